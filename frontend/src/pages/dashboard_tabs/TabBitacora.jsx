@@ -159,19 +159,9 @@ export default function TabBitacora({ boatId }) {
       setSelectedRoute(route);
       setPlaying(false);
 
-      // Cargar puntos de la ruta
-      // Nota: Si tu API ya devuelve los puntos en la lista, úsalos. Si no, fetch.
-      // Asumimos que hay un endpoint detail
-      let points = route.points;
-      if (!points || points.length === 0) {
-          // Si no vinieron en la lista, pedir detalle
-          // Ajusta esta URL a tu API real si existe endpoint de detalle
-          // const detail = await apiFetch(`/boats/${boatId}/bitacora/${route.id}/`);
-          // points = detail.points;
-      }
-
-      // IMPORTANTE: navigationRouteViewSet en views.py devuelve 'points' en el serializador?
-      // Si el NavigationRouteSerializer tiene 'points', ya los tenemos.
+      // La lista solo trae el resumen; los puntos vienen del detalle
+      const detail = await apiFetch(`/boats/${boatId}/bitacora/${route.id}/`);
+      let points = detail?.points;
       if(!points) points = []; // Fallback
 
       setHistoricPoints(points);
@@ -202,17 +192,19 @@ export default function TabBitacora({ boatId }) {
         }
       });
 
-      // 2. Guardar Puntos (En lotes o uno a uno, aquí uno a uno por simplicidad, idealmente bulk)
-      for (const p of livePoints) {
-        await apiFetch(`/navigation/route/${routeData.id}/point/`, {
+      // 2. Guardar Puntos en lotes (endpoint bulk)
+      const BATCH_SIZE = 500;
+      for (let i = 0; i < livePoints.length; i += BATCH_SIZE) {
+        const batch = livePoints.slice(i, i + BATCH_SIZE).map((p) => ({
+          lat: p.lat,
+          lng: p.lng,
+          speed: p.speed || 0,
+          type: p.type || 'gps',
+          recorded_at: new Date(p.timestamp).toISOString()
+        }));
+        await apiFetch(`/navigation/route/${routeData.id}/point/bulk/`, {
           method: "POST",
-          body: {
-            lat: p.lat,
-            lng: p.lng,
-            speed: p.speed || 0,
-            type: p.type || 'gps',
-            recorded_at: new Date(p.timestamp).toISOString()
-          }
+          body: { points: batch }
         });
       }
 
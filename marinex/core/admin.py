@@ -13,7 +13,7 @@ from .models import (
     DocumentCategory, DocumentPeriodization, DocumentStatus, Document,
     TaskCategory, WorkCategory, WorkStatus, TaskStatus, Work, Task,
     WorkMaterial,
-    NavigationRoute, NavigationPoint, AccountCompany
+    NavigationRoute, NavigationPoint, AccountCompany, DocumentAIJob
 )
 
 
@@ -592,7 +592,7 @@ class WorkMaterialAdmin(AuditAdminMixin, ImportExportModelAdmin):
 @admin.register(NavigationRoute)
 class NavigationRouteAdmin(SoftDeleteAdminMixin, ImportExportModelAdmin):
     resource_class = NavigationRouteResource
-    list_display = ("name", "boat", "account", "start_time", "end_time", "deleted_at")
+    list_display = ("name", "boat", "account", "start_time", "end_time", "archived_at", "deleted_at")
     list_filter = ("boat", "account")
     search_fields = ("name", "boat__name")
     raw_id_fields = ("account", "boat")
@@ -608,6 +608,14 @@ class NavigationPointAdmin(admin.ModelAdmin):
     list_select_related = ("route",)
 
 
+@admin.register(DocumentAIJob)
+class DocumentAIJobAdmin(AuditAdminMixin):
+    list_display = ("id", "status", "attempts", "run_after", "locked_by", "created_by", "created_at")
+    list_filter = ("status",)
+    readonly_fields = AuditAdminMixin.readonly_fields + ("result", "error", "locked_by", "locked_at")
+    raw_id_fields = ("created_by", "updated_by")
+
+
 admin.site.site_header = "Admin Marinex"
 admin.site.site_title = "Admin"
 admin.site.index_title = "Panel Admin"
\ No newline at end of file
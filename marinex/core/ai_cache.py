@@ -0,0 +1,106 @@
+# core/ai_cache.py
+"""
+Result cache for document AI analysis, stored in the DocumentAIResultCache table.
+
+Key = sha256(file bytes) + hash of the category tree + PROMPT_VERSION + the
+configured client and model, so the same PDF uploaded again (another boat, a
+retry) is answered without calling the model, while any change to the
+categories, the prompt or the model misses.
+Entries expire after DOCUMENT_AI_CACHE_TTL_S; above DOCUMENT_AI_CACHE_MAX_ENTRIES
+the least recently used ones are evicted.
+
+stats(): "process" hits/misses are only this worker's (every gunicorn worker
+has its own, and they reset on restart); total_hits is summed over the stored
+entries and is the figure that covers all workers.
+"""
+import hashlib
+import os
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import DocumentAIResultCache
+
+DEFAULT_TTL_S = 60 * 60 * 24 * 30
+DEFAULT_MAX_ENTRIES = 5000
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def result_key(file_hash, catalog_digest, prompt_version, model):
+    return hashlib.sha256(f"{file_hash}:{catalog_digest}:{prompt_version}:{model}".encode()).hexdigest()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_result(key):
+    ttl = getattr(settings, "DOCUMENT_AI_CACHE_TTL_S", DEFAULT_TTL_S)
+    entry = DocumentAIResultCache.objects.filter(key=key).only("result", "created_at").first()
+    if entry is None or entry.created_at < timezone.now() - timedelta(seconds=ttl):
+        _count("misses")
+        return None
+
+    DocumentAIResultCache.objects.filter(key=key).update(hits=F("hits") + 1, last_used_at=timezone.now())
+    _count("hits")
+    return entry.result
+
+
+def put_result(key, file_hash, result):
+    DocumentAIResultCache.objects.update_or_create(
+        key=key,
+        defaults={
+            "file_sha256": file_hash,
+            "result": result,
+            "created_at": timezone.now(),
+            "last_used_at": timezone.now(),
+        },
+    )
+    evict()
+
+
+def evict():
+    ttl = getattr(settings, "DOCUMENT_AI_CACHE_TTL_S", DEFAULT_TTL_S)
+    max_entries = getattr(settings, "DOCUMENT_AI_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+
+    DocumentAIResultCache.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=ttl)).delete()
+
+    # LRU: всё, что старше max_entries-го по последнему использованию
+    boundary = (
+        DocumentAIResultCache.objects.order_by("-last_used_at")
+        .values_list("last_used_at", flat=True)[max_entries:max_entries + 1]
+    )
+    boundary = list(boundary)
+    if boundary:
+        DocumentAIResultCache.objects.filter(last_used_at__lte=boundary[0]).delete()
+
+
+def stats():
+    with _stats_lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    totals = DocumentAIResultCache.objects.aggregate(total_hits=Sum("hits"))
+    return {
+        "process": {
+            "pid": os.getpid(),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else None,
+        },
+        "entries": DocumentAIResultCache.objects.count(),
+        "total_hits": totals["total_hits"] or 0,
+    }
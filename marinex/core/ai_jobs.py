@@ -0,0 +1,158 @@
+# core/ai_jobs.py
+"""
+Background queue for document AI analysis, backed by the DocumentAIJob table
+(no external broker; works on SQLite and PostgreSQL).
+
+POST /api/ai/jobs/ stores the upload as a pending job; workers started with
+`manage.py run_ai_worker` claim jobs with a compare-and-swap UPDATE, run
+document_ai.analyze_document() and store the cleaned result. Failed attempts
+are retried with exponential backoff; jobs whose worker died are reclaimed
+after DOCUMENT_AI_JOB_STALE_S (or failed, if that was their last attempt).
+
+An outcome is written only while the worker still owns the job (same
+locked_by and attempt), so a reclaimed job is not overwritten by the worker
+that was presumed dead. The uploaded file is deleted once the job is done or
+has finally failed.
+"""
+import logging
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import document_ai
+from .models import DocumentAIJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF_S = 30
+DEFAULT_MAX_BACKOFF_S = 60 * 30
+DEFAULT_STALE_S = 60 * 10
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def submit_job(uploaded, user=None):
+    return DocumentAIJob.objects.create(
+        file=uploaded,
+        mime_type=uploaded.content_type or "application/octet-stream",
+        max_attempts=_setting("DOCUMENT_AI_JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS),
+        created_by=user,
+        updated_by=user,
+    )
+
+
+def claim_job(worker_id):
+    """
+    Takes the oldest runnable job for this worker, or returns None.
+    The status check in the UPDATE makes the claim safe between workers.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=_setting("DOCUMENT_AI_JOB_STALE_S", DEFAULT_STALE_S))
+    _fail_abandoned(stale_before)
+    runnable = (
+        Q(status=DocumentAIJob.STATUS_PENDING, run_after__lte=now)
+        | Q(status=DocumentAIJob.STATUS_RUNNING, locked_at__lt=stale_before, attempts__lt=F("max_attempts"))
+    )
+
+    for job_id, status in (
+        DocumentAIJob.objects.filter(runnable).order_by("run_after").values_list("id", "status")[:10]
+    ):
+        claimed = DocumentAIJob.objects.filter(id=job_id, status=status).filter(runnable).update(
+            status=DocumentAIJob.STATUS_RUNNING,
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return DocumentAIJob.objects.get(id=job_id)
+    return None
+
+
+def _fail_abandoned(stale_before):
+    # Воркер умер на последней попытке: такое задание не перезапускается, а завершается ошибкой
+    abandoned = DocumentAIJob.objects.filter(
+        status=DocumentAIJob.STATUS_RUNNING, locked_at__lt=stale_before, attempts__gte=F("max_attempts")
+    ).only("id", "file", "attempts", "max_attempts", "locked_by")
+    for job in abandoned:
+        error = f"Worker stopped responding (attempt {job.attempts} of {job.max_attempts})"
+        if _finish(job, status=DocumentAIJob.STATUS_FAILED, error=error):
+            logger.warning("AI job %s failed after %d attempts: %s", job.id, job.attempts, error)
+
+
+def backoff_seconds(attempts):
+    base = _setting("DOCUMENT_AI_JOB_BACKOFF_S", DEFAULT_BACKOFF_S)
+    return min(base * 2 ** max(attempts - 1, 0), DEFAULT_MAX_BACKOFF_S)
+
+
+def run_job(job):
+    tmp_path = None
+    try:
+        # Клиент модели работает с путём к файлу; storage может быть не локальным
+        with job.file.open("rb") as src, tempfile.NamedTemporaryFile(delete=False) as tmp:
+            shutil.copyfileobj(src, tmp)
+            tmp_path = tmp.name
+        result = document_ai.analyze_document(tmp_path, job.mime_type)
+    except Exception as e:
+        _fail(job, e)
+        return job
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+
+    _finish(job, status=DocumentAIJob.STATUS_DONE, result=result, error="")
+    return job
+
+
+def _fail(job, exc):
+    if isinstance(exc, document_ai.DocumentAIError):
+        error = f"AI returned invalid JSON: {exc}"
+    else:
+        error = f"{exc.__class__.__name__}: {exc}"
+
+    if job.attempts >= job.max_attempts:
+        if _finish(job, status=DocumentAIJob.STATUS_FAILED, error=error):
+            logger.warning("AI job %s failed after %d attempts: %s", job.id, job.attempts, error)
+        return
+
+    run_after = timezone.now() + timedelta(seconds=backoff_seconds(job.attempts))
+    if _save_owned(job, status=DocumentAIJob.STATUS_PENDING, error=error, locked_by="", run_after=run_after):
+        logger.info("AI job %s attempt %d failed, retry at %s: %s", job.id, job.attempts, run_after, error)
+
+
+def _save_owned(job, **fields):
+    """
+    Writes fields only if the job is still this worker's attempt; returns whether it did.
+    """
+    fields["updated_at"] = timezone.now()
+    saved = DocumentAIJob.objects.filter(
+        id=job.id, status=DocumentAIJob.STATUS_RUNNING, locked_by=job.locked_by, attempts=job.attempts
+    ).update(**fields)
+    if not saved:
+        # Задание уже забрал другой воркер (считал этот умершим): его исход главнее
+        logger.warning("AI job %s was reclaimed, outcome of attempt %d dropped", job.id, job.attempts)
+        return False
+    for name, value in fields.items():
+        setattr(job, name, value)
+    return True
+
+
+def _finish(job, **fields):
+    # Окончательный исход: загруженный файл больше не нужен
+    name = job.file.name
+    if not _save_owned(job, locked_by="", file="", **fields):
+        return False
+    if name:
+        try:
+            job.file.storage.delete(name)
+        except OSError:
+            logger.warning("AI job %s: could not delete upload %s", job.id, name, exc_info=True)
+    return True
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.core import checks
+
+        from . import db_router, metrics, signals, sqlite  # noqa: F401
+
+        checks.register(db_router.check_sticky_cache, checks.Tags.caches)
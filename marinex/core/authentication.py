@@ -0,0 +1,121 @@
+# core/authentication.py
+"""
+JWT with account memberships in the claims.
+
+Tokens carry the user's (account_id, role) pairs and User.membership_version
+("mv"). For safe methods ClaimsJWTAuthentication builds a ClaimsUser from the
+claims; the only query is a primary-key lookup of is_active and
+membership_version, instead of loading the user and the memberships. Writes
+load the real User. Both are rejected if the user was deactivated or the
+memberships changed after the token was issued (the client refreshes the
+token, which re-reads them from the database). membership_version is bumped
+by the UserAccount signals and by UserAccountQuerySet for bulk update(),
+delete() and bulk_create(), which skip the signals.
+"""
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from rest_framework import permissions
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .memberships import Memberships, load_memberships
+
+ACCOUNTS_CLAIM = "accounts"
+VERSION_CLAIM = "mv"
+
+
+def add_membership_claims(token, user):
+    memberships = load_memberships(user)
+    token[ACCOUNTS_CLAIM] = [[str(account_id), role] for account_id, role in memberships.rows]
+    token[VERSION_CLAIM] = user.membership_version
+    token["username"] = user.username
+    token["is_staff"] = user.is_staff
+    token["is_superuser"] = user.is_superuser
+    return token
+
+
+class MarinexTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return add_membership_claims(super().get_token(user), user)
+
+
+class MarinexTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        # Новый access-токен получает актуальные членства из БД, а не копию старых claims
+        refresh = self.token_class(attrs["refresh"])
+        user = get_user_model().objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+
+        add_membership_claims(refresh, user)
+        attrs["refresh"] = str(refresh)
+        return super().validate(attrs)
+
+
+class ClaimsUser(TokenUser):
+    """
+    Stateless user built from token claims. Only what is in the token is
+    available; views that need other fields (email, names...) load the User.
+    """
+
+    @cached_property
+    def id(self):
+        return uuid.UUID(str(self.token[api_settings.USER_ID_CLAIM]))
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def membership_version(self):
+        return self.token[VERSION_CLAIM]
+
+    @cached_property
+    def token_memberships(self):
+        return Memberships([(uuid.UUID(account_id), role) for account_id, role in self.token[ACCOUNTS_CLAIM]])
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        if request.method in permissions.SAFE_METHODS:
+            return self.get_claims_user(validated_token), validated_token
+
+        user = self.get_user(validated_token)
+        if VERSION_CLAIM in validated_token:
+            self.check_membership_version(validated_token, user.membership_version)
+        return user, validated_token
+
+    @staticmethod
+    def check_membership_version(validated_token, membership_version):
+        if validated_token[VERSION_CLAIM] != membership_version:
+            raise AuthenticationFailed("Account memberships changed, refresh the token", code="membership_changed")
+
+    def get_claims_user(self, validated_token):
+        # Токены, выданные до появления claims, проверяются по БД как раньше
+        if VERSION_CLAIM not in validated_token or ACCOUNTS_CLAIM not in validated_token:
+            return self.get_user(validated_token)
+
+        user = ClaimsUser(validated_token)
+        state = get_user_model().objects.filter(pk=user.pk).values_list("is_active", "membership_version").first()
+        if state is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if not state[0]:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        self.check_membership_version(validated_token, state[1])
+        return user
@@ -0,0 +1,135 @@
+# core/db_router.py
+"""
+Read-replica routing (settings.DATABASE_REPLICAS, configured from MARINEX_DB_REPLICAS).
+
+Writes always go to "default". Reads go to a random replica only inside a
+safe-method request (GET/HEAD/OPTIONS) set up by
+core.middleware.DatabaseRoutingMiddleware; everything else - writes, admin,
+management commands, background workers, reads inside a transaction - stays
+on the primary. After a user writes, their reads stick to the primary for
+DATABASE_STICKY_PRIMARY_S seconds (read-your-writes).
+
+The sticky marker is a signed cookie on the write's response, so it works
+whichever worker serves the next request. It is also put in the Django cache
+for clients that do not keep cookies; that only helps if the cache is shared
+by all workers (system check core.W001 warns about a process-local one).
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import SimpleLazyObject, empty
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+STICKY_COOKIE = "marinex_primary"
+STICKY_SALT = "core.db_router.sticky"
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+_routing = ContextVar("marinex_db_routing", default=None)
+
+
+def _sticky_key(user_id):
+    return f"db:primary:{user_id}"
+
+
+def _sticky_window():
+    return getattr(settings, "DATABASE_STICKY_PRIMARY_S", 5)
+
+
+def _has_sticky_cookie(request, user):
+    # Подпись с меткой времени: max_age проверяется на сервере, подделать или продлить нельзя
+    value = request.get_signed_cookie(STICKY_COOKIE, default=None, salt=STICKY_SALT, max_age=_sticky_window())
+    return value == str(user.pk)
+
+
+def _resolved_user(request):
+    # Не вычисляем ленивого request.user: это само по себе запрос в БД (сессия)
+    user = request.__dict__.get("user")
+    if user is None or (isinstance(user, SimpleLazyObject) and user._wrapped is empty):
+        return None
+    return user if user.is_authenticated else None
+
+
+class RequestRouting:
+    def __init__(self, request):
+        self.request = request
+        self.use_primary = (
+            request.method not in SAFE_METHODS
+            or request.path.startswith(tuple(getattr(settings, "DATABASE_PRIMARY_PATHS", ())))
+        )
+        self.sticky_checked = False
+
+    def read_from_primary(self):
+        if self.use_primary:
+            return True
+        if not self.sticky_checked:
+            # JWT проверяется во view (DRF), поэтому пользователь появляется не сразу
+            user = _resolved_user(self.request)
+            if user is not None:
+                self.sticky_checked = True
+                self.use_primary = _has_sticky_cookie(self.request, user) or bool(cache.get(_sticky_key(user.pk)))
+        return self.use_primary
+
+
+def begin_request(request):
+    return _routing.set(RequestRouting(request))
+
+
+def end_request(token):
+    _routing.reset(token)
+
+
+def mark_write(request, response=None):
+    if request.method in SAFE_METHODS or not getattr(settings, "DATABASE_REPLICAS", []):
+        return
+    window = _sticky_window()
+    user = _resolved_user(request)
+    if user is None or not window:
+        return
+    cache.set(_sticky_key(user.pk), True, window)
+    if response is not None:
+        response.set_signed_cookie(
+            STICKY_COOKIE, str(user.pk), salt=STICKY_SALT, max_age=window,
+            httponly=True, samesite="Lax", secure=request.is_secure(),
+        )
+
+
+def check_sticky_cache(app_configs, **kwargs):
+    if not getattr(settings, "DATABASE_REPLICAS", []):
+        return []
+    if settings.CACHES["default"]["BACKEND"] not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [checks.Warning(
+        "DATABASE_REPLICAS is set but the default cache is local to each process.",
+        hint="Clients that do not keep the sticky cookie will not read their own writes. "
+             "Configure a cache shared by all workers (Redis, Memcached, database cache).",
+        id="core.W001",
+    )]
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        routing = _routing.get()
+        if not replicas or routing is None or routing.read_from_primary():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,319 @@
+# core/document_ai.py
+"""
+Document analysis with a generative model: prompt, model client and
+normalization of the answer into the JSON returned by /api/ai/analyze-document/.
+
+The client is pluggable (settings.DOCUMENT_AI_CLIENT, dotted path):
+  * GeminiDocumentAIClient - Google Gemini (default).
+  * FakeDocumentAIClient   - local, no network; for tests and development.
+A client has analyze(path, mime_type, prompt) -> raw model text. Clients are
+created on first use, so google.generativeai is only imported by a process
+that actually analyzes a document.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLIENT = "core.document_ai.GeminiDocumentAIClient"
+DEFAULT_MODEL = "gemini-2.5-pro"
+
+# Меняйте при правке промпта: кэш результатов (core/ai_cache.py) зависит от версии
+PROMPT_VERSION = 2
+
+
+class DocumentAIError(Exception):
+    def __init__(self, message, raw=None):
+        super().__init__(message)
+        self.raw = raw
+
+
+# -------------------------
+# Category catalog
+# -------------------------
+CATALOG_VERSION_KEY = "document_ai:catalog_version"
+
+
+class CategoryCatalog:
+    """
+    Compact category tree for the prompt: [[short_id, name, [children...]], ...]
+    (leaves are [short_id, name]) without whitespace; short ids map back to
+    DocumentCategory UUIDs.
+    """
+
+    def __init__(self, categories):
+        # categories: [(id, name, parent_id, level), ...] ordered by level, name
+        self.by_short_id = {}
+        nodes = {}
+        roots = []
+        for index, (category_id, name, parent_id, _) in enumerate(categories, start=1):
+            short_id = str(index)
+            self.by_short_id[short_id] = str(category_id)
+            nodes[category_id] = [short_id, name, []]
+        for category_id, _, parent_id, _ in categories:
+            parent = nodes.get(parent_id)
+            (parent[2] if parent else roots).append(nodes[category_id])
+
+        for node in nodes.values():
+            if not node[2]:
+                node.pop()  # лист: [id, name]
+        self.text = json.dumps(roots, ensure_ascii=False, separators=(",", ":"))
+        self.digest = hashlib.sha256(self.text.encode() + json.dumps(self.by_short_id).encode()).hexdigest()
+        self.uuids = set(self.by_short_id.values())
+
+        # Для сравнения: прежний формат (плоский список, json с indent=2)
+        self.legacy_size = len(json.dumps([
+            {"id": str(c[0]), "name": c[1], "parent": str(c[2]) if c[2] else None, "level": c[3]}
+            for c in categories
+        ], indent=2))
+
+    def resolve(self, value):
+        if not value:
+            return None
+        value = str(value)
+        if value in self.by_short_id:
+            return self.by_short_id[value]
+        return value if value in self.uuids else None
+
+
+DEFAULT_CATALOG_CHECK_S = 30
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def _catalog_db_version():
+    # Любая правка категории через save() двигает max(updated_at), удаление — count
+    from .models import DocumentCategory
+
+    state = DocumentCategory.objects.aggregate(count=Count("id"), updated=Max("updated_at"))
+    return state["count"], state["updated"]
+
+
+def get_catalog():
+    """
+    Catalog built once per process. Changes made by this process rebuild it on
+    the next call (core/signals.py bumps the version in the local cache); changes
+    made by other workers are picked up by a DB check of the category count and
+    max(updated_at), done at most every DOCUMENT_AI_CATALOG_CHECK_S seconds.
+    """
+    global _catalog
+    local_version = cache.get(CATALOG_VERSION_KEY, 0)
+    check_s = getattr(settings, "DOCUMENT_AI_CATALOG_CHECK_S", DEFAULT_CATALOG_CHECK_S)
+    catalog = _catalog
+    if catalog is not None and catalog["local"] == local_version and time.monotonic() < catalog["check_at"]:
+        return catalog["built"]
+
+    with _catalog_lock:
+        db_version = _catalog_db_version()
+        catalog = _catalog
+        if catalog is not None and catalog["local"] == local_version and catalog["db"] == db_version:
+            catalog["check_at"] = time.monotonic() + check_s
+            return catalog["built"]
+
+        from .models import DocumentCategory
+
+        rows = list(DocumentCategory.objects.order_by("level", "name").values_list("id", "name", "parent_id", "level"))
+        built = CategoryCatalog(rows)
+        _catalog = {"local": local_version, "db": db_version, "check_at": time.monotonic() + check_s, "built": built}
+
+    prompt_size = len(build_prompt(built))
+    logger.info(
+        "Document AI catalog: %d categories, %d chars (was %d); prompt %d chars",
+        len(rows), len(built.text), built.legacy_size, prompt_size,
+    )
+    return built
+
+
+def invalidate_catalog():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, 1, None)
+
+
+def catalog_sizes():
+    catalog = get_catalog()
+    return {
+        "categories": len(catalog.by_short_id),
+        "catalog_chars": len(catalog.text),
+        "legacy_catalog_chars": catalog.legacy_size,
+        "prompt_chars": len(build_prompt(catalog)),
+    }
+
+
+# -------------------------
+# Prompt
+# -------------------------
+def build_prompt(catalog):
+    return f"""
+            Eres un asistente experto en documentación náutica.
+
+            Categorías como árbol JSON compacto: [id, nombre, [subcategorías]] (sin subcategorías: [id, nombre])
+
+            {catalog.text}
+
+            Debes ANALIZAR el documento adjunto y devolver SIEMPRE un JSON válido:
+
+            {{
+              "name": "string",
+              "category_id": "id" o null,
+              "subcategory_id": "id" o null,
+              "expiration_date": "YYYY-MM-DD" o null,
+              "no_expiration": true o false,
+              "notes": "string"
+            }}
+
+            REGLAS SOBRE EL NOMBRE:
+            - El nombre debe ser corto y genérico (por ejemplo: "Seguro de Responsabilidad Civil").
+            - NO incluyas números, códigos, pólizas ni fechas en el nombre.
+
+            REGLAS SOBRE CATEGORÍAS:
+            - category_id = id de una categoría raíz del árbol
+            - subcategory_id = id de una subcategoría de esa categoría
+
+            REGLAS SOBRE FECHAS (MUY IMPORTANTE):
+            - Las fechas dentro del documento están SIEMPRE en formato español: **DD/MM/YYYY**.
+            - NO interpretes nunca las fechas como formato americano **MM/DD/YYYY**.
+            - Si lees por ejemplo "15/01/2028", significa **15 de enero de 2028**, NO diciembre.
+            - Debes convertir la fecha encontrada a formato ISO: "YYYY-MM-DD".
+            - NO reordenes ni intercambies día y mes bajo ninguna circunstancia.
+
+            REGLAS GENERALES:
+            - NO uses ```json ni bloques de código.
+            - Devuelve SOLO un JSON limpio, sin texto adicional.
+            """
+
+
+# -------------------------
+# Answer
+# -------------------------
+def clean_response(raw, catalog):
+    raw = raw.strip()
+
+    # Remove ```json fences if AI returns them
+    if raw.startswith("```"):
+        raw = raw.replace("```json", "")
+        raw = raw.replace("```", "")
+        raw = raw.strip()
+
+    try:
+        data = json.loads(raw)
+    except Exception as e:
+        raise DocumentAIError(str(e), raw=raw)
+
+    return {
+        "name": data.get("name", ""),
+        # Короткие id из промпта -> UUID категорий
+        "category_id": catalog.resolve(data.get("category_id")),
+        "subcategory_id": catalog.resolve(data.get("subcategory_id")),
+        "expiration_date": data.get("expiration_date"),
+        "no_expiration": bool(data.get("no_expiration", False)),
+        "notes": data.get("notes", "")
+    }
+
+
+# -------------------------
+# Clients
+# -------------------------
+class GeminiDocumentAIClient:
+    def __init__(self):
+        # Тяжёлый импорт (gRPC/protobuf): только при первом анализе, не при старте воркера
+        import google.generativeai as genai
+
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        self.genai = genai
+        self.model = genai.GenerativeModel(getattr(settings, "DOCUMENT_AI_MODEL", DEFAULT_MODEL))
+
+    def analyze(self, path, mime_type, prompt):
+        file_obj = self.genai.upload_file(path, mime_type=mime_type)
+        response = self.model.generate_content([prompt, file_obj])
+        return response.text
+
+
+class FakeDocumentAIClient:
+    """
+    Answers without a model: settings.DOCUMENT_AI_FAKE_RESPONSE (dict) or a fixed document.
+    """
+
+    def analyze(self, path, mime_type, prompt):
+        delay = getattr(settings, "DOCUMENT_AI_FAKE_DELAY_S", 0)
+        if delay:
+            threading.Event().wait(delay)
+        response = getattr(settings, "DOCUMENT_AI_FAKE_RESPONSE", None) or {
+            "name": "Documento",
+            "category_id": None,
+            "subcategory_id": None,
+            "expiration_date": None,
+            "no_expiration": True,
+            "notes": "",
+        }
+        return json.dumps(response)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    # По пути из настроек, чтобы override_settings в тестах подменял клиента
+    path = getattr(settings, "DOCUMENT_AI_CLIENT", DEFAULT_CLIENT)
+    if path not in _clients:
+        with _clients_lock:
+            if path not in _clients:
+                _clients[path] = import_string(path)()
+    return _clients[path]
+
+
+def model_signature():
+    # Другой клиент или модель отвечают по-другому: их результаты в кэше не смешиваются
+    client = getattr(settings, "DOCUMENT_AI_CLIENT", DEFAULT_CLIENT)
+    return f"{client}:{getattr(settings, 'DOCUMENT_AI_MODEL', DEFAULT_MODEL)}"
+
+
+class PreparedAnalysis:
+    def __init__(self, file_hash, cache_key, catalog, cached):
+        self.file_hash = file_hash
+        self.cache_key = cache_key
+        self.catalog = catalog
+        self.prompt = build_prompt(catalog)
+        self.cached = cached
+
+
+def prepare_analysis(path):
+    """
+    Hashes the file, builds the prompt and looks the result up in the cache.
+    """
+    from . import ai_cache
+
+    catalog = get_catalog()
+    file_hash = ai_cache.file_sha256(path)
+    cache_key = ai_cache.result_key(file_hash, catalog.digest, PROMPT_VERSION, model_signature())
+    return PreparedAnalysis(file_hash, cache_key, catalog, ai_cache.get_result(cache_key))
+
+
+def store_result(prepared, result):
+    from . import ai_cache
+    ai_cache.put_result(prepared.cache_key, prepared.file_hash, result)
+
+
+def analyze_document(path, mime_type):
+    """
+    Blocking: returns the cleaned dict from the cache or from the model.
+    Raises DocumentAIError if the model did not answer with JSON.
+    """
+    prepared = prepare_analysis(path)
+    if prepared.cached is not None:
+        return prepared.cached
+
+    result = clean_response(get_client().analyze(path, mime_type, prepared.prompt), prepared.catalog)
+    store_result(prepared, result)
+    return result
@@ -0,0 +1,110 @@
+# core/geohash.py
+"""
+Geohash encoding and bbox covering, used as a spatial index for NavigationPoint.
+
+A bbox is covered by a small set of geohash prefixes; each prefix becomes an
+index range scan (geohash >= prefix AND geohash < successor), so the cost of a
+query depends on the area asked for, not on the size of the table.
+"""
+import math
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 9  # ~4.8 x 4.8 m
+
+MAX_COVER_CELLS = 32
+
+
+def encode(lat, lng, precision=PRECISION):
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                value = (value << 1) | 1
+                lng_lo = mid
+            else:
+                value <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_lo = mid
+            else:
+                value <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """
+    (lat_height, lng_width) in degrees of a cell at the given precision.
+    """
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def successor(prefix):
+    """
+    Smallest string greater than every geohash starting with prefix (None if unbounded).
+    """
+    while prefix:
+        index = BASE32.index(prefix[-1])
+        if index < len(BASE32) - 1:
+            return prefix[:-1] + BASE32[index + 1]
+        prefix = prefix[:-1]
+    return None
+
+
+def _cells(min_lat, min_lng, max_lat, max_lng, precision):
+    height, width = cell_size(precision)
+    lat_from = math.floor((min_lat + 90) / height)
+    lat_to = math.floor((min(max_lat, 89.999999) + 90) / height)
+    lng_from = math.floor((min_lng + 180) / width)
+    lng_to = math.floor((min(max_lng, 179.999999) + 180) / width)
+    return lat_from, lat_to, lng_from, lng_to
+
+
+def cover(min_lat, min_lng, max_lat, max_lng, max_cells=MAX_COVER_CELLS):
+    """
+    Sorted, merged [start, end) geohash ranges covering the bbox.
+    end is None when the range is open-ended.
+    """
+    precision = 1
+    for candidate in range(1, PRECISION + 1):
+        lat_from, lat_to, lng_from, lng_to = _cells(min_lat, min_lng, max_lat, max_lng, candidate)
+        if (lat_to - lat_from + 1) * (lng_to - lng_from + 1) > max_cells:
+            break
+        precision = candidate
+
+    height, width = cell_size(precision)
+    lat_from, lat_to, lng_from, lng_to = _cells(min_lat, min_lng, max_lat, max_lng, precision)
+    prefixes = sorted({
+        encode(-90 + (i + 0.5) * height, -180 + (j + 0.5) * width, precision)
+        for i in range(lat_from, lat_to + 1)
+        for j in range(lng_from, lng_to + 1)
+    })
+
+    ranges = []
+    for prefix in prefixes:
+        end = successor(prefix)
+        if ranges and ranges[-1][1] == prefix:
+            ranges[-1][1] = end
+        else:
+            ranges.append([prefix, end])
+    return [tuple(r) for r in ranges]
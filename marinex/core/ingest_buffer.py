@@ -0,0 +1,446 @@
+# core/ingest_buffer.py
+"""
+Optional write-behind buffer for GPS ingest (settings.NAVIGATION_INGEST_BUFFER).
+
+Points are validated by the view, put into a bounded in-process queue and
+acknowledged right away (202). A background flusher commits them through
+navigation.record_points() in batched transactions every FLUSH_INTERVAL_MS
+or FLUSH_MAX_POINTS, whichever comes first, so SQLite sees a few large write
+transactions instead of one per fix.
+
+Durability:
+  * "memory" - queued points are lost if the process dies.
+  * "spool"  - every accepted batch is appended to a per-process spool file
+               before it is acknowledged; "fsync" additionally fsyncs it.
+Spool files left behind by dead processes are replayed on startup; points
+that were already committed are skipped by id. A spool is removed only once
+its replay committed everything, otherwise it is retried on the next start.
+
+A failed commit does not drop points: they go back to the queue after an
+exponential backoff (RETRY_BASE_MS .. RETRY_MAX_MS). After MAX_ATTEMPTS they
+are appended to <spool>.failed for manual replay; points for a route that was
+archived meanwhile (navigation.RouteArchived) go there at once, since no
+retry can commit them. The spool checkpoint only
+advances past a submit() once every point of it is committed, even when a
+flush batch (FLUSH_MAX_POINTS) splits it.
+"""
+import atexit
+import glob
+import heapq
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from .navigation import RouteArchived
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировок spool-файлов
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "ENABLED": False,
+    "FLUSH_INTERVAL_MS": 500,
+    "FLUSH_MAX_POINTS": 500,
+    "MAX_QUEUE_POINTS": 20000,
+    "DURABILITY": "spool",
+    "SPOOL_DIR": None,
+    "RETRY_BASE_MS": 500,
+    "RETRY_MAX_MS": 30000,
+    "MAX_ATTEMPTS": 10,
+}
+
+
+class BufferFull(Exception):
+    pass
+
+
+def buffer_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "NAVIGATION_INGEST_BUFFER", {}) or {})
+    if not config["SPOOL_DIR"]:
+        config["SPOOL_DIR"] = os.path.join(settings.BASE_DIR, "spool")
+    return config
+
+
+def is_enabled():
+    return bool(buffer_settings()["ENABLED"])
+
+
+def _encode_point(point):
+    return {
+        "id": str(point["id"]),
+        "lat": point["lat"],
+        "lng": point["lng"],
+        "speed": point.get("speed"),
+        "type": point.get("type", "gps"),
+        "recorded_at": point["recorded_at"].isoformat(),
+    }
+
+
+class PointBuffer:
+    def __init__(self, config):
+        self.flush_interval = config["FLUSH_INTERVAL_MS"] / 1000
+        self.flush_max_points = config["FLUSH_MAX_POINTS"]
+        self.max_points = config["MAX_QUEUE_POINTS"]
+        self.durability = config["DURABILITY"]
+        self.spool_dir = config["SPOOL_DIR"]
+        self.retry_base = config["RETRY_BASE_MS"] / 1000
+        self.retry_max = config["RETRY_MAX_MS"] / 1000
+        self.max_attempts = config["MAX_ATTEMPTS"]
+
+        # Элемент очереди: (seq, enqueued_at, route_id, point, attempts)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.spool = None
+        self.spool_path = None
+        # seq -> сколько точек этого submit() ещё не закоммичено
+        self.pending = {}
+        self.outstanding = 0
+        # Куча (когда повторить, номер, элементы) для неудавшихся коммитов
+        self.retries = []
+        self.retry_counter = 0
+
+        self.metrics_lock = threading.Lock()
+        self.accepted_total = 0
+        self.committed_total = 0
+        self.failed_total = 0
+        self.retried_total = 0
+        self.flushes_total = 0
+        self.last_flush_points = 0
+        self.latency_count = 0
+        self.latency_sum_ms = 0.0
+        self.latency_max_ms = 0.0
+        self.latency_last_ms = None
+
+        if self.durability in ("spool", "fsync"):
+            self._open_spool()
+
+        self.thread = threading.Thread(target=self._run, name="navigation-ingest-flusher", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    # -------------------------
+    # Accepting points
+    # -------------------------
+    def submit(self, route_id, points):
+        """
+        points: validated dicts (lat, lng, speed, type, recorded_at). Returns their ids.
+        """
+        with self.lock:
+            if self.outstanding + len(points) > self.max_points:
+                raise BufferFull()
+
+            encoded = [_encode_point(dict(p, id=p.get("id") or uuid.uuid4())) for p in points]
+            self.seq += 1
+            if self.spool:
+                self._spool_write({"seq": self.seq, "route": str(route_id), "points": encoded})
+
+            enqueued_at = time.monotonic()
+            self.pending[self.seq] = len(encoded)
+            self.outstanding += len(encoded)
+            for point in encoded:
+                self.queue.put((self.seq, enqueued_at, str(route_id), point, 0))
+
+        with self.metrics_lock:
+            self.accepted_total += len(encoded)
+        return [p["id"] for p in encoded]
+
+    # -------------------------
+    # Flusher
+    # -------------------------
+    def _run(self):
+        self._replay_orphans()
+        while True:
+            self._requeue_due()
+            batch = self._drain()
+            if batch:
+                self._flush(batch)
+
+    def _drain(self):
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_max_points:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch, replay=False):
+        """
+        Commits the batch route by route; returns the items that failed.
+        Outside replay, failed items are scheduled for a retry and the spool is checkpointed.
+        """
+        close_old_connections()
+        by_route = defaultdict(list)
+        for item in batch:
+            by_route[item[2]].append(item)
+
+        failed = []
+        for route_id, items in by_route.items():
+            # Повтор мог упасть уже после коммита: такие точки отсеиваем по id
+            dedupe = replay or any(item[4] for item in items)
+            try:
+                self._commit(route_id, [item[3] for item in items], dedupe)
+            except RouteArchived:
+                # Повтор не поможет: маршрут заархивировали, пока точки были в очереди
+                logger.error("Ingest buffer: route %s is archived, setting aside %d points", route_id, len(items))
+                self._set_aside(items)
+                if not replay:
+                    self._done(items)
+                continue
+            except Exception:
+                logger.exception("Ingest buffer: failed to commit %d points for route %s", len(items), route_id)
+                failed.extend(items)
+                continue
+
+            committed_at = time.monotonic()
+            with self.metrics_lock:
+                self.committed_total += len(items)
+                for item in items:
+                    latency = (committed_at - item[1]) * 1000 if item[1] else 0.0
+                    self.latency_count += 1
+                    self.latency_sum_ms += latency
+                    self.latency_max_ms = max(self.latency_max_ms, latency)
+                    self.latency_last_ms = latency
+            if not replay:
+                self._done(items)
+
+        with self.metrics_lock:
+            self.flushes_total += 1
+            self.last_flush_points = len(batch)
+        close_old_connections()
+
+        if not replay:
+            if failed:
+                self._retry(failed)
+            if self.spool:
+                self._checkpoint()
+        return failed
+
+    def _done(self, items):
+        with self.lock:
+            for item in items:
+                self.pending[item[0]] -= 1
+                if not self.pending[item[0]]:
+                    del self.pending[item[0]]
+            self.outstanding -= len(items)
+
+    def _retry(self, items):
+        by_attempts = defaultdict(list)
+        for seq, enqueued_at, route_id, point, attempts in items:
+            by_attempts[attempts + 1].append((seq, enqueued_at, route_id, point, attempts + 1))
+
+        now = time.monotonic()
+        for attempts, retry_items in by_attempts.items():
+            if attempts >= self.max_attempts:
+                self._give_up(retry_items)
+                continue
+            delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+            with self.lock:
+                self.retry_counter += 1
+                heapq.heappush(self.retries, (now + delay, self.retry_counter, retry_items))
+            with self.metrics_lock:
+                self.retried_total += len(retry_items)
+
+    def _give_up(self, items):
+        logger.error("Ingest buffer: dropping %d points after %d attempts", len(items), self.max_attempts)
+        self._set_aside(items)
+        self._done(items)
+
+    def _set_aside(self, items):
+        if self.spool:
+            # Из spool точки уйдут с чекпоинтом: сохраняем их отдельно для ручного разбора
+            with open(self.spool_path + ".failed", "a", encoding="utf-8") as f:
+                for seq, _, route_id, point, _ in items:
+                    f.write(json.dumps({"seq": seq, "route": route_id, "points": [point]}, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        with self.metrics_lock:
+            self.failed_total += len(items)
+
+    def _requeue_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            while self.retries and self.retries[0][0] <= now:
+                _, _, items = heapq.heappop(self.retries)
+                for item in items:
+                    self.queue.put(item)
+
+    @staticmethod
+    def _commit(route_id, encoded, dedupe):
+        from .models import NavigationPoint, NavigationRoute
+        from .navigation import record_points
+
+        route = NavigationRoute.all_objects.get(pk=route_id)
+        if dedupe:
+            existing = set(
+                str(pk) for pk in NavigationPoint.objects.filter(
+                    id__in=[p["id"] for p in encoded]
+                ).values_list("id", flat=True)
+            )
+            encoded = [p for p in encoded if p["id"] not in existing]
+
+        points = [
+            NavigationPoint(
+                id=uuid.UUID(p["id"]),
+                route=route,
+                lat=p["lat"],
+                lng=p["lng"],
+                speed=p["speed"],
+                type=p["type"],
+                recorded_at=parse_datetime(p["recorded_at"]),
+            )
+            for p in encoded
+        ]
+        record_points(route, points)
+
+    def flush(self):
+        """
+        Synchronously commits everything queued so far (shutdown hook, tests).
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._flush(batch)
+
+    # -------------------------
+    # Spool
+    # -------------------------
+    def _open_spool(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.spool_path = os.path.join(self.spool_dir, f"ingest-{os.getpid()}-{uuid.uuid4().hex[:8]}.spool")
+        self.spool = open(self.spool_path, "a", encoding="utf-8")
+        if fcntl:
+            fcntl.flock(self.spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _spool_write(self, record):
+        self.spool.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.spool.flush()
+        if self.durability == "fsync":
+            os.fsync(self.spool.fileno())
+
+    def _checkpoint(self):
+        with self.lock:
+            if not self.pending:
+                # Всё принятое закоммичено: spool можно обнулить
+                self.spool.truncate(0)
+                self.spool.seek(0)
+                checkpoint = 0
+                self.seq = 0
+            else:
+                # Последний seq, до которого закоммичено всё без пропусков
+                checkpoint = min(self.pending) - 1
+            with open(self.spool_path + ".ckpt", "w", encoding="utf-8") as f:
+                f.write(str(checkpoint))
+
+    def _replay_orphans(self):
+        if not self.spool:
+            return
+        for path in glob.glob(os.path.join(self.spool_dir, "ingest-*.spool")):
+            if path == self.spool_path:
+                continue
+            try:
+                self._replay_file(path)
+            except Exception:
+                logger.exception("Ingest buffer: failed to replay spool %s", path)
+
+    def _replay_file(self, path):
+        with open(path, "r+", encoding="utf-8") as f:
+            if fcntl:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return  # spool живого процесса
+
+            checkpoint = 0
+            if os.path.exists(path + ".ckpt"):
+                with open(path + ".ckpt", encoding="utf-8") as ckpt:
+                    checkpoint = int(ckpt.read().strip() or 0)
+
+            batch = []
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # оборванная последняя строка
+                if record["seq"] <= checkpoint:
+                    continue
+                batch.extend((record["seq"], None, record["route"], p, 0) for p in record["points"])
+
+            if batch:
+                logger.info("Ingest buffer: replaying %d points from %s", len(batch), path)
+                failed = self._flush(batch, replay=True)
+                if failed:
+                    # Оставляем spool до следующего запуска, чекпоинт — до первой неудачи
+                    with open(path + ".ckpt", "w", encoding="utf-8") as ckpt:
+                        ckpt.write(str(max(checkpoint, min(item[0] for item in failed) - 1)))
+                    logger.error("Ingest buffer: %d points from %s not committed, keeping the spool",
+                                 len(failed), path)
+                    return
+
+        os.remove(path)
+        if os.path.exists(path + ".ckpt"):
+            os.remove(path + ".ckpt")
+
+    # -------------------------
+    # Metrics
+    # -------------------------
+    def metrics(self):
+        with self.lock:
+            retry_pending = sum(len(items) for _, _, items in self.retries)
+        with self.metrics_lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.max_points,
+                "accepted_total": self.accepted_total,
+                "committed_total": self.committed_total,
+                "failed_total": self.failed_total,
+                "retried_total": self.retried_total,
+                "retry_pending": retry_pending,
+                "flushes_total": self.flushes_total,
+                "last_flush_points": self.last_flush_points,
+                "commit_latency_ms": {
+                    "last": self.latency_last_ms,
+                    "avg": self.latency_sum_ms / self.latency_count if self.latency_count else None,
+                    "max": self.latency_max_ms,
+                },
+                "durability": self.durability,
+            }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = PointBuffer(buffer_settings())
+    return _buffer
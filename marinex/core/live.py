@@ -0,0 +1,200 @@
+# core/live.py
+"""
+Live route streaming: every accepted NavigationPoint is pushed to the
+subscribers of its route over Server-Sent Events (served by marinex/asgi.py).
+
+Brokers:
+  * DatabasePollingBroker (default) - subscribers poll the route's new rows
+    in the database, so a point accepted by any worker reaches every
+    subscriber; no external broker needed.
+  * InProcessBroker - pub/sub inside one process, only for a single-worker
+    deployment (runserver, one uvicorn process). Ingest runs in a worker
+    thread, subscribers live on the event loop, so delivery goes through
+    loop.call_soon_threadsafe().
+
+Events are (recorded_at, point_id, json) triples; polling and resume use the
+(recorded_at, id) key, so points sharing a timestamp are not skipped (point
+ids are time-ordered, see core.models.point_id). A stream without a position
+starts after the route's newest stored point (latest_position).
+
+Choose with settings.NAVIGATION_LIVE_BROKER (dotted path).
+"""
+import asyncio
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+SUBSCRIBER_QUEUE_SIZE = 1000
+POLL_BATCH_SIZE = 500
+
+
+class Subscription:
+    def __init__(self, broker, route_id):
+        self.broker = broker
+        self.route_id = route_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Медленный клиент: теряем точку, он может переподключиться с ?since=
+            pass
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, route_id, since=None, since_id=None):
+        subscription = Subscription(self, str(route_id))
+        with self._lock:
+            self._subscribers.setdefault(subscription.route_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.route_id)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.route_id]
+
+    def publish(self, route_id, points):
+        with self._lock:
+            subscribers = list(self._subscribers.get(str(route_id), ()))
+        if not subscribers:
+            return
+        events = [point_event(p) for p in sorted(points, key=lambda p: p.recorded_at)]
+        for subscription in subscribers:
+            for event in events:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+
+
+class PollingSubscription(Subscription):
+    def __init__(self, broker, route_id, since=None, since_id=None):
+        super().__init__(broker, route_id)
+        self.since = since
+        self.since_id = since_id
+        self.interval = getattr(settings, "NAVIGATION_LIVE_POLL_INTERVAL_S", 1)
+        self.task = self.loop.create_task(self._poll())
+
+    async def _poll(self):
+        # Не thread_sensitive: опрос не должен вставать в очередь к общему sync-потоку всех view.
+        # Маршрут читается один раз на подписку
+        route = await sync_to_async(load_route, thread_sensitive=False)(self.route_id)
+        if route.is_archived:
+            return  # в архивный маршрут точки больше не принимаются
+        while True:
+            events = await sync_to_async(route_events, thread_sensitive=False)(
+                route, self.since, POLL_BATCH_SIZE, self.since_id
+            )
+            for event in events:
+                self.since, self.since_id = event[0], event[1]
+                self.deliver(event)
+            await asyncio.sleep(self.interval)
+
+    def close(self):
+        self.task.cancel()
+
+
+class DatabasePollingBroker:
+    def subscribe(self, route_id, since=None, since_id=None):
+        return PollingSubscription(self, str(route_id), since, since_id)
+
+    def unsubscribe(self, subscription):
+        pass
+
+    def publish(self, route_id, points):
+        # Точки уже в БД, подписчики заберут их сами
+        pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                path = getattr(settings, "NAVIGATION_LIVE_BROKER", "core.live.DatabasePollingBroker")
+                _broker = import_string(path)()
+    return _broker
+
+
+def point_event(point):
+    """
+    (recorded_at, point_id, json) triple sent to subscribers for one NavigationPoint.
+    """
+    from .serializers import NavigationPointSerializer
+    return point.recorded_at, point.id, json.dumps(NavigationPointSerializer(point).data)
+
+
+def publish_points(route_id, points):
+    """
+    Publishes points to live subscribers once the current transaction commits.
+    """
+    if not points:
+        return
+    transaction.on_commit(lambda: get_broker().publish(route_id, points))
+
+
+def load_route(route_id):
+    from .models import NavigationRoute
+
+    return NavigationRoute.all_objects.get(pk=route_id)
+
+
+def load_events(route_id, since=None, limit=None, since_id=None):
+    """
+    Stored points of a route after (since, since_id) as events (used for resume and polling).
+    Without since_id every point recorded at `since` counts as already sent.
+    """
+    return route_events(load_route(route_id), since, limit, since_id)
+
+
+def route_events(route, since=None, limit=None, since_id=None):
+    events = []
+    if not route.is_archived:
+        points = _live_points(route, since, limit, since_id)
+    else:
+        points = (p for p in route.get_points() if not since or p.recorded_at > since)
+    for point in points:
+        events.append(point_event(point))
+        if limit and len(events) >= limit:
+            break
+    return events
+
+
+def latest_position(route):
+    """
+    (recorded_at, id) of the route's newest stored point, where a live subscription
+    starts; the id breaks ties between points sharing that timestamp.
+    """
+    if route.is_archived:
+        return route.last_recorded_at, None
+    return route.points.order_by("-recorded_at", "-id").values_list("recorded_at", "id").first() or (None, None)
+
+
+def _live_points(route, since, limit, since_id=None):
+    qs = route.points.order_by("recorded_at", "id")
+    if since and since_id:
+        qs = qs.filter(Q(recorded_at__gt=since) | Q(recorded_at=since, id__gt=since_id))
+    elif since:
+        qs = qs.filter(recorded_at__gt=since)
+    return qs[:limit] if limit else qs
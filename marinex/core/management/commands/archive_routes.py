@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from core.models import NavigationRoute
+
+
+class Command(BaseCommand):
+    help = 'Архивирует завершённые маршруты: упаковывает точки в blob и удаляет строки NavigationPoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Архивировать маршруты, завершённые больше N дней назад (по умолчанию 30)')
+        parser.add_argument('--limit', type=int, default=None, help='Максимум маршрутов за один запуск')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет заархивировано')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='После архивации выполнить VACUUM, чтобы вернуть место (SQLite/Postgres)')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        routes = NavigationRoute.all_objects.filter(
+            end_time__isnull=False,
+            end_time__lt=cutoff,
+            archived_at__isnull=True,
+        ).order_by('end_time')
+        if options['limit']:
+            routes = routes[:options['limit']]
+        # Сначала только id: открытый курсор iterator() не должен жить поперёк
+        # транзакций archive() (на SQLite запись в таблицу, которую читает курсор)
+        route_ids = list(routes.values_list('id', flat=True))
+
+        archived_count = 0
+        archived_points = 0
+        blob_bytes = 0
+
+        for route_id in route_ids:
+            route = NavigationRoute.all_objects.filter(pk=route_id, archived_at__isnull=True).first()
+            if route is None:
+                continue  # заархивирован или удалён параллельно
+            points = route.points.count()
+            if options['dry_run']:
+                self.stdout.write(f"  [dry-run] {route} ({points} точек)")
+                archived_count += 1
+                archived_points += points
+                continue
+
+            blob = route.archive()
+            archived_count += 1
+            archived_points += points
+            blob_bytes += len(blob)
+            self.stdout.write(f"  -> {route}: {points} точек, {len(blob)} байт")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\nМаршрутов: {archived_count}, точек: {archived_points}, размер архива: {blob_bytes} байт"
+        ))
+
+        if options['vacuum'] and archived_count and not options['dry_run']:
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            self.stdout.write(self.style.SUCCESS("VACUUM выполнен."))
@@ -0,0 +1,144 @@
+import argparse
+import multiprocessing
+import random
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core import synthetic
+
+GENERATION_OPTIONS = (
+    'seed', 'boats', 'tasks', 'works', 'materials', 'documents', 'attachments', 'routes', 'points', 'chunk_size',
+    'base_time',
+)
+
+
+def _init_worker():
+    # При spawn (macOS/Windows) Django в дочернем процессе ещё не настроен
+    import django
+    django.setup()
+
+
+def _generate_account(job):
+    """
+    Один аккаунт целиком в процессе-воркере. Свой Random(seed:index) на аккаунт,
+    поэтому результат не зависит от числа воркеров и порядка выполнения.
+    """
+    index, options, catalog_ids, password_hash = job
+    from core.models import (
+        BoatModel, DocumentCategory, DocumentPeriodization, DocumentStatus, Material, Port, TaskCategory,
+        TaskStatus, WorkCategory, WorkStatus,
+    )
+
+    def load(model, ids):
+        objects = model.objects.in_bulk(ids)
+        return [objects[pk] for pk in ids]
+
+    catalogs = synthetic.Catalogs(**{
+        field: load(model, catalog_ids[field])
+        for field, model in zip(synthetic.Catalogs._fields, (
+            BoatModel, Port, Material, DocumentCategory, DocumentStatus, DocumentPeriodization,
+            TaskCategory, TaskStatus, WorkCategory, WorkStatus,
+        ))
+    })
+
+    started = time.monotonic()
+    rng = random.Random(f"{options['seed']}:{index}")
+    username = f"load{options['seed']}-{index:06d}"
+    user = synthetic.make_user(username, rng=rng, password_hash=password_hash)
+    synthetic.seed_account(
+        rng, catalogs, f"Load fleet {options['seed']}-{index}", user=user,
+        boats=options['boats'],
+        tasks_per_boat=options['tasks'],
+        works_per_boat=options['works'],
+        documents_per_boat=options['documents'],
+        attachments_per_boat=options['attachments'],
+        materials_per_work=options['materials'],
+        routes_per_boat=options['routes'],
+        points_per_route=options['points'],
+        chunk_size=options['chunk_size'],
+        base_time=options['base_time'],
+    )
+    connections.close_all()
+    return index, time.monotonic() - started
+
+
+def _base_time(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        parsed = datetime.combine(day, datetime.min.time()) if day else None
+    if parsed is None:
+        raise argparse.ArgumentTypeError(f"не дата ISO 8601: {value!r}")
+    return parsed if timezone.is_aware(parsed) else parsed.replace(tzinfo=dt_timezone.utc)
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими данными для нагрузочного тестирования: '
+            'N аккаунтов x M лодок с задачами, работами, документами и GPS-треками')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=10, help='Количество аккаунтов (по умолчанию 10)')
+        parser.add_argument('--boats', type=int, default=5, help='Лодок на аккаунт (по умолчанию 5)')
+        parser.add_argument('--tasks', type=int, default=40, help='Задач на лодку (по умолчанию 40)')
+        parser.add_argument('--works', type=int, default=15, help='Работ на лодку (по умолчанию 15)')
+        parser.add_argument('--materials', type=int, default=2,
+                            help='Среднее число строк WorkMaterial на работу (по умолчанию 2)')
+        parser.add_argument('--documents', type=int, default=15, help='Документов на лодку (по умолчанию 15)')
+        parser.add_argument('--attachments', type=int, default=3, help='Вложений на лодку (по умолчанию 3)')
+        parser.add_argument('--routes', type=int, default=10, help='Маршрутов на лодку (по умолчанию 10)')
+        parser.add_argument('--points', type=int, default=2000,
+                            help='Точек на маршрут, шаг 5 секунд (по умолчанию 2000)')
+        parser.add_argument('--seed', type=int, default=42, help='Seed генератора (по умолчанию 42)')
+        parser.add_argument('--start', type=int, default=0,
+                            help='Номер первого аккаунта: чтобы дозаполнить базу тем же seed')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Параллельных процессов (по умолчанию 1)')
+        parser.add_argument('--chunk-size', type=int, default=synthetic.CHUNK_SIZE,
+                            help=f'Размер пачки bulk_create (по умолчанию {synthetic.CHUNK_SIZE})')
+        parser.add_argument('--base-time', type=_base_time, default=synthetic.DEFAULT_BASE_TIME,
+                            help='Точка отсчёта дат, ISO 8601 (по умолчанию '
+                                 f'{synthetic.DEFAULT_BASE_TIME:%Y-%m-%d}); с тем же seed — те же данные')
+
+    def handle(self, *args, **options):
+        if options['accounts'] < 1 or options['workers'] < 1:
+            raise CommandError("--accounts и --workers должны быть >= 1")
+
+        boats = options['accounts'] * options['boats']
+        points = boats * options['routes'] * options['points']
+        self.stdout.write(
+            f"Аккаунтов: {options['accounts']}, лодок: {boats}, маршрутов: {boats * options['routes']}, "
+            f"точек: {points}, воркеров: {options['workers']}"
+        )
+
+        started = time.monotonic()
+        catalogs = synthetic.seed_catalogs(random.Random(f"{options['seed']}:catalogs"))
+        catalog_ids = {field: [obj.pk for obj in getattr(catalogs, field)] for field in synthetic.Catalogs._fields}
+        # Один хэш на всех: PBKDF2 на каждого пользователя съел бы всё время. Пароль = "load"
+        password_hash = make_password("load")
+
+        # В воркеры уходят только параметры генерации (options содержит и stdout)
+        params = {key: options[key] for key in GENERATION_OPTIONS}
+        jobs = [
+            (index, params, catalog_ids, password_hash)
+            for index in range(options['start'], options['start'] + options['accounts'])
+        ]
+        if options['workers'] == 1:
+            self.run(map(_generate_account, jobs), len(jobs))
+        else:
+            # Соединения не должны переживать fork
+            connections.close_all()
+            with multiprocessing.get_context().Pool(options['workers'], initializer=_init_worker) as pool:
+                self.run(pool.imap_unordered(_generate_account, jobs), len(jobs))
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"\nГотово за {elapsed:.1f} с, точек/с: {points / elapsed:.0f}"))
+
+    def run(self, results, total):
+        for done, (index, seconds) in enumerate(results, start=1):
+            self.stdout.write(f"  -> аккаунт {index}: {seconds:.1f} с ({done}/{total})")
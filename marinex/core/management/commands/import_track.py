@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Boat
+from core.track_import import FORMATS, TrackImportError, detect_format, import_track
+
+
+class Command(BaseCommand):
+    help = 'Импортирует трек (GPX, KML или лог NMEA) как новый маршрут лодки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу трека')
+        parser.add_argument('--boat', required=True, help='ID лодки')
+        parser.add_argument('--name', help='Название маршрута. По умолчанию — из файла')
+        parser.add_argument('--format', choices=FORMATS, help='Формат файла. По умолчанию — по расширению/содержимому')
+
+    def handle(self, *args, **options):
+        try:
+            boat = Boat.objects.get(id=options['boat'])
+        except (Boat.DoesNotExist, ValueError):
+            raise CommandError(f"Лодка {options['boat']} не найдена")
+
+        try:
+            with open(options['path'], 'rb') as f:
+                fmt = options['format'] or detect_format(options['path'], f.read(512))
+                f.seek(0)
+                route = import_track(boat, f, fmt, name=options['name'])
+        except (OSError, TrackImportError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Импортирован маршрут {route.id} «{route.name}»: {route.point_count} точек, {route.distance_m:.0f} м"
+        ))
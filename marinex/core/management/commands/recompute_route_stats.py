@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from core.models import NavigationRoute
+from core.navigation import recompute_route_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику маршрутов (дистанция, время в движении, скорость, bbox) по их точкам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', action='append', dest='routes', default=[],
+                            help='ID маршрута (можно указать несколько раз). По умолчанию — все маршруты')
+        parser.add_argument('--only-empty', action='store_true',
+                            help='Только маршруты без посчитанной статистики (point_count = 0)')
+
+    def handle(self, *args, **options):
+        routes = NavigationRoute.all_objects.all().order_by('created_at')
+        if options['routes']:
+            routes = routes.filter(id__in=options['routes'])
+        if options['only_empty']:
+            routes = routes.filter(point_count=0)
+
+        # Сначала только id: пересчёт пишет в ту же таблицу, курсор iterator() не держим открытым
+        route_ids = list(routes.values_list('id', flat=True))
+
+        count = 0
+        for route_id in route_ids:
+            route = NavigationRoute.all_objects.filter(pk=route_id).first()
+            if route is None:
+                continue
+            recompute_route_stats(route)
+            count += 1
+            self.stdout.write(f"  -> {route}: {route.point_count} точек, {route.distance_m:.0f} м")
+
+        self.stdout.write(self.style.SUCCESS(f"\nПересчитано маршрутов: {count}"))
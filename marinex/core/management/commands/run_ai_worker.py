@@ -0,0 +1,62 @@
+import os
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.ai_jobs import claim_job, run_job
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры очереди AI-анализа документов (DocumentAIJob)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2,
+                            help='Количество потоков-воркеров (по умолчанию 2)')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Пауза в секундах, когда очередь пуста (по умолчанию 2)')
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать доступные задания и выйти')
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.processed = 0
+        self.lock = threading.Lock()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        threads = [
+            threading.Thread(target=self.work, args=(f"{prefix}:{i}", options), daemon=True)
+            for i in range(options['threads'])
+        ]
+        self.stdout.write(f"Воркеров: {len(threads)}")
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stop.set()
+            self.stdout.write("Остановка: дожидаемся текущих заданий...")
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(self.style.SUCCESS(f"Обработано заданий: {self.processed}"))
+
+    def work(self, worker_id, options):
+        while not self.stop.is_set():
+            close_old_connections()
+            job = claim_job(worker_id)
+            if job is None:
+                if options['once']:
+                    break
+                self.stop.wait(options['poll_interval'])
+                continue
+
+            job = run_job(job)
+            with self.lock:
+                self.processed += 1
+            self.stdout.write(f"  -> {job.id}: {job.status} (попытка {job.attempts})")
+        close_old_connections()
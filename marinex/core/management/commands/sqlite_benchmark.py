@@ -0,0 +1,141 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Конфигурация Django по умолчанию: журнал отката, synchronous=FULL, отложенные транзакции
+DEFAULT_MODE = {
+    'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+    'begin': 'BEGIN',
+    'timeout': 5,
+}
+
+SEED_ROWS = 20000
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест SQLite: параллельные чтения и записи в конфигурации по умолчанию '
+            'и в production-режиме (settings.SQLITE_PRAGMAS + BEGIN IMMEDIATE)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Параллельных потоков (по умолчанию 8)')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Длительность каждого прогона (по умолчанию 5)')
+        parser.add_argument('--write-ratio', type=float, default=0.2,
+                            help='Доля записывающих операций (по умолчанию 0.2)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        pragmas = dict(settings.SQLITE_PRAGMAS)
+        # В секундах: sqlite3.connect(timeout=...) — тот же busy handler
+        timeout = pragmas.pop('busy_timeout', 5000) / 1000
+        modes = [
+            ('default', DEFAULT_MODE),
+            ('production', {'pragmas': pragmas, 'begin': 'BEGIN IMMEDIATE', 'timeout': timeout}),
+        ]
+
+        self.stdout.write(
+            f"Потоков: {options['threads']}, {options['seconds']} с на прогон, "
+            f"доля записи: {options['write_ratio']}"
+        )
+        self.stdout.write(f"{'режим':<12}{'опер/с':>10}{'чтений':>10}{'записей':>10}{'locked':>10}{'p95, мс':>10}")
+        for name, mode in modes:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'bench.sqlite3')
+                self.seed(path, mode)
+                result = self.run(path, mode, options)
+            self.stdout.write(
+                f"{name:<12}{result['ops_per_s']:>10.0f}{result['reads']:>10}{result['writes']:>10}"
+                f"{result['locked']:>10}{result['p95_ms']:>10.1f}"
+            )
+        self.stdout.write(self.style.SUCCESS("Готово"))
+
+    def connect(self, path, mode):
+        conn = sqlite3.connect(path, timeout=mode['timeout'], isolation_level=None, check_same_thread=False)
+        for pragma, value in mode['pragmas'].items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def seed(self, path, mode):
+        conn = self.connect(path, mode)
+        # Похоже на NavigationPoint: точки маршрута с временем
+        conn.execute(
+            "CREATE TABLE point (id INTEGER PRIMARY KEY, route_id INTEGER, ts REAL, lat REAL, lon REAL)"
+        )
+        conn.execute("CREATE INDEX point_route_ts ON point (route_id, ts)")
+        rng = random.Random(0)
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO point (route_id, ts, lat, lon) VALUES (?, ?, ?, ?)",
+            ((i % 100, i, rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(SEED_ROWS)),
+        )
+        conn.execute("COMMIT")
+        conn.close()
+
+    def run(self, path, mode, options):
+        stop = threading.Event()
+        lock = threading.Lock()
+        totals = {'reads': 0, 'writes': 0, 'locked': 0}
+        latencies = []
+
+        def worker(index):
+            rng = random.Random(options['seed'] + index)
+            conn = self.connect(path, mode)
+            reads = writes = locked = 0
+            local_latencies = []
+            while not stop.is_set():
+                route_id = rng.randrange(100)
+                started = time.perf_counter()
+                try:
+                    if rng.random() < options['write_ratio']:
+                        # Чтение и запись в одной транзакции, как record_points
+                        conn.execute(mode['begin'])
+                        last = conn.execute(
+                            "SELECT MAX(ts) FROM point WHERE route_id = ?", (route_id,)
+                        ).fetchone()[0] or 0
+                        conn.execute(
+                            "INSERT INTO point (route_id, ts, lat, lon) VALUES (?, ?, ?, ?)",
+                            (route_id, last + 1, rng.uniform(-90, 90), rng.uniform(-180, 180)),
+                        )
+                        conn.execute("COMMIT")
+                        writes += 1
+                    else:
+                        conn.execute(
+                            "SELECT COUNT(*), AVG(lat), AVG(lon) FROM point WHERE route_id = ?", (route_id,)
+                        ).fetchone()
+                        reads += 1
+                    local_latencies.append(time.perf_counter() - started)
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e) and 'busy' not in str(e):
+                        raise
+                    locked += 1
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+            conn.close()
+            with lock:
+                totals['reads'] += reads
+                totals['writes'] += writes
+                totals['locked'] += locked
+                latencies.extend(local_latencies)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0
+        return dict(
+            totals,
+            ops_per_s=(totals['reads'] + totals['writes']) / elapsed,
+            p95_ms=p95,
+        )
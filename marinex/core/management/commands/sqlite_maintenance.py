@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.sqlite import checkpoint, current_pragmas, is_sqlite, optimize
+
+
+class Command(BaseCommand):
+    help = 'Обслуживание SQLite: чекпоинт WAL и PRAGMA optimize (запускать по cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Алиас базы (по умолчанию default)')
+        parser.add_argument('--mode', default='TRUNCATE', choices=['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'],
+                            help='Режим wal_checkpoint (по умолчанию TRUNCATE — ещё и обрезает файл -wal)')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='Выполнить VACUUM (блокирует запись на время работы)')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if not is_sqlite(connections[alias]):
+            raise CommandError(f"База '{alias}' не SQLite")
+
+        busy, wal_pages, moved_pages = checkpoint(alias, options['mode'])
+        if busy:
+            # Чекпоинт не дошёл до конца: WAL читает долгая транзакция
+            self.stdout.write(self.style.WARNING(
+                f"Чекпоинт неполный: перенесено {moved_pages} из {wal_pages} страниц"
+            ))
+        else:
+            self.stdout.write(f"Чекпоинт: перенесено {moved_pages} страниц WAL")
+
+        optimize(alias)
+        self.stdout.write("PRAGMA optimize выполнен")
+
+        if options['vacuum']:
+            with connections[alias].cursor() as cursor:
+                cursor.execute("VACUUM")
+            self.stdout.write("VACUUM выполнен")
+
+        if options['verbosity'] > 1:
+            for name, value in current_pragmas(alias).items():
+                self.stdout.write(f"  {name} = {value}")
+
+        self.stdout.write(self.style.SUCCESS("Готово"))
@@ -0,0 +1,65 @@
+# core/memberships.py
+"""
+Account memberships of a user (UserAccount rows), resolved once per request.
+
+The (account_id, role) list is memoized on the request only, so views and
+serializers of one request share a single lookup, while the next request sees
+every change, including queryset.update() and bulk deletes that bypass
+signals. Users authenticated from JWT claims bring their memberships in the
+token and skip the lookup.
+"""
+REQUEST_ATTR = "_marinex_memberships"
+
+
+class Memberships:
+    def __init__(self, rows):
+        # rows: [(account_id, role_name), ...] в порядке добавления в аккаунт
+        self.rows = rows
+        self.account_ids = [account_id for account_id, _ in rows]
+        self.roles = dict(rows)
+
+    @property
+    def primary_account_id(self):
+        return self.account_ids[0] if self.account_ids else None
+
+    def role(self, account_id):
+        return self.roles.get(account_id)
+
+    def __contains__(self, account_id):
+        return account_id in self.roles
+
+
+def load_memberships(user):
+    from .models import UserAccount
+    return Memberships(list(
+        UserAccount.objects.filter(user_id=user.pk)
+        .order_by("created_at")
+        .values_list("account_id", "role__name")
+    ))
+
+
+def get_memberships(request, user=None):
+    """
+    Memberships of request.user (or of `user`), memoized on the request.
+    """
+    user = user or request.user
+    # ClaimsUser (core/authentication.py): членства уже в токене
+    token_memberships = getattr(user, "token_memberships", None)
+    if token_memberships is not None:
+        return token_memberships
+    if request is None:
+        return load_memberships(user)
+
+    # DRF Request и HttpRequest одного запроса делят один объект
+    target = getattr(request, "_request", request)
+    memoized = getattr(target, REQUEST_ATTR, None)
+    if memoized is not None and memoized[0] == user.pk:
+        return memoized[1]
+
+    memberships = load_memberships(user)
+    setattr(target, REQUEST_ATTR, (user.pk, memberships))
+    return memberships
+
+
+def get_account_ids(request):
+    return get_memberships(request).account_ids
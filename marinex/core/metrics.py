@@ -0,0 +1,342 @@
+# core/metrics.py
+"""
+Per-endpoint request metrics in Prometheus text format (settings.METRICS).
+
+core.middleware.MetricsMiddleware records, per endpoint (URL name, plus the
+viewset action for viewsets) and HTTP method:
+  * request latency, SQL query count and SQL time (execute_wrapper on every
+    connection), render time (TimedJSONRenderer: DRF response data to bytes),
+    response size;
+  * a response counter per status code.
+Values are aggregated into histograms in the process. serializer.data is
+evaluated in the view and is part of the request latency.
+
+Gunicorn: with MULTIPROCESS_DIR set, every process dumps its snapshot to
+<dir>/<pid>-<start>.json at most every FLUSH_INTERVAL_S (and on exit) and
+holds a flock on <pid>-<start>.lock while alive. The /metrics endpoint merges
+all files, so one scrape covers every worker; files of dead processes are
+folded into retired.json (counters must not go back) and removed.
+
+Streaming responses: latency covers building the response, not sending the
+body (timing stops before the first chunk), and their size is not recorded.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировок, файлы умерших процессов не чистятся
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "ENABLED": True,
+    "MULTIPROCESS_DIR": None,
+    "FLUSH_INTERVAL_S": 5,
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# имя -> (тип, описание, границы корзин)
+METRICS = {
+    "marinex_http_request_duration_seconds": ("histogram", "Request latency", LATENCY_BUCKETS),
+    "marinex_http_sql_queries": ("histogram", "SQL queries per request", QUERY_BUCKETS),
+    "marinex_http_sql_duration_seconds": ("histogram", "SQL time per request", LATENCY_BUCKETS),
+    "marinex_http_render_duration_seconds": ("histogram", "Response rendering time per request", LATENCY_BUCKETS),
+    "marinex_http_response_size_bytes": ("histogram", "Response body size", SIZE_BUCKETS),
+    "marinex_http_responses_total": ("counter", "Responses by status code", None),
+}
+
+_current = ContextVar("marinex_request_metrics", default=None)
+
+RETIRED_FILE = "retired.json"
+
+
+def metrics_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "METRICS", {}) or {})
+    return config
+
+
+def is_enabled():
+    return bool(metrics_settings()["ENABLED"])
+
+
+class RequestMetrics:
+    # Запросы из sync_to_async/to_thread пишут сюда из других потоков
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+
+    def add_query(self, duration):
+        with self.lock:
+            self.sql_queries += 1
+            self.sql_time += duration
+
+
+def begin_request():
+    return _current.set(RequestMetrics())
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # Обёртка висит на соединении постоянно и считает только внутри запроса
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that adds its time to the current request's metrics
+    (DEFAULT_RENDERER_CLASSES; the browsable API renders through it too).
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        started = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            with stats.lock:
+                stats.render_time += time.perf_counter() - started
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (метрика, метки) -> [счётчики по корзинам + Inf, сумма, количество] или число
+        self.values = {}
+        self.started = int(time.time())
+        self.last_flush = 0.0
+        self.lock_file = None
+        self.lock_pid = None
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                [name, list(labels), [list(value[0]), value[1], value[2]] if isinstance(value, list) else value]
+                for (name, labels), value in self.values.items()
+            ]
+
+    def _path(self, directory, suffix=".json"):
+        return os.path.join(directory, f"{os.getpid()}-{self.started}{suffix}")
+
+    def _hold_lock(self, directory):
+        # Блокировка держится до выхода процесса: по ней _prune_dead() отличает живых от умерших
+        if not fcntl or self.lock_pid == os.getpid():
+            return
+        if self.lock_file is not None:
+            self.lock_file.close()  # унаследован от родителя до fork
+        self.lock_file = open(self._path(directory, ".lock"), "w")
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.lock_pid = os.getpid()
+
+    def flush(self, force=False):
+        config = metrics_settings()
+        directory = config["MULTIPROCESS_DIR"]
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_flush < config["FLUSH_INTERVAL_S"]:
+            return
+        self.last_flush = now
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._hold_lock(directory)
+            _write(self._path(directory), self.snapshot())
+        except OSError:
+            logger.exception("Could not write metrics to %s", directory)
+
+
+_registry = Registry()
+atexit.register(lambda: _registry.flush(force=True))
+
+
+def endpoint_label(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "<unresolved>"
+    name = match.view_name or match.route
+    actions = getattr(match.func, "actions", None)
+    if actions and request.method.lower() in actions:
+        return f"{name}.{actions[request.method.lower()]}"
+    return name
+
+
+def record(request, response, stats, duration):
+    labels = (("endpoint", endpoint_label(request)), ("method", request.method))
+    _registry.observe("marinex_http_request_duration_seconds", labels, duration)
+    _registry.observe("marinex_http_sql_queries", labels, stats.sql_queries)
+    _registry.observe("marinex_http_sql_duration_seconds", labels, stats.sql_time)
+    _registry.observe("marinex_http_render_duration_seconds", labels, stats.render_time)
+    if not response.streaming:
+        _registry.observe("marinex_http_response_size_bytes", labels, len(response.content))
+    _registry.inc("marinex_http_responses_total", labels + (("status", str(response.status_code)),))
+    _registry.flush()
+
+
+def _merge(into, snapshot):
+    for name, labels, value in snapshot:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        if isinstance(value, list):
+            entry = into.setdefault(key, [[0] * len(value[0]), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+            entry[1] += value[1]
+            entry[2] += value[2]
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError):
+        logger.warning("Skipping unreadable metrics file %s", path)
+        return []
+
+
+def _write(path, snapshot):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def _prune_dead(directory):
+    """
+    Folds the snapshots of processes that no longer hold their .lock into
+    retired.json and deletes their files. Caller holds the directory lock.
+    """
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    for lock_path in glob.glob(os.path.join(directory, "*.lock")):
+        if lock_path == _registry._path(directory, ".lock"):
+            continue
+        with open(lock_path, "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue  # процесс жив
+            path = lock_path[:-len(".lock")] + ".json"
+            retired = {}
+            _merge(retired, _read(retired_path))
+            _merge(retired, _read(path))
+            _write(retired_path, [[name, list(labels), value] for (name, labels), value in retired.items()])
+            if os.path.exists(path):
+                os.remove(path)
+            os.remove(lock_path)
+
+
+def collect():
+    """
+    Все значения: из файлов всех процессов (MULTIPROCESS_DIR) или только из текущего.
+    """
+    directory = metrics_settings()["MULTIPROCESS_DIR"]
+    merged = {}
+    if not directory:
+        _merge(merged, _registry.snapshot())
+        return merged
+
+    _registry.flush(force=True)
+    if not fcntl:
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            _merge(merged, _read(path))
+        return merged
+
+    # Чистка и чтение под одной блокировкой: параллельный scrape не увидит процесс дважды
+    # (и в retired.json, и в его собственном файле). Скрытый .scrape.lock не попадает в glob "*.lock"
+    with open(os.path.join(directory, ".scrape.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _prune_dead(directory)
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            _merge(merged, _read(path))
+    return merged
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def render():
+    values = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (metric, labels), value in sorted(values.items()):
+            if metric != name:
+                continue
+            if kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
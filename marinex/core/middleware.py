@@ -1,21 +1,122 @@
 # core/middleware.py
-import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from . import db_router, metrics
+
+# ContextVar, а не threading.local: под ASGI корутины разных запросов делят поток
+_current_request = ContextVar("marinex_current_request", default=None)
 
-_thread_locals = threading.local()
 
 def get_current_user():
-    return getattr(_thread_locals, "user", None)
+    # Пользователь читается лениво: JWT проверяется уже во view (DRF),
+    # после этой middleware, и DRF кладёт его в request.user
+    request = _current_request.get()
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return None
+    return user
+
 
 class CurrentUserMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        # store only if authenticated
-        _thread_locals.user = request.user if hasattr(request, "user") and request.user.is_authenticated else None
-        response = self.get_response(request)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+    async def __acall__(self, request):
+        token = _current_request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+
+class DatabaseRoutingMiddleware:
+    """
+    Marks the request for core.db_router.ReplicaRouter: safe methods may read
+    from replicas, a write pins the user's next reads to the primary.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = db_router.begin_request(request)
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            db_router.end_request(token)
+            db_router.mark_write(request, response)
+
+    async def __acall__(self, request):
+        token = db_router.begin_request(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            db_router.end_request(token)
+            await sync_to_async(db_router.mark_write)(request, response)
+
+
+class MetricsMiddleware:
+    """
+    Per-endpoint latency, SQL, render time and response size metrics (core.metrics).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = metrics.is_enabled()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        token = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            metrics.record(request, response, metrics.current(), time.perf_counter() - started)
+            return response
+        finally:
+            metrics.end_request(token)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        token = metrics.begin_request()
+        started = time.perf_counter()
         try:
-            del _thread_locals.user
-        except Exception:
-            pass
-        return response
+            response = await self.get_response(request)
+            metrics.record(request, response, metrics.current(), time.perf_counter() - started)
+            return response
+        finally:
+            metrics.end_request(token)
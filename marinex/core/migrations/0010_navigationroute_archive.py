@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_navigationpoint_type_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='navigationroute',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='archived_track',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
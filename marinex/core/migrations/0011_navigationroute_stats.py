@@ -0,0 +1,73 @@
+# Generated by Django 5.2.8 on 2026-10-17 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_navigationroute_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='navigationroute',
+            name='distance_m',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='first_recorded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='last_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='last_lng',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='last_recorded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='max_lng',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='max_speed',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='min_lng',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='moving_time_s',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='navigationroute',
+            name='point_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
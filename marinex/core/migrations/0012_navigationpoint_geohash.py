@@ -0,0 +1,70 @@
+# Generated by Django 5.2.8 on 2026-10-17 17:38
+
+from django.db import migrations, models
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode(lat, lng, precision):
+    # Копия core.geohash.encode на момент миграции: миграция не должна зависеть от кода приложения
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                value = (value << 1) | 1
+                lng_lo = mid
+            else:
+                value <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_lo = mid
+            else:
+                value <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def fill_geohash(apps, schema_editor):
+    NavigationPoint = apps.get_model('core', 'NavigationPoint')
+    while True:
+        batch = list(NavigationPoint.objects.filter(geohash='').only('id', 'lat', 'lng')[:2000])
+        if not batch:
+            break
+        for point in batch:
+            point.geohash = encode(point.lat, point.lng, 9)
+        NavigationPoint.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_navigationroute_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='navigationpoint',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='navigationpoint',
+            index=models.Index(fields=['geohash', 'recorded_at'], name='core_naviga_geohash_d41f87_idx'),
+        ),
+    ]
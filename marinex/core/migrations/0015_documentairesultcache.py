@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-17 17:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_documentaijob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentAIResultCache',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('file_sha256', models.CharField(db_index=True, max_length=64)),
+                ('result', models.JSONField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
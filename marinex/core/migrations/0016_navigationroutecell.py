@@ -0,0 +1,104 @@
+# Generated by Django 5.2.8 on 2026-10-17 18:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CELL_PRECISION = 6
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode(lat, lng, precision):
+    # Копия core.geohash.encode на момент миграции: миграция не должна зависеть от кода приложения
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                value = (value << 1) | 1
+                lng_lo = mid
+            else:
+                value <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_lo = mid
+            else:
+                value <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def track_coordinates(data):
+    # Координаты из blob core/track_codec.py (версии 1 и 2 совпадают во всём, кроме единицы времени)
+    if len(data) < 4 or data[:3] != b"MXT":
+        return
+    count, pos = _read_varint(data, 4)
+    lat_e6 = lng_e6 = 0
+    for _ in range(count):
+        value, pos = _read_varint(data, pos)
+        lat_e6 += (value >> 1) ^ -(value & 1)
+        value, pos = _read_varint(data, pos)
+        lng_e6 += (value >> 1) ^ -(value & 1)
+        _, pos = _read_varint(data, pos)
+        _, pos = _read_varint(data, pos)
+        pos += 1
+        yield lat_e6 / 1_000_000, lng_e6 / 1_000_000
+
+
+def fill_route_cells(apps, schema_editor):
+    NavigationRoute = apps.get_model('core', 'NavigationRoute')
+    NavigationRouteCell = apps.get_model('core', 'NavigationRouteCell')
+    routes = NavigationRoute.objects.filter(archived_at__isnull=False).only('id', 'archived_track')
+    for route in routes.iterator(chunk_size=50):
+        cells = {encode(lat, lng, CELL_PRECISION) for lat, lng in track_coordinates(bytes(route.archived_track or b""))}
+        NavigationRouteCell.objects.bulk_create(
+            [NavigationRouteCell(route_id=route.id, geohash=cell) for cell in sorted(cells)],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_documentairesultcache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NavigationRouteCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geohash', models.CharField(max_length=12)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='core.navigationroute')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['geohash'], name='core_naviga_geohash_ad6b18_idx')],
+                'unique_together': {('route', 'geohash')},
+            },
+        ),
+        migrations.RunPython(fill_route_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:09
+
+import core.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_navigationroutecell'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='useraccount',
+            managers=[
+                ('objects', core.models.UserAccountManager()),
+                ('all_objects', core.models.UserAccountAllObjectsManager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,81 @@
+import math
+
+from django.db import migrations
+
+from core.track_codec import decode_track
+
+EARTH_RADIUS_M = 6371008.8
+MOVING_MIN_SPEED_MS = 0.5
+MOVING_MAX_GAP_S = 300
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def compute_stats(track):
+    # Копия core.navigation.apply_points_to_stats на момент миграции (трек уже отсортирован по времени).
+    # decode_track берётся из приложения: кодек обязан читать все версии blob'ов, которые когда-либо писал
+    stats = {
+        "point_count": 0, "distance_m": 0.0, "moving_time_s": 0.0, "max_speed": None,
+        "min_lat": None, "max_lat": None, "min_lng": None, "max_lng": None,
+        "first_recorded_at": None, "last_recorded_at": None, "last_lat": None, "last_lng": None,
+    }
+    for lat, lng, speed, _type, recorded_at in track:
+        stats["point_count"] += 1
+        if speed is not None and (stats["max_speed"] is None or speed > stats["max_speed"]):
+            stats["max_speed"] = speed
+        if stats["min_lat"] is None:
+            stats["min_lat"] = stats["max_lat"] = lat
+            stats["min_lng"] = stats["max_lng"] = lng
+            stats["first_recorded_at"] = recorded_at
+        else:
+            stats["min_lat"] = min(stats["min_lat"], lat)
+            stats["max_lat"] = max(stats["max_lat"], lat)
+            stats["min_lng"] = min(stats["min_lng"], lng)
+            stats["max_lng"] = max(stats["max_lng"], lng)
+            segment = haversine_m(stats["last_lat"], stats["last_lng"], lat, lng)
+            stats["distance_m"] += segment
+            dt = (recorded_at - stats["last_recorded_at"]).total_seconds()
+            if 0 < dt <= MOVING_MAX_GAP_S and segment / dt >= MOVING_MIN_SPEED_MS:
+                stats["moving_time_s"] += dt
+        stats["last_lat"] = lat
+        stats["last_lng"] = lng
+        stats["last_recorded_at"] = recorded_at
+    return stats
+
+
+def fill_route_stats(apps, schema_editor):
+    # 0011 добавила колонки с default 0: маршруты, созданные до неё, выглядят пустыми
+    NavigationRoute = apps.get_model('core', 'NavigationRoute')
+    NavigationPoint = apps.get_model('core', 'NavigationPoint')
+    ids = list(NavigationRoute._base_manager.filter(point_count=0).values_list('id', flat=True))
+    for route_id in ids:
+        route = NavigationRoute._base_manager.only('id', 'archived_at', 'archived_track').get(pk=route_id)
+        if route.archived_at is not None:
+            if not route.archived_track:
+                continue
+            track = decode_track(bytes(route.archived_track))
+        else:
+            track = NavigationPoint.objects.filter(route_id=route_id).order_by('recorded_at').values_list(
+                'lat', 'lng', 'speed', 'type', 'recorded_at'
+            ).iterator(chunk_size=2000)
+        stats = compute_stats(track)
+        if stats["point_count"]:
+            NavigationRoute._base_manager.filter(pk=route_id).update(**stats)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_alter_useraccount_managers'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_route_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:20
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_backfill_route_stats'),
+    ]
+
+    operations = [
+        # Меняется только default на стороне Python: SQLite иначе пересоздал бы таблицу точек целиком
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='navigationpoint',
+                    name='id',
+                    field=models.UUIDField(default=core.models.point_id, editable=False, primary_key=True, serialize=False),
+                ),
+            ],
+        ),
+    ]
@@ -1,7 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser, Group, Permission, UserManager
+import secrets
+import threading
+import time
 import uuid
 from django.core.files.storage import default_storage
 import uuid
@@ -62,9 +65,14 @@ class SoftDeleteModel(AuditModel):
         abstract = True
 
     def soft_delete(self, by_user=None):
+        from .middleware import get_current_user
+
         self.deleted_at = timezone.now()
+        # По умолчанию — пользователь текущего запроса (CurrentUserMiddleware).
+        # По pk: на чтении это ClaimsUser из JWT, а не User
+        by_user = by_user or get_current_user()
         if by_user:
-            self.deleted_by = by_user
+            self.deleted_by_id = by_user.pk
         self.save(update_fields=["deleted_at", "deleted_by", "updated_at", "updated_by"])
 
     def restore(self):
@@ -119,6 +127,8 @@ class User(AbstractUser):
     cargo = models.ForeignKey(UserCargo, null=True, blank=True, on_delete=models.SET_NULL)
     subscription_plan = models.ForeignKey(SubscriptionPlan, null=True, blank=True, on_delete=models.SET_NULL)
     subscription_expires_at = models.DateTimeField(null=True, blank=True)
+    # Растёт при каждом изменении UserAccount пользователя (см. core/authentication.py)
+    membership_version = models.PositiveIntegerField(default=0, editable=False)
     groups = models.ManyToManyField(Group, related_name="custom_user_set", blank=True)
     user_permissions = models.ManyToManyField(Permission, related_name="custom_user_permissions_set", blank=True)
     country = models.ForeignKey("Country", null=True, blank=True, on_delete=models.SET_NULL, related_name="users")
@@ -142,9 +152,14 @@ class User(AbstractUser):
     active_objects = ActiveManager()
 
     def soft_delete(self, by_user=None):
+        from .middleware import get_current_user
+
         self.deleted_at = timezone.now()
+        # По умолчанию — пользователь текущего запроса (CurrentUserMiddleware).
+        # По pk: на чтении это ClaimsUser из JWT, а не User
+        by_user = by_user or get_current_user()
         if by_user:
-            self.deleted_by = by_user
+            self.deleted_by_id = by_user.pk
         self.save(update_fields=["deleted_at", "deleted_by", "updated_at", "updated_by"])
 
     def restore(self):
@@ -177,11 +192,57 @@ class Account(SoftDeleteModel):
     def __str__(self):
         return self.name
 
+class UserAccountQuerySet(models.QuerySet):
+    """
+    Bulk writes skip the UserAccount signals, so they bump User.membership_version
+    themselves: JWT claims issued before the change stop being accepted.
+    """
+
+    def _bump_membership_versions(self, user_ids):
+        if user_ids:
+            User.objects.filter(pk__in=user_ids).update(membership_version=models.F("membership_version") + 1)
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db):
+            user_ids = set(self.values_list("user_id", flat=True))
+            rows = super().update(**kwargs)
+            # Членство могли перевесить на другого пользователя
+            moved_to = kwargs.get("user_id", getattr(kwargs.get("user"), "pk", kwargs.get("user")))
+            if rows and moved_to is not None:
+                user_ids.add(moved_to)
+            self._bump_membership_versions(user_ids)
+        return rows
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            user_ids = set(self.values_list("user_id", flat=True))
+            result = super().delete()
+            self._bump_membership_versions(user_ids)
+        return result
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            self._bump_membership_versions({obj.user_id for obj in created})
+        return created
+
+
+class UserAccountManager(ActiveManager.from_queryset(UserAccountQuerySet)):
+    pass
+
+
+class UserAccountAllObjectsManager(AllObjectsManager.from_queryset(UserAccountQuerySet)):
+    pass
+
+
 class UserAccount(SoftDeleteModel):
     """
     Through model: one user can belong to many accounts, one account can have many users.
     Use soft-delete and audit.
     """
+    objects = UserAccountManager()
+    all_objects = UserAccountAllObjectsManager()
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="user_accounts")
     account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name="account_users")
     role = models.ForeignKey(UserRole, null=True, blank=True, on_delete=models.SET_NULL)
@@ -697,6 +758,35 @@ class WorkMaterial(AuditModel):
 # -------------------------
 # NAVIGATION: Routes & Points
 # -------------------------
+# Удаление точек при архивации пачками: ограничение на число параметров SQLite
+ARCHIVE_DELETE_BATCH = 900
+
+# Ячейки geohash архивного маршрута (~1.2 x 0.6 км), см. NavigationRouteCell
+ROUTE_CELL_PRECISION = 6
+
+_point_id_lock = threading.Lock()
+_point_id_last = [0, 0]  # [мс, счётчик]
+
+
+def point_id():
+    """
+    UUIDv7 layout (48-bit unix ms, 12-bit counter, 62 random bits), monotonic
+    within the process: among points sharing recorded_at a later point gets a
+    larger id, so the (recorded_at, id) cursors of the live stream see it.
+    """
+    with _point_id_lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _point_id_last[0]:
+            _point_id_last[:] = [ms, 0]
+        elif _point_id_last[1] < 0xFFF:
+            _point_id_last[1] += 1
+        else:
+            _point_id_last[:] = [_point_id_last[0] + 1, 0]
+        ms, counter = _point_id_last
+    value = (ms & 0xFFFFFFFFFFFF) << 80 | 0x7 << 76 | counter << 64 | 0b10 << 62 | secrets.randbits(62)
+    return uuid.UUID(int=value)
+
+
 class NavigationRoute(SoftDeleteModel):  # <-- Вернули SoftDeleteModel
     account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name="nav_routes")
     boat = models.ForeignKey(Boat, on_delete=models.CASCADE, related_name="nav_routes")
@@ -704,6 +794,24 @@ class NavigationRoute(SoftDeleteModel):  # <-- Вернули SoftDeleteModel
     start_time = models.DateTimeField(null=True, blank=True)
     end_time = models.DateTimeField(null=True, blank=True)
 
+    # Архив: точки завершённого маршрута упакованы в один blob (см. core/track_codec.py)
+    archived_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    archived_track = models.BinaryField(null=True, blank=True, editable=False)
+
+    # Статистика маршрута, обновляется инкрементально при приёме точек (core/navigation.py)
+    point_count = models.PositiveIntegerField(default=0)
+    distance_m = models.FloatField(default=0)
+    moving_time_s = models.FloatField(default=0)
+    max_speed = models.FloatField(null=True, blank=True)
+    min_lat = models.FloatField(null=True, blank=True)
+    max_lat = models.FloatField(null=True, blank=True)
+    min_lng = models.FloatField(null=True, blank=True)
+    max_lng = models.FloatField(null=True, blank=True)
+    first_recorded_at = models.DateTimeField(null=True, blank=True)
+    last_recorded_at = models.DateTimeField(null=True, blank=True)
+    last_lat = models.FloatField(null=True, blank=True)
+    last_lng = models.FloatField(null=True, blank=True)
+
     class Meta:
         indexes = [
             models.Index(fields=["account"]),
@@ -713,6 +821,83 @@ class NavigationRoute(SoftDeleteModel):  # <-- Вернули SoftDeleteModel
             models.Index(fields=["deleted_at"]),
         ]
 
+    @property
+    def avg_speed(self):
+        if not self.moving_time_s:
+            return None
+        return self.distance_m / self.moving_time_s
+
+    @property
+    def bbox(self):
+        if self.min_lat is None:
+            return None
+        return [self.min_lng, self.min_lat, self.max_lng, self.max_lat]
+
+    @property
+    def is_archived(self):
+        return self.archived_at is not None
+
+    def iter_track(self, chunk_size=2000):
+        """
+        Yields (lat, lng, speed, type, recorded_at) for live and archived routes alike.
+        """
+        if self.is_archived:
+            from .track_codec import decode_track
+            return decode_track(self.archived_track or b"")
+        return self.points.order_by("recorded_at").values_list(
+            "lat", "lng", "speed", "type", "recorded_at"
+        ).iterator(chunk_size=chunk_size)
+
+    def get_points(self):
+        """
+        Points as NavigationPoint instances; archived ones are unsaved and have no id.
+        """
+        if not self.is_archived:
+            return self.points.all()
+        return [
+            NavigationPoint(id=None, route=self, lat=lat, lng=lng, speed=speed, type=p_type, recorded_at=recorded_at)
+            for lat, lng, speed, p_type, recorded_at in self.iter_track()
+        ]
+
+    def archive(self):
+        """
+        Packs the points into archived_track, records the geohash cells the track
+        passes through (NavigationRouteCell) and deletes the point rows.
+        """
+        from django.db import transaction
+        from .geohash import encode as encode_geohash
+        from .track_codec import encode_track
+
+        with transaction.atomic():
+            # Блокируем маршрут, как record_points(), и удаляем ровно закодированные точки:
+            # точка, вставленная параллельно, не должна пропасть без следа
+            NavigationRoute.all_objects.select_for_update().only("id").get(pk=self.pk)
+            ids = []
+            cells = set()
+
+            def track():
+                rows = self.points.order_by("recorded_at").values_list(
+                    "id", "lat", "lng", "speed", "type", "recorded_at", "geohash"
+                ).iterator(chunk_size=2000)
+                for point_id, *point, geohash in rows:
+                    ids.append(point_id)
+                    cell = geohash[:ROUTE_CELL_PRECISION] or encode_geohash(point[0], point[1])[:ROUTE_CELL_PRECISION]
+                    cells.add(cell)
+                    yield point
+
+            blob = encode_track(track())
+            self.archived_track = blob
+            self.archived_at = timezone.now()
+            self.save(update_fields=["archived_track", "archived_at", "updated_at"])
+            NavigationRouteCell.objects.bulk_create(
+                [NavigationRouteCell(route=self, geohash=cell) for cell in sorted(cells)],
+                ignore_conflicts=True,
+            )
+            for start in range(0, len(ids), ARCHIVE_DELETE_BATCH):
+                NavigationPoint.objects.filter(id__in=ids[start:start + ARCHIVE_DELETE_BATCH]).delete()
+
+        return blob
+
     def __str__(self):
         return f"Route {self.name or self.id}"
 
@@ -725,7 +910,7 @@ class NavigationPoint(models.Model):
         ('stop', 'Stop/Anchor'),
     )
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=point_id, editable=False)
     route = models.ForeignKey(NavigationRoute, on_delete=models.CASCADE, related_name="points")
     lat = models.FloatField()
     lng = models.FloatField()
@@ -737,12 +922,93 @@ class NavigationPoint(models.Model):
     # Время записи точки
     recorded_at = models.DateTimeField(db_index=True)
 
+    # Пространственный индекс: geohash точки (см. core/geohash.py)
+    geohash = models.CharField(max_length=12, blank=True, default="", editable=False)
+
     class Meta:
         ordering = ("recorded_at",)
         indexes = [
             models.Index(fields=["route"]),
             models.Index(fields=["recorded_at"]),
+            models.Index(fields=["geohash", "recorded_at"]),
         ]
 
+    def save(self, *args, **kwargs):
+        if self.lat is not None and self.lng is not None:
+            from .geohash import encode
+            self.geohash = encode(float(self.lat), float(self.lng))
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Point {self.id} ({self.type})"
+
+
+class NavigationRouteCell(models.Model):
+    """
+    Geohash cell (precision ROUTE_CELL_PRECISION) that an archived route passes through.
+    Lets area search pick archived routes by index instead of decoding every blob.
+    """
+    route = models.ForeignKey(NavigationRoute, on_delete=models.CASCADE, related_name="cells")
+    geohash = models.CharField(max_length=12)
+
+    class Meta:
+        unique_together = ("route", "geohash")
+        indexes = [
+            models.Index(fields=["geohash"]),
+        ]
+
+    def __str__(self):
+        return f"{self.geohash} ({self.route_id})"
+
+
+# -------------------------
+# DOCUMENT AI JOBS (очередь анализа документов, см. core/ai_jobs.py)
+# -------------------------
+class DocumentAIJob(AuditModel):
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    )
+
+    file = models.FileField(upload_to="ai_jobs/%Y/%m/")
+    mime_type = models.CharField(max_length=255, default="application/octet-stream")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, blank=True, default="")
+    locked_at = models.DateTimeField(null=True, blank=True)
+
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"]),
+            models.Index(fields=["created_by"]),
+        ]
+
+    def __str__(self):
+        return f"AI job {self.id} ({self.status})"
+
+
+class DocumentAIResultCache(models.Model):
+    """
+    Cached analysis result for identical file bytes + category tree + prompt version (core/ai_cache.py).
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    file_sha256 = models.CharField(max_length=64, db_index=True)
+    result = models.JSONField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"AI cache {self.key[:12]} ({self.hits} hits)"
@@ -0,0 +1,275 @@
+# core/navigation.py
+"""
+Helpers for navigation tracks: ingest with incremental route stats,
+simplification for map display and its cache.
+"""
+import math
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .geohash import encode as encode_geohash
+
+EARTH_RADIUS_M = 6371008.8
+
+# Точки этих типов никогда не выкидываются при упрощении
+KEEP_TYPES = ("start", "end", "stop")
+
+MIN_TOLERANCE_M = 1
+MAX_TOLERANCE_M = 50000
+
+SIMPLIFIED_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class RouteArchived(Exception):
+    """
+    Points for a route that is already archived: they would be stored as rows
+    that iter_track() never reads (it reads archived_track).
+    """
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+# -------------------------
+# Route stats (maintained at ingest time)
+# -------------------------
+STATS_FIELDS = (
+    "point_count", "distance_m", "moving_time_s", "max_speed",
+    "min_lat", "max_lat", "min_lng", "max_lng",
+    "first_recorded_at", "last_recorded_at", "last_lat", "last_lng",
+)
+
+# Сегмент считается ходом, если скорость по нему выше порога и между фиксами нет большой паузы
+MOVING_MIN_SPEED_MS = 0.5
+MOVING_MAX_GAP_S = 300
+
+
+def reset_route_stats(route):
+    route.point_count = 0
+    route.distance_m = 0.0
+    route.moving_time_s = 0.0
+    for field in STATS_FIELDS[3:]:
+        setattr(route, field, None)
+
+
+def apply_points_to_stats(route, track):
+    """
+    Folds (lat, lng, speed, type, recorded_at) tuples into the route's stats columns.
+
+    Distance is a running haversine sum from the last stored point; fixes older than
+    the last stored one still count for count/bbox/max speed but not for distance
+    (recompute_route_stats fixes that up).
+    """
+    for lat, lng, speed, p_type, recorded_at in sorted(track, key=lambda p: p[4]):
+        route.point_count += 1
+
+        if speed is not None and (route.max_speed is None or speed > route.max_speed):
+            route.max_speed = speed
+
+        if route.min_lat is None:
+            route.min_lat = route.max_lat = lat
+            route.min_lng = route.max_lng = lng
+        else:
+            route.min_lat = min(route.min_lat, lat)
+            route.max_lat = max(route.max_lat, lat)
+            route.min_lng = min(route.min_lng, lng)
+            route.max_lng = max(route.max_lng, lng)
+
+        if route.first_recorded_at is None or recorded_at < route.first_recorded_at:
+            route.first_recorded_at = recorded_at
+
+        if route.last_recorded_at is not None and recorded_at < route.last_recorded_at:
+            continue
+
+        if route.last_recorded_at is not None:
+            segment = haversine_m(route.last_lat, route.last_lng, lat, lng)
+            route.distance_m += segment
+            dt = (recorded_at - route.last_recorded_at).total_seconds()
+            if 0 < dt <= MOVING_MAX_GAP_S and segment / dt >= MOVING_MIN_SPEED_MS:
+                route.moving_time_s += dt
+
+        route.last_lat = lat
+        route.last_lng = lng
+        route.last_recorded_at = recorded_at
+
+
+def _lock_route(route, *fields):
+    from .models import NavigationRoute
+
+    return NavigationRoute.all_objects.select_for_update().only(*fields).get(pk=route.pk)
+
+
+def _copy_stats(source, route):
+    for field in STATS_FIELDS:
+        setattr(route, field, getattr(source, field))
+
+
+def recompute_route_stats(route):
+    """
+    Rebuilds the stats from the stored track under the same row lock as record_points,
+    so a concurrent ingest either lands before the recompute or is applied on top of it.
+    """
+    with transaction.atomic():
+        locked = _lock_route(route, "archived_at", "archived_track", *STATS_FIELDS)
+        reset_route_stats(locked)
+        apply_points_to_stats(locked, locked.iter_track())
+        locked.save(update_fields=list(STATS_FIELDS) + ["updated_at"])
+    _copy_stats(locked, route)
+
+
+def record_points(route, points):
+    """
+    Single entry point for ingest: writes unsaved NavigationPoint instances in one
+    transaction and updates the route's stats (which also versions cached simplifications).
+    Raises RouteArchived if the route was archived.
+    """
+    from .live import publish_points
+    from .models import NavigationPoint
+
+    if not points:
+        return []
+
+    for point in points:
+        point.geohash = encode_geohash(point.lat, point.lng)
+
+    with transaction.atomic():
+        locked = _lock_route(route, "archived_at", *STATS_FIELDS)
+        # Проверка под блокировкой: архивация могла пройти после проверки во view или постановки в буфер
+        if locked.archived_at is not None:
+            raise RouteArchived(route.pk)
+        NavigationPoint.objects.bulk_create(points)
+        apply_points_to_stats(locked, [
+            (p.lat, p.lng, p.speed, p.type, p.recorded_at) for p in points
+        ])
+        locked.save(update_fields=list(STATS_FIELDS) + ["updated_at"])
+
+        publish_points(route.id, points)
+
+    _copy_stats(locked, route)
+    return points
+
+
+def tolerance_for_zoom(zoom, latitude=0.0):
+    """
+    ~1 screen pixel in metres at the given web-mercator zoom level (512px tiles).
+    """
+    metres_per_pixel = 78271.517 * math.cos(math.radians(latitude)) / (2 ** zoom)
+    return max(metres_per_pixel, MIN_TOLERANCE_M)
+
+
+def reference_latitude(route):
+    """
+    Latitude used to convert a zoom level into metres for this route.
+    """
+    if route.is_archived:
+        first = next(iter(route.iter_track()), None)
+        lat = first[0] if first else None
+    else:
+        lat = route.points.order_by("recorded_at").values_list("lat", flat=True).first()
+    return lat or 0.0
+
+
+def tolerance_bucket(tolerance_m):
+    """
+    Snaps a tolerance down to a power of two so that close requests share a cache entry.
+    """
+    tolerance_m = min(max(tolerance_m, MIN_TOLERANCE_M), MAX_TOLERANCE_M)
+    return 2 ** int(math.floor(math.log2(tolerance_m)))
+
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    dx = bx - ax
+    dy = by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)
+    t = min(max(t, 0.0), 1.0)
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def _douglas_peucker(xy, first, last, tolerance, keep):
+    stack = [(first, last)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        ax, ay = xy[start]
+        bx, by = xy[end]
+        max_dist = -1.0
+        index = start
+        for i in range(start + 1, end):
+            dist = _segment_distance(xy[i][0], xy[i][1], ax, ay, bx, by)
+            if dist > max_dist:
+                max_dist = dist
+                index = i
+        if max_dist > tolerance:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+
+def simplify_track(points, tolerance_m):
+    """
+    Douglas-Peucker over (lat, lng, speed, type, recorded_at) tuples.
+
+    The track is split at start/end/stop points, so typed points always survive,
+    as do the first and last points of the track.
+    """
+    points = list(points)
+    if len(points) < 3:
+        return points
+
+    # Локальная равнопромежуточная проекция в метры вокруг первой точки
+    lat0 = math.radians(points[0][0])
+    cos_lat0 = math.cos(lat0)
+    xy = [
+        (
+            math.radians(p[1]) * EARTH_RADIUS_M * cos_lat0,
+            math.radians(p[0]) * EARTH_RADIUS_M,
+        )
+        for p in points
+    ]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    for i, p in enumerate(points):
+        if p[3] in KEEP_TYPES:
+            keep[i] = True
+
+    anchors = [i for i, flag in enumerate(keep) if flag]
+    for first, last in zip(anchors, anchors[1:]):
+        _douglas_peucker(xy, first, last, tolerance_m, keep)
+
+    return [p for p, flag in zip(points, keep) if flag]
+
+
+# -------------------------
+# Cache of simplified tracks
+# -------------------------
+def track_version(route):
+    """
+    Version of the route's geometry, taken from its stats columns: every ingest
+    changes point_count, so the key is the same in every process and needs no bump.
+    """
+    last = route.last_recorded_at.timestamp() if route.last_recorded_at else 0
+    return f"{route.point_count}-{last}"
+
+
+def get_simplified_points(route, tolerance_m, serialize):
+    """
+    Returns serialize(simplified_points) for the route's tolerance bucket, cached per track version.
+    """
+    bucket = tolerance_bucket(tolerance_m)
+    key = f"navroute:{route.id}:v{track_version(route)}:simplified:{bucket}"
+    data = cache.get(key)
+    if data is None:
+        data = serialize(simplify_track(route.iter_track(), bucket))
+        cache.set(key, data, SIMPLIFIED_CACHE_TIMEOUT)
+    return data
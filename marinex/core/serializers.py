@@ -5,7 +5,9 @@ from .models import (
     BoatBrand, BoatAttachment, WorkStatus, Work, Company, WorkCategory, CompanyService, NavigationPoint, NavigationRoute
 )
 from .models import Document, DocumentCategory, DocumentStatus, DocumentPeriodization
-from .models import Task, TaskCategory, TaskStatus, AccountCompany
+from .models import Task, TaskCategory, TaskStatus, AccountCompany, DocumentAIJob
+from .memberships import get_memberships
+from .navigation import get_simplified_points, reference_latitude, tolerance_for_zoom
 
 
 class BoatAttachmentSerializer(serializers.ModelSerializer):
@@ -48,8 +50,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
     def get_has_boats(self, user):
         # Проверяем, есть ли у пользователя доступ хотя бы к одному аккаунту,
         # у которого есть хотя бы одна лодка.
-        user_accounts = UserAccount.objects.filter(user=user)
-        account_ids = user_accounts.values_list('account_id', flat=True)
+        account_ids = get_memberships(self.context.get('request'), user).account_ids
         return Boat.objects.filter(account_id__in=account_ids).exists()
 
 
@@ -391,8 +392,47 @@ class NavigationPointSerializer(serializers.ModelSerializer):
         fields = ("id", "lat", "lng", "speed", "type", "recorded_at")
 
 
+class NavigationRouteSummarySerializer(serializers.ModelSerializer):
+    """
+    Лёгкое представление для списка маршрутов: без точек, только сводка
+    из колонок статистики маршрута.
+    """
+    duration_s = serializers.SerializerMethodField()
+    avg_speed = serializers.FloatField(read_only=True)
+    bbox = serializers.ListField(child=serializers.FloatField(), read_only=True)
+
+    class Meta:
+        model = NavigationRoute
+        fields = (
+            "id",
+            "account",
+            "boat",
+            "name",
+            "start_time",
+            "end_time",
+            "archived_at",
+            "point_count",
+            "distance_m",
+            "moving_time_s",
+            "duration_s",
+            "avg_speed",
+            "max_speed",
+            "bbox",
+        )
+        read_only_fields = fields
+
+    def get_duration_s(self, route):
+        start, end = route.start_time, route.end_time
+        if not start or not end:
+            start, end = route.first_recorded_at, route.last_recorded_at
+        if not start or not end:
+            return None
+        return max((end - start).total_seconds(), 0)
+
+
 class NavigationRouteSerializer(serializers.ModelSerializer):
-    points = NavigationPointSerializer(many=True, read_only=True)
+    # Архивные маршруты хранят точки в blob, поэтому читаем через route.get_points()
+    points = serializers.SerializerMethodField()
 
     class Meta:
         model = NavigationRoute
@@ -403,6 +443,42 @@ class NavigationRouteSerializer(serializers.ModelSerializer):
             "name",
             "start_time",
             "end_time",
+            "archived_at",
+            "point_count",
+            "distance_m",
+            "moving_time_s",
+            "max_speed",
             "points",
         )
-        read_only_fields = ("account", "boat")
\ No newline at end of file
+        read_only_fields = ("account", "boat", "archived_at", "point_count", "distance_m", "moving_time_s", "max_speed")
+
+    def get_points(self, route):
+        # ?tolerance= / ?zoom= (см. NavigationRouteViewSet) -> упрощённая геометрия из кэша
+        tolerance = self.context.get("simplify_tolerance")
+        zoom = self.context.get("simplify_zoom")
+        if zoom is not None:
+            tolerance = tolerance_for_zoom(zoom, reference_latitude(route))
+        if tolerance:
+            return get_simplified_points(route, tolerance, self._serialize_track)
+        return NavigationPointSerializer(route.get_points(), many=True).data
+
+    @staticmethod
+    def _serialize_track(track):
+        recorded_at_field = serializers.DateTimeField()
+        return [
+            {
+                "id": None,
+                "lat": lat,
+                "lng": lng,
+                "speed": speed,
+                "type": p_type,
+                "recorded_at": recorded_at_field.to_representation(recorded_at),
+            }
+            for lat, lng, speed, p_type, recorded_at in track
+        ]
+
+class DocumentAIJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DocumentAIJob
+        fields = ("id", "status", "attempts", "max_attempts", "result", "error", "created_at", "updated_at")
+        read_only_fields = fields
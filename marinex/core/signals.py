@@ -0,0 +1,20 @@
+# core/signals.py
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .document_ai import invalidate_catalog
+from .models import DocumentCategory, User, UserAccount
+
+
+@receiver([post_save, post_delete], sender=UserAccount)
+def user_account_changed(sender, instance, **kwargs):
+    # save() покрывает и soft_delete()/restore().
+    # Выданные JWT с этими членствами больше не годятся для записи
+    User.objects.filter(pk=instance.user_id).update(membership_version=F("membership_version") + 1)
+
+
+@receiver([post_save, post_delete], sender=DocumentCategory)
+def document_category_changed(sender, instance, **kwargs):
+    # Каталог категорий для промпта AI пересобирается при следующем запросе
+    invalidate_catalog()
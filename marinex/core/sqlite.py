@@ -0,0 +1,64 @@
+# core/sqlite.py
+"""
+SQLite production mode.
+
+Every new SQLite connection gets settings.SQLITE_PRAGMAS (WAL, synchronous=NORMAL,
+busy_timeout, mmap_size, cache_size, temp_store); transactions are opened with
+BEGIN IMMEDIATE through OPTIONS["transaction_mode"] in settings.DATABASES.
+
+WAL grows until it is checkpointed; sqlite_maintenance (cron, e.g. every
+15 minutes) runs checkpoint() and optimize().
+"""
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def is_sqlite(connection):
+    return connection.vendor == "sqlite"
+
+
+def is_memory(connection):
+    name = str(connection.settings_dict["NAME"])
+    return name == ":memory:" or "mode=memory" in name
+
+
+def apply_pragmas(connection, pragmas=None):
+    pragmas = getattr(settings, "SQLITE_PRAGMAS", {}) if pragmas is None else pragmas
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            if name == "journal_mode" and is_memory(connection):
+                # У базы в памяти журнал всегда "memory"
+                continue
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if is_sqlite(connection):
+        apply_pragmas(connection)
+
+
+def checkpoint(alias="default", mode="TRUNCATE"):
+    """
+    Переносит WAL в основной файл. TRUNCATE ещё и обрезает -wal до нуля.
+    Возвращает (busy, wal_pages, checkpointed_pages).
+    """
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f"PRAGMA wal_checkpoint({mode})")
+        return tuple(cursor.fetchone())
+
+
+def optimize(alias="default"):
+    with connections[alias].cursor() as cursor:
+        cursor.execute("PRAGMA optimize")
+
+
+def current_pragmas(alias="default"):
+    values = {}
+    with connections[alias].cursor() as cursor:
+        for name in getattr(settings, "SQLITE_PRAGMAS", {}):
+            cursor.execute(f"PRAGMA {name}")
+            values[name] = cursor.fetchone()[0]
+    return values
@@ -0,0 +1,344 @@
+# core/synthetic.py
+"""
+Deterministic production-shaped data for benchmarks and load tests.
+
+Everything, primary keys included, is drawn from a random.Random(seed), so
+the same seed gives the same fleet, and every table is filled with
+bulk_create in chunks. Model save() hooks do not run, so the fields they
+derive (category level, WorkMaterial.total_price, NavigationPoint.geohash,
+route stats) are filled in here.
+
+Catalog rows have fixed ids per seed and are inserted with ignore_conflicts,
+so generating more accounts with the same seed reuses them.
+
+Dates are offsets from base_time (DEFAULT_BASE_TIME unless given), not from
+the clock, so a seed produces the same rows whenever it is run.
+"""
+import math
+import random
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from .geohash import encode as encode_geohash
+from .models import (
+    Account, Boat, BoatAttachment, BoatBrand, BoatModel, Document, DocumentCategory,
+    DocumentPeriodization, DocumentStatus, Material, NavigationPoint, NavigationRoute, Port, Task,
+    TaskCategory, TaskStatus, User, UserAccount, Work, WorkCategory, WorkMaterial, WorkStatus,
+)
+from .navigation import STATS_FIELDS, apply_points_to_stats, reset_route_stats
+
+CHUNK_SIZE = 5000
+
+# Точка отсчёта дат: не timezone.now(), чтобы один seed давал одни и те же строки в любой день
+DEFAULT_BASE_TIME = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+# Стартовые точки треков: порты Балеарских островов и побережья
+HOME_PORTS = (
+    ("Palma", 39.5620, 2.6350),
+    ("Port d'Andratx", 39.5430, 2.3880),
+    ("Ibiza", 38.9110, 1.4420),
+    ("Mahón", 39.8880, 4.2660),
+    ("Barcelona", 41.3740, 2.1840),
+    ("Valencia", 39.4570, -0.3220),
+)
+
+CATEGORY_TREE = {
+    "Seguridad": {"Chalecos": [], "Bengalas": [], "Extintores": ["Polvo", "CO2"], "Balsa salvavidas": []},
+    "Motor": {"Aceite": [], "Filtros": ["Aceite", "Combustible", "Aire"], "Impulsor": [], "Correas": []},
+    "Casco": {"Antifouling": [], "Ánodos": [], "Pulido": []},
+    "Electricidad": {"Baterías": [], "Electrónica": ["Plotter", "VHF", "AIS"], "Luces de navegación": []},
+    "Documentación": {"Seguro": [], "ITB": [], "Licencia de navegación": []},
+}
+
+PERIODIZATIONS = (("Anual", 12), ("Semestral", 6), ("Bienal", 24), ("Quinquenal", 60), ("Sin caducidad", None))
+
+MATERIALS = (
+    ("Aceite motor 15W40", "l", "9.50"), ("Filtro de aceite", "ud", "18.00"),
+    ("Filtro de combustible", "ud", "24.00"), ("Impulsor bomba agua", "ud", "45.00"),
+    ("Ánodo de zinc", "ud", "32.00"), ("Antifouling", "l", "68.00"),
+    ("Correa alternador", "ud", "27.00"), ("Batería 100Ah", "ud", "190.00"),
+    ("Sikaflex 291", "ud", "21.00"), ("Cabo 12mm", "m", "3.20"),
+)
+
+Catalogs = namedtuple("Catalogs", [
+    "boat_models", "ports", "materials", "document_categories", "document_statuses",
+    "document_periodizations", "task_categories", "task_statuses", "work_categories", "work_statuses",
+])
+
+
+def new_id(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def chunked(iterable, size=CHUNK_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_insert(model, objects, chunk_size=CHUNK_SIZE, ignore_conflicts=False):
+    created = []
+    for chunk in chunked(objects, chunk_size):
+        created.extend(model.objects.bulk_create(chunk, ignore_conflicts=ignore_conflicts))
+    return created
+
+
+def _category_tree(rng, model):
+    # level считается в save(), а bulk_create его не вызывает; вставляем уровень за уровнем
+    leaves = []
+    level = [(None, name, children) for name, children in CATEGORY_TREE.items()]
+    depth = 0
+    while level:
+        nodes = [model(id=new_id(rng), name=name, parent=parent, level=depth) for parent, name, _ in level]
+        bulk_insert(model, nodes, ignore_conflicts=True)
+        next_level = []
+        for node, (_, _, children) in zip(nodes, level):
+            if not children:
+                leaves.append(node)
+            items = children.items() if isinstance(children, dict) else ((name, []) for name in children)
+            next_level.extend((node, name, grandchildren) for name, grandchildren in items)
+        level = next_level
+        depth += 1
+    return leaves
+
+
+def _statuses(model, pairs):
+    # code уникален: существующие статусы переиспользуем
+    return [model.objects.get_or_create(code=code, defaults={"name": name})[0] for code, name in pairs]
+
+
+def seed_catalogs(rng):
+    brands = bulk_insert(BoatBrand, [BoatBrand(id=new_id(rng), name=name) for name in (
+        "Beneteau", "Jeanneau", "Bavaria", "Lagoon", "Sunseeker", "Azimut", "Quicksilver",
+    )], ignore_conflicts=True)
+    boat_models = bulk_insert(BoatModel, [
+        BoatModel(
+            id=new_id(rng),
+            brand=brand,
+            name=f"{brand.name} {rng.randint(20, 60)}.{i}",
+            year_start=rng.randint(1995, 2022),
+            length=Decimal(rng.randint(600, 2000)) / 100,
+            width=Decimal(rng.randint(200, 600)) / 100,
+            draft=Decimal(rng.randint(50, 250)) / 100,
+        )
+        for brand in brands for i in range(8)
+    ], ignore_conflicts=True)
+    return Catalogs(
+        boat_models=boat_models,
+        ports=bulk_insert(Port, [Port(id=new_id(rng), name=name) for name, _, _ in HOME_PORTS],
+                          ignore_conflicts=True),
+        materials=bulk_insert(Material, [
+            Material(id=new_id(rng), name=name, unit=unit, price_per_unit=Decimal(price))
+            for name, unit, price in MATERIALS
+        ], ignore_conflicts=True),
+        document_categories=_category_tree(rng, DocumentCategory),
+        document_statuses=bulk_insert(DocumentStatus, [
+            DocumentStatus(id=new_id(rng), name=name) for name in ("valid", "expired", "pending", "missing")
+        ], ignore_conflicts=True),
+        document_periodizations=bulk_insert(DocumentPeriodization, [
+            DocumentPeriodization(id=new_id(rng), name=name, months=months) for name, months in PERIODIZATIONS
+        ], ignore_conflicts=True),
+        task_categories=_category_tree(rng, TaskCategory),
+        task_statuses=_statuses(TaskStatus, (("todo", "To Do"), ("in_progress", "In Progress"), ("done", "Done"))),
+        work_categories=_category_tree(rng, WorkCategory),
+        work_statuses=_statuses(WorkStatus, (
+            ("planned", "Planned"), ("in_progress", "In Progress"), ("completed", "Completed"),
+        )),
+    )
+
+
+def make_user(username, rng=None, password_hash=None):
+    """
+    password_hash: готовый хэш (make_password), чтобы не считать PBKDF2 на каждого пользователя.
+    """
+    if password_hash is None:
+        return User.objects.create_user(username=username, email=f"{username}@example.com", password=username)
+    return User.objects.create(
+        id=new_id(rng) if rng else uuid.uuid4(),
+        username=username,
+        email=f"{username}@example.com",
+        password=password_hash,
+    )
+
+
+def _documents(rng, catalogs, boat, count, now):
+    for i in range(count):
+        periodization = rng.choice(catalogs.document_periodizations)
+        issued = now - timedelta(days=rng.randint(0, 5 * 365))
+        expires = None
+        if periodization.months:
+            expires = issued + timedelta(days=round(periodization.months * 30.44))
+        yield Document(
+            id=new_id(rng),
+            boat=boat,
+            category=rng.choice(catalogs.document_categories),
+            status=rng.choice(catalogs.document_statuses),
+            periodization=periodization,
+            name=f"Document {i + 1}",
+            expiration_date=expires,
+            no_expiration=expires is None,
+        )
+
+
+def _work_materials(rng, catalogs, works, per_work):
+    for work in works:
+        for material in rng.sample(catalogs.materials, min(rng.randint(0, per_work * 2), len(catalogs.materials))):
+            quantity = Decimal(rng.randint(1, 200)) / 10
+            yield WorkMaterial(
+                id=new_id(rng),
+                work=work,
+                material=material,
+                quantity=quantity,
+                total_price=(material.price_per_unit * quantity).quantize(Decimal("0.01")),
+            )
+
+
+def seed_account(rng, catalogs, name, user=None, boats=10, tasks_per_boat=20, works_per_boat=10,
+                 documents_per_boat=10, attachments_per_boat=3, materials_per_work=2,
+                 routes_per_boat=0, points_per_route=0, chunk_size=CHUNK_SIZE, base_time=DEFAULT_BASE_TIME):
+    """
+    Аккаунт с флотом: лодки с вложениями, работы с материалами, задачи (часть
+    привязана к работам), документы с периодичностью и маршруты с треками.
+    """
+    now = base_time
+    account = Account.objects.create(id=new_id(rng), name=name)
+    if user is not None:
+        UserAccount.objects.create(id=new_id(rng), user=user, account=account)
+
+    boat_objects = []
+    for i in range(boats):
+        model = rng.choice(catalogs.boat_models)
+        boat_objects.append(Boat(
+            id=new_id(rng),
+            account=account,
+            model=model,
+            name=f"{name} #{i + 1}",
+            registration_number=f"7{rng.randint(0, 9)}-{rng.choice('ABCDEFGHPM')}-{rng.randint(1, 9999):04d}",
+            port=rng.choice(catalogs.ports),
+            year=model.year_start,
+            length=model.length,
+            width=model.width,
+            draft=model.draft,
+        ))
+    boat_list = bulk_insert(Boat, boat_objects, chunk_size)
+
+    bulk_insert(BoatAttachment, (
+        BoatAttachment(
+            id=new_id(rng),
+            boat=boat,
+            attachment_type="photo" if i else "document",
+            order=i,
+            external_id=f"ext-{rng.getrandbits(48):012x}",
+        )
+        for boat in boat_list for i in range(attachments_per_boat)
+    ), chunk_size)
+
+    works = bulk_insert(Work, (
+        Work(
+            id=new_id(rng),
+            account=account,
+            boat=boat,
+            category=rng.choice(catalogs.work_categories),
+            status=rng.choice(catalogs.work_statuses),
+            title=f"Work {i + 1}",
+            cost_estimate=Decimal(rng.randint(5000, 500000)) / 100,
+            start_date=now - timedelta(days=rng.randint(0, 720)),
+        )
+        for boat in boat_list for i in range(works_per_boat)
+    ), chunk_size)
+    bulk_insert(WorkMaterial, _work_materials(rng, catalogs, works, materials_per_work), chunk_size)
+
+    works_by_boat = {}
+    for work in works:
+        works_by_boat.setdefault(work.boat_id, []).append(work)
+
+    bulk_insert(Task, (
+        Task(
+            id=new_id(rng),
+            account=account,
+            boat=boat,
+            work=rng.choice(works_by_boat[boat.id]) if works_by_boat.get(boat.id) and rng.random() < 0.5 else None,
+            category=rng.choice(catalogs.task_categories),
+            status=rng.choice(catalogs.task_statuses),
+            title=f"Task {i + 1}",
+            priority=rng.choice(("low", "medium", "high")),
+            due_date=now + timedelta(days=rng.randint(-180, 365)),
+        )
+        for boat in boat_list for i in range(tasks_per_boat)
+    ), chunk_size)
+
+    bulk_insert(Document, (
+        document for boat in boat_list for document in _documents(rng, catalogs, boat, documents_per_boat, now)
+    ), chunk_size)
+
+    for boat in boat_list:
+        for _ in range(routes_per_boat):
+            seed_route(rng, boat, points_per_route, chunk_size=chunk_size, base_time=base_time)
+    return account, boat_list
+
+
+def generate_track(rng, lat, lng, start, count, interval_s=5):
+    """
+    Правдоподобный GPS-трек: скорость и курс меняются плавно, иногда стоянки.
+    Yields (lat, lng, speed, type, recorded_at).
+    """
+    heading = rng.uniform(0, 2 * math.pi)
+    speed = rng.uniform(2, 6)
+    stopped = 0
+    for i in range(count):
+        if stopped:
+            stopped -= 1
+            p_type, current_speed = "stop", 0.0
+        else:
+            heading += rng.gauss(0, 0.08)
+            speed = min(max(speed + rng.gauss(0, 0.2), 0.5), 12)
+            current_speed = speed
+            p_type = "gps"
+            if rng.random() < 0.0005:
+                stopped = rng.randint(10, 120)
+        if i == 0:
+            p_type = "start"
+        elif i == count - 1:
+            p_type = "end"
+
+        distance = current_speed * interval_s
+        lat += distance * math.cos(heading) / 111320
+        lng += distance * math.sin(heading) / (111320 * math.cos(math.radians(lat)))
+        yield lat, lng, round(current_speed, 2), p_type, start + timedelta(seconds=i * interval_s)
+
+
+def seed_route(rng, boat, points, start=None, chunk_size=CHUNK_SIZE, base_time=DEFAULT_BASE_TIME):
+    """
+    Маршрут с points точками; статистика считается по ходу вставки, как при ingest.
+    """
+    _, lat, lng = rng.choice(HOME_PORTS)
+    start = start or base_time - timedelta(days=rng.randint(1, 365), seconds=rng.randint(0, 86400))
+    route = NavigationRoute.objects.create(
+        id=new_id(rng),
+        account_id=boat.account_id,
+        boat=boat,
+        name=f"{boat.name} {start:%Y-%m-%d}",
+        start_time=start,
+    )
+    reset_route_stats(route)
+
+    for chunk in chunked(generate_track(rng, lat, lng, start, points), chunk_size):
+        NavigationPoint.objects.bulk_create([
+            NavigationPoint(
+                id=new_id(rng), route=route, lat=p_lat, lng=p_lng, speed=speed, type=p_type,
+                recorded_at=recorded_at, geohash=encode_geohash(p_lat, p_lng),
+            )
+            for p_lat, p_lng, speed, p_type, recorded_at in chunk
+        ])
+        apply_points_to_stats(route, chunk)
+
+    route.end_time = route.last_recorded_at
+    route.save(update_fields=list(STATS_FIELDS) + ["end_time", "updated_at"])
+    return route
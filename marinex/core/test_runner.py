@@ -0,0 +1,18 @@
+# core/test_runner.py
+"""
+Test runner that leaves out the long API benchmarks (tag "benchmark") unless
+they are asked for: python manage.py test --tag benchmark, or MARINEX_BENCHMARK=1.
+"""
+import os
+
+from django.test.runner import DiscoverRunner
+
+BENCHMARK_TAG = "benchmark"
+
+
+class MarinexTestRunner(DiscoverRunner):
+    def __init__(self, *args, tags=None, exclude_tags=None, **kwargs):
+        exclude_tags = set(exclude_tags or ())
+        if BENCHMARK_TAG not in (tags or ()) and not os.environ.get("MARINEX_BENCHMARK"):
+            exclude_tags.add(BENCHMARK_TAG)
+        super().__init__(*args, tags=tags, exclude_tags=exclude_tags, **kwargs)
@@ -1,3 +1,1600 @@
-from django.test import TestCase
+import asyncio
+import atexit
+import fcntl
+import importlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.utils import load_backend
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core import ai_cache, ai_jobs, db_router, document_ai, geohash, ingest_buffer, live, metrics, navigation, synthetic, track_codec, views
+from core.authentication import ClaimsJWTAuthentication, MarinexTokenObtainPairSerializer
+from core.middleware import CurrentUserMiddleware, get_current_user
+from core.models import Account, Boat, Document, DocumentAIJob, DocumentCategory, NavigationPoint, NavigationRoute, User, UserAccount
+from core.navigation import RouteArchived, record_points
+
+
+def make_member(username):
+    # make_password(None) — без PBKDF2, пароль тестам не нужен
+    user = synthetic.make_user(username, password_hash=make_password(None))
+    account = Account.objects.create(name=f"{username} fleet")
+    UserAccount.objects.create(user=user, account=account)
+    boat = Boat.objects.create(account=account, name=f"{username} boat")
+    user.refresh_from_db()  # membership_version поднят сигналом UserAccount
+    return user, account, boat
+
+
+def api_client(user):
+    token = MarinexTokenObtainPairSerializer.get_token(user).access_token
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    return client
+
+
+def make_route(boat, points=(), **kwargs):
+    """
+    points: (lat, lng, speed, recorded_at)
+    """
+    route = NavigationRoute.objects.create(account=boat.account, boat=boat, **kwargs)
+    record_points(route, [
+        NavigationPoint(route=route, lat=lat, lng=lng, speed=speed, recorded_at=recorded_at)
+        for lat, lng, speed, recorded_at in points
+    ])
+    return route
+
+
+# Холодный старт воркера: импорт settings + URLconf (все views) в чистом процессе
+STARTUP_SCRIPT = """
+import os, resource, sys
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "marinex.settings")
+import django
+django.setup()
+import marinex.urls
+# ru_maxrss после vfork/exec наследует пик родителя (большого тестового процесса)
+try:
+    with open("/proc/self/status") as f:
+        rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+except OSError:
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print("RSS_KB", rss_kb)
+print("MODULES", " ".join(sorted(sys.modules)))
+"""
+
+# Не должны грузиться при старте: нужны только при анализе документов
+HEAVY_MODULES = ("google.generativeai", "grpc", "google.protobuf")
+
+IMPORT_BUDGET_MS = float(os.environ.get("MARINEX_IMPORT_BUDGET_MS", 1500))
+RSS_BUDGET_MB = float(os.environ.get("MARINEX_IMPORT_RSS_BUDGET_MB", 120))
+
+
+class WorkerStartupTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        cls.import_times = {}
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if line.startswith("import time:") and "|" in line:
+                _, cumulative, name = line[len("import time:"):].split("|")
+                if cumulative.strip().isdigit():
+                    cls.import_times[name.strip()] = int(cumulative) / 1000
+        output = dict(line.split(" ", 1) for line in result.stdout.splitlines())
+        cls.rss_mb = int(output["RSS_KB"]) / 1024
+        cls.modules = set(output["MODULES"].split())
+
+    def test_ai_sdk_not_imported_at_startup(self):
+        loaded = sorted(m for m in self.modules if m.startswith(HEAVY_MODULES))
+        self.assertEqual(loaded, [], "AI SDK is imported at worker startup")
+
+    def test_urlconf_import_time_within_budget(self):
+        self.assertLess(self.import_times["marinex.urls"], IMPORT_BUDGET_MS)
+
+    def test_startup_rss_within_budget(self):
+        self.assertLess(self.rss_mb, RSS_BUDGET_MB)
+
+
+# Бюджеты эндпоинтов: время (медиана), число SQL-запросов, пик памяти (tracemalloc)
+BUDGETS_PATH = Path(__file__).with_name("benchmark_budgets.json")
+# JSON с результатами прогона для сравнения во времени: MARINEX_BENCH_OUTPUT=bench.json
+BENCH_OUTPUT = os.environ.get("MARINEX_BENCH_OUTPUT")
+BENCH_POINTS = int(os.environ.get("MARINEX_BENCH_POINTS", 100000))
+BENCH_REPEATS = int(os.environ.get("MARINEX_BENCH_REPEATS", 3))
+# Время зависит от машины: по умолчанию проверяются только запросы и память
+BENCH_WALL = os.environ.get("MARINEX_BENCH_WALL") == "1"
+BENCH_METRICS = ("wall_ms", "queries", "peak_kb") if BENCH_WALL else ("queries", "peak_kb")
+
+
+@tag("benchmark")
+class ApiBenchmarkTests(TestCase):
+    """
+    Основные эндпоинты на реалистичных объёмах. Долго, поэтому по умолчанию не
+    запускаются (core/test_runner.py): python manage.py test --tag benchmark.
+    Бюджет wall_ms проверяется только с MARINEX_BENCH_WALL=1
+    """
+    results = []
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(20240601)
+        catalogs = synthetic.seed_catalogs(rng)
+        cls.user = synthetic.make_user("bench")
+        _, cls.boats = synthetic.seed_account(
+            rng, catalogs, "Bench fleet", user=cls.user,
+            boats=40, tasks_per_boat=75, works_per_boat=30, documents_per_boat=30,
+        )
+        # Чужие аккаунты: данные, которые запросы должны отфильтровать
+        for i in range(3):
+            synthetic.seed_account(rng, catalogs, f"Other fleet {i}", user=synthetic.make_user(f"other{i}"))
+        cls.route = synthetic.seed_route(rng, cls.boats[0], BENCH_POINTS)
+        cls.budgets = json.loads(BUDGETS_PATH.read_text())
+
+    @classmethod
+    def tearDownClass(cls):
+        if BENCH_OUTPUT and cls.results:
+            Path(BENCH_OUTPUT).write_text(json.dumps({
+                "timestamp": datetime.now(dt_timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "database": connection.vendor,
+                "points": BENCH_POINTS,
+                "repeats": BENCH_REPEATS,
+                "results": sorted(cls.results, key=lambda r: r["name"]),
+            }, indent=2))
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user.refresh_from_db()
+        token = MarinexTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def fetch(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        if response.streaming:
+            # Поток не склеиваем: иначе пик памяти мерил бы тест, а не view
+            return sum(len(chunk) for chunk in response.streaming_content)
+        return len(response.content)
+
+    def measure(self, name, url):
+        self.fetch(url)  # прогрев: кэш членств, каталога, скомпилированные шаблоны URL
+
+        timings = []
+        for _ in range(BENCH_REPEATS):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                size = self.fetch(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            query_count = len(queries)
+
+        # Отдельный прогон: tracemalloc сам замедляет выполнение
+        tracemalloc.start()
+        try:
+            self.fetch(url)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        result = {
+            "name": name,
+            "url": url,
+            "wall_ms": round(statistics.median(timings), 2),
+            "queries": query_count,
+            "peak_kb": round(peak / 1024),
+            "response_bytes": size,
+        }
+        self.results.append(result)
+
+        budget = self.budgets[name]
+        over = [
+            f"{metric}={result[metric]} > {budget[metric]}"
+            for metric in BENCH_METRICS
+            if result[metric] > budget[metric]
+        ]
+        self.assertFalse(over, f"{name} over budget: {', '.join(over)}")
+
+    def test_boat_list(self):
+        self.measure("boat_list", "/api/boats/")
+
+    def test_boat_tasks(self):
+        self.measure("boat_tasks", f"/api/boats/{self.boats[0].id}/tasks/")
+
+    def test_boat_works(self):
+        self.measure("boat_works", f"/api/boats/{self.boats[0].id}/works/")
+
+    def test_boat_documents(self):
+        self.measure("boat_documents", f"/api/boats/{self.boats[0].id}/documents/")
+
+    def test_route_list(self):
+        self.measure("route_list", f"/api/boats/{self.boats[0].id}/bitacora/")
+
+    def test_route_detail(self):
+        self.measure("route_detail", f"/api/boats/{self.boats[0].id}/bitacora/{self.route.id}/")
+
+    def test_route_detail_simplified(self):
+        self.measure("route_detail_simplified", f"/api/boats/{self.boats[0].id}/bitacora/{self.route.id}/?zoom=12")
+
+    def test_route_points_window(self):
+        self.measure("route_points_window", f"/api/boats/{self.boats[0].id}/bitacora/{self.route.id}/points/")
+
+    def test_gpx_export(self):
+        self.measure("gpx_export", f"/api/navigation/route/{self.route.id}/export/gpx/")
+
+    def test_catalog_brands(self):
+        self.measure("catalog_brands", "/api/brands/")
+
+    def test_catalog_models(self):
+        self.measure("catalog_models", "/api/models/")
+
+    def test_catalog_ports(self):
+        self.measure("catalog_ports", "/api/ports/")
+
+    def test_catalog_document_categories(self):
+        self.measure("catalog_document_categories", "/api/document-categories/")
+
+    def test_catalog_task_categories(self):
+        self.measure("catalog_task_categories", "/api/task-categories/")
+
+    def test_catalog_work_categories(self):
+        self.measure("catalog_work_categories", "/api/work-categories/")
+
+
+class NavigationExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, _, cls.boat = make_member("exporter")
+        start = datetime(2024, 6, 1, 10, 0, tzinfo=dt_timezone.utc)
+        cls.route = make_route(cls.boat, [
+            (39.5, 2.6, 3.5, start),
+            (39.6, 2.7, None, start + timedelta(seconds=5)),
+        ], name="Palma")
+
+    def test_gpx_speed_in_extensions(self):
+        response = api_client(self.user).get(f"/api/navigation/route/{self.route.id}/export/gpx/")
+        self.assertEqual(response.status_code, 200)
+        root = ET.fromstring(b"".join(response.streaming_content))
+        ns = {"gpx": "http://www.topografix.com/GPX/1/1", "tpx": views.GPX_TRACKPOINT_EXTENSION_NS}
+        points = root.findall(".//gpx:trkpt", ns)
+        self.assertEqual(len(points), 2)
+        # В GPX 1.1 у trkpt нет собственного <speed>
+        self.assertIsNone(points[0].find("gpx:speed", ns))
+        self.assertEqual(points[0].find("gpx:extensions/tpx:TrackPointExtension/tpx:speed", ns).text, "3.5")
+        self.assertIsNone(points[1].find("gpx:extensions", ns))
+
+    def test_other_account_gets_404(self):
+        outsider, _, _ = make_member("outsider")
+        for fmt in ("gpx", "kml"):
+            response = api_client(outsider).get(f"/api/navigation/route/{self.route.id}/export/{fmt}/")
+            self.assertEqual(response.status_code, 404, fmt)
+
+
+class TrackCodecTests(SimpleTestCase):
+    start = datetime(2024, 6, 1, 10, 0, 0, 123456, tzinfo=dt_timezone.utc)
+
+    def test_round_trip_preserves_microseconds_and_deltas(self):
+        track = [
+            (39.562001, 2.635001, 3.25, "start", self.start),
+            (39.562104, 2.634907, None, "gps", self.start + timedelta(seconds=5, microseconds=1)),
+            (39.561999, 2.635102, 0.0, "stop", self.start + timedelta(seconds=5, microseconds=1)),
+            (39.562500, 2.636000, 11.5, "end", self.start + timedelta(hours=3, microseconds=999999)),
+        ]
+        self.assertEqual(list(track_codec.decode_track(track_codec.encode_track(track))), track)
+
+    def test_negative_coordinates(self):
+        track = [
+            (-33.856784, -151.215297, 1.0, "gps", self.start),
+            (-33.856001, 151.215297, 2.0, "gps", self.start + timedelta(seconds=1)),
+            (0.000001, -0.000001, None, "gps", self.start + timedelta(seconds=2)),
+        ]
+        decoded = list(track_codec.decode_track(track_codec.encode_track(track)))
+        self.assertEqual(decoded, track)
+
+    def test_empty_track(self):
+        blob = track_codec.encode_track([])
+        self.assertEqual(list(track_codec.decode_track(blob)), [])
+        self.assertEqual(track_codec.track_point_count(blob), 0)
+
+    def test_short_blob_is_codec_error(self):
+        for blob in (b"", b"MX", b"MXT"):
+            with self.assertRaises(track_codec.TrackCodecError):
+                list(track_codec.decode_track(blob))
+
+    def test_decoding_resumes_from_position(self):
+        track = [
+            (39.5 + i * 0.001, 2.6 - i * 0.002, float(i), "gps", self.start + timedelta(seconds=i // 2)) for i in range(6)
+        ]
+        blob = track_codec.encode_track(track)
+        decoded = list(track_codec.decode_track_positions(blob))
+        points = [point for _, point in decoded]
+        for index, (position, point) in enumerate(decoded):
+            resumed = track_codec.decode_track_positions(blob, position + (point[4],))
+            self.assertEqual([point for _, point in resumed], points[index + 1:])
+
+        with self.assertRaises(track_codec.TrackCodecError):
+            list(track_codec.decode_track_positions(blob, (1, len(blob) + 1, 0, 0, self.start)))
+
+    def test_version_1_blobs_still_decode(self):
+        # v1: время в миллисекундах
+        blob = bytearray(b"MXT\x01\x01")
+        for value in (0, 0, 1717236000123, 0):
+            track_codec._write_varint(blob, value)
+        blob.append(0)
+        (point,) = track_codec.decode_track(bytes(blob))
+        self.assertEqual(point[4], datetime(2024, 6, 1, 10, 0, 0, 123000, tzinfo=dt_timezone.utc))
+
+
+class RouteArchiveTests(TestCase):
+    def test_archive_deletes_only_encoded_points(self):
+        _, _, boat = make_member("archiver")
+        start = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        route = make_route(boat, [(39.5, 2.6, 1.0, start), (39.6, 2.7, 2.0, start + timedelta(seconds=5))])
+        other = make_route(boat, [(40.0, 3.0, 1.0, start)])
+
+        route.archive()
+
+        self.assertFalse(NavigationPoint.objects.filter(route=route).exists())
+        self.assertEqual(NavigationPoint.objects.filter(route=other).count(), 1)
+        self.assertEqual([p[4] for p in route.iter_track()], [start, start + timedelta(seconds=5)])
+
+    def test_archive_command_archives_each_ended_route(self):
+        _, _, boat = make_member("archive-cmd")
+        start = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        ended = [
+            make_route(boat, [(39.5 + i / 10, 2.6, 1.0, start + timedelta(seconds=i)) for i in range(3)], end_time=start)
+            for _ in range(2)
+        ]
+        ongoing = make_route(boat, [(39.5, 2.6, 1.0, start)])
+
+        out = io.StringIO()
+        call_command("archive_routes", "--days", "1", stdout=out)
+
+        self.assertIn("Маршрутов: 2, точек: 6", out.getvalue())
+        for route in ended:
+            route.refresh_from_db()
+            self.assertTrue(route.is_archived)
+            self.assertEqual(len(list(route.iter_track())), 3)
+        self.assertFalse(NavigationPoint.objects.filter(route__in=ended).exists())
+        self.assertEqual(NavigationPoint.objects.filter(route=ongoing).count(), 1)
+
+        # Пересчёт статистики по архивным и живым маршрутам
+        NavigationRoute.all_objects.update(point_count=0)
+        call_command("recompute_route_stats", stdout=io.StringIO())
+        self.assertEqual(
+            sorted(NavigationRoute.all_objects.filter(boat=boat).values_list("point_count", flat=True)), [1, 3, 3]
+        )
+
+    def test_points_after_archiving_are_rejected(self):
+        user, _, boat = make_member("late-points")
+        start = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        route = make_route(boat, [(39.5, 2.6, 1.0, start)])
+        stale = NavigationRoute.objects.get(pk=route.pk)
+        route.archive()
+
+        # Экземпляр, загруженный до архивации (гонка с проверкой во view, буфер, импорт)
+        with self.assertRaises(RouteArchived):
+            record_points(stale, [NavigationPoint(route=stale, lat=39.6, lng=2.7, recorded_at=start + timedelta(seconds=5))])
+        self.assertFalse(NavigationPoint.objects.filter(route=route).exists())
+
+        response = api_client(user).post(
+            f"/api/navigation/route/{route.id}/point/bulk/", {"points": [{"lat": 39.6, "lng": 2.7}]}, format="json"
+        )
+        self.assertEqual(response.status_code, 409)
+
+
+class RouteStatsTests(TestCase):
+    START = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+    # 0.001° долготы на экваторе
+    STEP_M = navigation.haversine_m(0, 0, 0, 0.001)
+
+    def fix(self, lng, seconds, speed=None, lat=0.0):
+        return (lat, lng, speed, "gps", self.START + timedelta(seconds=seconds))
+
+    def fold(self, *batches):
+        route = NavigationRoute()
+        navigation.reset_route_stats(route)
+        for batch in batches:
+            navigation.apply_points_to_stats(route, batch)
+        return route
+
+    def stats(self, route):
+        return {field: getattr(route, field) for field in navigation.STATS_FIELDS}
+
+    def test_running_distance_and_moving_time(self):
+        route = self.fold(
+            [self.fix(0.0, 0, speed=5.0), self.fix(0.001, 10)],
+            # Пауза больше MOVING_MAX_GAP_S: дистанция идёт, время хода — нет
+            [self.fix(0.002, 10 + navigation.MOVING_MAX_GAP_S + 1)],
+            # Медленнее MOVING_MIN_SPEED_MS
+            [self.fix(0.002, 700, lat=0.000001)],
+        )
+
+        self.assertEqual(route.point_count, 4)
+        self.assertAlmostEqual(route.distance_m, 2 * self.STEP_M, delta=1)
+        self.assertEqual(route.moving_time_s, 10)
+        self.assertEqual(route.max_speed, 5.0)
+        self.assertEqual(route.last_recorded_at, self.START + timedelta(seconds=700))
+
+    def test_out_of_order_fix_counts_for_bbox_but_not_distance(self):
+        route = self.fold([self.fix(0.0, 0), self.fix(0.002, 20)], [self.fix(0.005, 10, lat=-0.001)])
+
+        self.assertEqual(route.point_count, 3)
+        self.assertAlmostEqual(route.distance_m, 2 * self.STEP_M, delta=1)
+        self.assertEqual(route.bbox, [0.0, -0.001, 0.005, 0.0])
+        self.assertEqual(route.first_recorded_at, self.START)
+        self.assertEqual((route.last_lng, route.last_recorded_at), (0.002, self.START + timedelta(seconds=20)))
+
+        # Пересчёт учитывает опоздавший фикс в дистанции
+        recomputed = self.fold([self.fix(0.0, 0), self.fix(0.005, 10, lat=-0.001), self.fix(0.002, 20)])
+        self.assertGreater(recomputed.distance_m, route.distance_m)
+
+    def test_recompute_matches_incremental_ingest(self):
+        _, _, boat = make_member("stats")
+        route = make_route(boat, [(0.0, 0.001 * i, 1.0 + i, self.START + timedelta(seconds=10 * i)) for i in range(3)])
+        record_points(route, [
+            NavigationPoint(route=route, lat=0.001, lng=0.001 * i, speed=2.0, recorded_at=self.START + timedelta(seconds=10 * i))
+            for i in range(3, 6)
+        ])
+        incremental = self.stats(NavigationRoute.objects.get(pk=route.pk))
+
+        navigation.recompute_route_stats(route)
+        self.assertEqual(self.stats(route), incremental)
+        self.assertEqual(self.stats(NavigationRoute.objects.get(pk=route.pk)), incremental)
+
+        route.archive()
+        navigation.recompute_route_stats(route)
+        recomputed = self.stats(route)
+        # Кодек округляет координаты до 1e-6°
+        self.assertAlmostEqual(recomputed.pop("distance_m"), incremental.pop("distance_m"), delta=1)
+        self.assertEqual(recomputed, incremental)
+
+    def test_migration_backfills_routes_created_before_stats(self):
+        backfill = importlib.import_module("core.migrations.0018_backfill_route_stats")
+        _, _, boat = make_member("legacy")
+        live_route = make_route(boat, [(0.0, 0.001 * i, 1.0, self.START + timedelta(seconds=10 * i)) for i in range(3)])
+        archived = make_route(boat, [(0.0, 0.001 * i, 1.0, self.START + timedelta(seconds=10 * i)) for i in range(3)])
+        archived.archive()
+        expected = {route.pk: self.stats(NavigationRoute.objects.get(pk=route.pk)) for route in (live_route, archived)}
+        NavigationRoute.all_objects.update(point_count=0, distance_m=0, moving_time_s=0, min_lat=None, last_recorded_at=None)
+
+        backfill.fill_route_stats(django_apps, None)
+
+        for pk, stats in expected.items():
+            backfilled = self.stats(NavigationRoute.all_objects.get(pk=pk))
+            self.assertAlmostEqual(backfilled.pop("distance_m"), stats.pop("distance_m"), delta=1)
+            self.assertEqual(backfilled, stats)
+
+
+class SimplifiedTrackTests(TestCase):
+    def setUp(self):
+        user, _, self.boat = make_member("simplifier")
+        self.client = api_client(user)
+        self.start = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        self.route = make_route(self.boat, [
+            (39.5 + i * 0.001, 2.6, 1.0, self.start + timedelta(seconds=5 * i)) for i in range(10)
+        ])
+        self.url = f"/api/boats/{self.boat.id}/bitacora/{self.route.id}/"
+
+    def test_non_finite_tolerance_and_zoom_are_400(self):
+        for query in ("tolerance=nan", "tolerance=inf", "zoom=nan", "zoom=-inf", "zoom=abc"):
+            response = self.client.get(f"{self.url}?{query}")
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_new_points_change_cached_simplification(self):
+        first = self.client.get(f"{self.url}?tolerance=5").json()["points"]
+        record_points(self.route, [NavigationPoint(
+            route=self.route, lat=39.6, lng=2.7, speed=1.0, type="gps",
+            recorded_at=self.start + timedelta(minutes=5),
+        )])
+        second = self.client.get(f"{self.url}?tolerance=5").json()["points"]
+        self.assertEqual(len(second), len(first) + 1)
+
+
+class RoutePointsPaginationTests(TestCase):
+    def setUp(self):
+        user, _, self.boat = make_member("pager")
+        self.client = api_client(user)
+        start = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        # Пары точек с одинаковым временем: страница из 3 режет пару пополам
+        self.route = make_route(self.boat, [
+            (39.5 + i * 0.001, 2.6, 1.0, start + timedelta(seconds=5 * (i // 2))) for i in range(8)
+        ])
+        self.url = f"/api/boats/{self.boat.id}/bitacora/{self.route.id}/points/"
+
+    def collect(self, url):
+        results = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            results += response.json()["results"]
+            url = response.json()["next"]
+        return results
+
+    def test_keyset_cursor_keeps_points_with_equal_timestamps(self):
+        results = self.collect(f"{self.url}?limit=3")
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len({point["id"] for point in results}), 8)
+
+    def test_archived_route_pages_and_accepts_naive_datetimes(self):
+        self.route.archive()
+        self.assertEqual(len(self.collect(f"{self.url}?limit=3")), 8)
+        response = self.client.get(f"{self.url}?after=2024-06-01T00:00:05&before=2024-06-01T00:00:15")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+    def test_archived_pages_resume_decoding_at_cursor(self):
+        self.route.archive()
+        decoded = []
+
+        def counting(data, position=None):
+            for item in track_codec.decode_track_positions(data, position):
+                decoded.append(item[0][0])
+                yield item
+
+        with mock.patch.object(views, "decode_track_positions", counting):
+            results = self.collect(f"{self.url}?limit=3")
+        self.assertEqual(len(results), 8)
+        # Каждая страница декодирует только свои точки и одну лишнюю для next
+        self.assertEqual(decoded, [1, 2, 3, 4, 4, 5, 6, 7, 7, 8])
+
+        # Курсор старого формата (номер точки) продолжает работать
+        legacy = views.encode_points_cursor(datetime(2024, 6, 1, tzinfo=dt_timezone.utc), 2)
+        self.assertEqual(len(self.collect(f"{self.url}?cursor={legacy}")), 5)
+        broken = views.encode_points_cursor(datetime(2024, 6, 1, tzinfo=dt_timezone.utc), (1, 10 ** 6, 0, 0))
+        self.assertEqual(self.client.get(f"{self.url}?cursor={broken}").status_code, 400)
+
+    def test_invalid_cursor_is_400(self):
+        self.assertEqual(self.client.get(f"{self.url}?cursor=bm9wZQ").status_code, 400)
+
+
+@override_settings(NAVIGATION_LIVE_POLL_INTERVAL_S=0.05, NAVIGATION_LIVE_KEEPALIVE_S=0.05)
+class NavigationLiveStreamTests(TestCase):
+    def setUp(self):
+        self.user, _, self.boat = make_member("streamer")
+        self.start = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        self.route = make_route(self.boat, [(39.5, 2.6, 1.0, self.start), (39.6, 2.7, 1.0, self.start)])
+        self.url = f"/api/navigation/route/{self.route.id}/live/"
+
+    def ticket(self, route=None):
+        response = api_client(self.user).post(f"/api/navigation/route/{(route or self.route).id}/live/ticket/")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["ticket"]
+
+    async def read_points(self, stream, count):
+        points = []
+        for _ in range(100):
+            if len(points) >= count:
+                break
+            chunk = (await asyncio.wait_for(anext(stream), 5)).decode()
+            points += [json.loads(line[6:]) for line in chunk.splitlines() if line.startswith("data: ")]
+        return points
+
+    def test_wsgi_request_is_rejected(self):
+        self.assertEqual(self.client.get(f"{self.url}?ticket={self.ticket()}").status_code, 503)
+
+    async def test_jwt_in_query_string_is_not_accepted(self):
+        token = await sync_to_async(lambda: str(MarinexTokenObtainPairSerializer.get_token(self.user).access_token))()
+        response = await self.async_client.get(f"{self.url}?token={token}")
+        self.assertEqual(response.status_code, 401)
+
+    async def test_ticket_is_bound_to_route(self):
+        other = await sync_to_async(make_route)(self.boat)
+        ticket = await sync_to_async(self.ticket)(other)
+        response = await self.async_client.get(f"{self.url}?ticket={ticket}")
+        self.assertEqual(response.status_code, 401)
+
+    @mock.patch.object(live, "_broker", live.InProcessBroker())
+    async def test_points_with_equal_timestamps_are_streamed(self):
+        ticket = await sync_to_async(self.ticket)()
+        since = (self.start - timedelta(seconds=1)).isoformat()
+        response = await self.async_client.get(self.url, {"ticket": ticket, "since": since})
+        self.assertEqual(response.status_code, 200)
+        events = response._iterator
+        try:
+            replayed = await self.read_points(events, 2)
+            # Новая точка с тем же временем, что и уже отправленные
+            def add_point():
+                with self.captureOnCommitCallbacks(execute=True):
+                    record_points(self.route, [NavigationPoint(
+                        route=self.route, lat=39.7, lng=2.8, speed=1.0, type="gps", recorded_at=self.start,
+                    )])
+
+            await sync_to_async(add_point)()
+            (live,) = await self.read_points(events, 1)
+        finally:
+            await events.aclose()
+        self.assertEqual(len({point["id"] for point in replayed + [live]}), 3)
+
+    def test_subscription_without_since_starts_after_latest_point_id(self):
+        recorded_at, point_id = live.latest_position(self.route)
+        self.assertEqual(recorded_at, self.start)
+        self.assertEqual(point_id, max(NavigationPoint.objects.filter(route=self.route).values_list("id", flat=True)))
+
+        # Точка с тем же временем, что и последняя сохранённая, принятая после подписки
+        (late,) = record_points(self.route, [NavigationPoint(
+            route=self.route, lat=39.7, lng=2.8, speed=1.0, type="gps", recorded_at=self.start,
+        )])
+        self.assertGreater(late.id, point_id)
+        self.assertEqual([e[1] for e in live.load_events(self.route.id, recorded_at, since_id=point_id)], [late.id])
+
+    async def test_polling_loads_route_once_per_subscription(self):
+        route = await sync_to_async(NavigationRoute.objects.get)(pk=self.route.pk)
+        polled = []
+
+        def route_events(polled_route, since, limit, since_id):
+            polled.append(polled_route)
+            return []
+
+        with mock.patch.object(live, "load_route", return_value=route) as load_route, \
+                mock.patch.object(live, "route_events", side_effect=route_events), \
+                override_settings(NAVIGATION_LIVE_POLL_INTERVAL_S=0):
+            subscription = live.DatabasePollingBroker().subscribe(route.id, self.start)
+            try:
+                for _ in range(500):
+                    if len(polled) >= 3:
+                        break
+                    await asyncio.sleep(0.01)
+            finally:
+                subscription.close()
+        self.assertGreaterEqual(len(polled), 3)
+        load_route.assert_called_once_with(str(route.id))
+        self.assertTrue(all(polled_route is route for polled_route in polled))
+
+    def test_polling_resumes_after_point_id(self):
+        events = live.load_events(self.route.id)
+        self.assertEqual(len(events), 2)
+        recorded_at, point_id, _ = events[0]
+        self.assertEqual([e[1] for e in live.load_events(self.route.id, recorded_at, since_id=point_id)], [events[1][1]])
+
+
+class NavigationAreaSearchTests(TestCase):
+    url = "/api/navigation/search/"
+    bbox = "2.5,39.4,2.8,39.7"
+
+    def setUp(self):
+        user, _, self.boat = make_member("searcher")
+        self.client = api_client(user)
+        self.start = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        self.inside = make_route(self.boat, [(39.5, 2.6, 1.0, self.start), (39.55, 2.65, 1.0, self.start)])
+        # bbox маршрута накрывает область поиска, но сам трек обходит её стороной
+        self.around = make_route(self.boat, [(39.0, 2.0, 1.0, self.start), (40.0, 3.5, 1.0, self.start)])
+        self.inside.archive()
+        self.around.archive()
+
+    def search(self, **params):
+        return self.client.get(self.url, {"bbox": self.bbox, **params})
+
+    def test_archived_routes_prefiltered_by_cells(self):
+        self.assertEqual(
+            set(self.inside.cells.values_list("geohash", flat=True)),
+            {geohash.encode(39.5, 2.6)[:6], geohash.encode(39.55, 2.65)[:6]},
+        )
+        with mock.patch("core.track_codec.decode_track", wraps=track_codec.decode_track) as decode:
+            response = self.search()
+        # Трек маршрута в обход области даже не декодируется
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([route["id"] for route in response.json()], [str(self.inside.id)])
+
+    def test_invalid_boat_is_400(self):
+        self.assertEqual(self.search(boat="not-a-uuid").status_code, 400)
+        self.assertEqual(self.search(boat=str(self.boat.id)).status_code, 200)
+
+    def test_naive_from_to_are_accepted(self):
+        response = self.search(mode="points", **{"from": "2024-05-31T23:00:00", "to": "2024-06-01T01:00:00"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+
+class ManualPointBuffer(ingest_buffer.PointBuffer):
+    # Без фонового потока: тест сам решает, когда сбрасывать очередь
+    def _run(self):
+        pass
+
+
+class IngestBufferTests(SimpleTestCase):
+    route_id = "6f1c1c1e-8c1d-4c55-9d6e-8e3c9f0b2a11"
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+        self.committed = []
+        self.failures = 0
+
+    def make_buffer(self, **config):
+        buffer = ManualPointBuffer(dict(
+            ingest_buffer.DEFAULTS, SPOOL_DIR=self.spool_dir, RETRY_BASE_MS=0, MAX_ATTEMPTS=3, **config,
+        ))
+        self.addCleanup(lambda: buffer.spool and buffer.spool.close())
+        self.addCleanup(atexit.unregister, buffer.flush)
+        return buffer
+
+    def commit(self, route_id, encoded, dedupe):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        self.committed += [p["id"] for p in encoded if p["id"] not in self.committed]
+
+    def submit(self, buffer, count):
+        start = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        return buffer.submit(self.route_id, [
+            {"lat": 39.5, "lng": 2.6, "recorded_at": start + timedelta(seconds=i)} for i in range(count)
+        ])
+
+    def checkpoint(self, buffer):
+        with open(buffer.spool_path + ".ckpt") as f:
+            return int(f.read())
+
+    def test_failed_commit_is_retried_not_dropped(self):
+        buffer = self.make_buffer()
+        with mock.patch.object(ingest_buffer.PointBuffer, "_commit", side_effect=self.commit):
+            ids = self.submit(buffer, 3)
+            self.failures = 1
+            with self.assertLogs("core.ingest_buffer", "ERROR"):
+                buffer.flush()
+            self.assertEqual(self.committed, [])
+            self.assertEqual(self.checkpoint(buffer), 0)
+            self.assertGreater(os.path.getsize(buffer.spool_path), 0)
+
+            buffer._requeue_due()
+            buffer.flush()
+        self.assertEqual(self.committed, ids)
+        self.assertEqual(os.path.getsize(buffer.spool_path), 0)
+        self.assertEqual(buffer.metrics()["retried_total"], 3)
+
+    def test_points_go_to_failed_file_after_max_attempts(self):
+        buffer = self.make_buffer()
+        with mock.patch.object(ingest_buffer.PointBuffer, "_commit", side_effect=self.commit):
+            self.submit(buffer, 2)
+            self.failures = 3
+            with self.assertLogs("core.ingest_buffer", "ERROR") as logs:
+                for _ in range(3):
+                    buffer._requeue_due()
+                    buffer.flush()
+            self.assertIn("dropping 2 points", logs.output[-1])
+        with open(buffer.spool_path + ".failed") as f:
+            self.assertEqual(len(f.readlines()), 2)
+        self.assertEqual(buffer.metrics()["failed_total"], 2)
+        self.assertEqual(buffer.pending, {})
+
+    def test_points_for_archived_route_are_set_aside_without_retry(self):
+        buffer = self.make_buffer()
+        archived = mock.patch.object(
+            ingest_buffer.PointBuffer, "_commit", side_effect=ingest_buffer.RouteArchived(self.route_id)
+        )
+        with archived:
+            self.submit(buffer, 2)
+            with self.assertLogs("core.ingest_buffer", "ERROR") as logs:
+                buffer.flush()
+            self.assertIn("is archived", logs.output[0])
+        with open(buffer.spool_path + ".failed") as f:
+            self.assertEqual(len(f.readlines()), 2)
+        self.assertEqual(buffer.retries, [])
+        self.assertEqual(buffer.pending, {})
+        self.assertEqual(os.path.getsize(buffer.spool_path), 0)
+
+    def test_checkpoint_waits_for_whole_submit(self):
+        buffer = self.make_buffer(FLUSH_MAX_POINTS=2)
+        with mock.patch.object(ingest_buffer.PointBuffer, "_commit", side_effect=self.commit):
+            self.submit(buffer, 3)
+            ids = self.submit(buffer, 1)
+            # Первая пачка делит первый submit пополам
+            buffer._flush([buffer.queue.get_nowait() for _ in range(2)])
+            self.assertEqual(self.checkpoint(buffer), 0)
+
+            # "Падение": новый процесс проигрывает spool целиком, уже записанное отсеется по id
+            buffer.spool.close()
+            buffer.spool = None
+            replayer = self.make_buffer()
+            replayer._replay_orphans()
+        self.assertEqual(len(self.committed), 4)
+        self.assertIn(ids[0], self.committed)
+        self.assertFalse(os.path.exists(buffer.spool_path))
+
+    def test_replayed_spool_kept_until_flush_succeeds(self):
+        buffer = self.make_buffer()
+        ids = self.submit(buffer, 2)
+        buffer.spool.close()
+        buffer.spool = None
+
+        replayer = self.make_buffer()
+        with mock.patch.object(ingest_buffer.PointBuffer, "_commit", side_effect=self.commit):
+            self.failures = 1
+            with self.assertLogs("core.ingest_buffer", "ERROR"):
+                replayer._replay_orphans()
+            self.assertTrue(os.path.exists(buffer.spool_path))
+            replayer._replay_orphans()
+        self.assertEqual(self.committed, ids)
+        self.assertFalse(os.path.exists(buffer.spool_path))
+
+
+KML_HEADER = '<?xml version="1.0"?><kml xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2">'
+
+
+class TrackImportTests(TestCase):
+    def setUp(self):
+        user, _, self.boat = make_member("importer")
+        self.client = api_client(user)
+        self.url = f"/api/boats/{self.boat.id}/bitacora/import/"
+
+    def upload(self, name, content):
+        return self.client.post(self.url, {"file": SimpleUploadedFile(name, content.encode())}, format="multipart")
+
+    def test_gx_track_pairs_whens_with_coords_per_track(self):
+        response = self.upload("trip.kml", KML_HEADER + (
+            "<Document><Placemark><TimeStamp><when>2020-01-01T00:00:00Z</when></TimeStamp><Point>"
+            "<coordinates>1,1</coordinates></Point></Placemark><Placemark><gx:MultiTrack>"
+            "<gx:Track><when>2024-06-01T10:00:00Z</when><when>2024-06-01T10:00:05Z</when>"
+            "<gx:coord>2.60 39.50 0</gx:coord><gx:coord>2.61 39.51 0</gx:coord></gx:Track>"
+            "<gx:Track><when>2024-06-01T11:00:00Z</when><gx:coord>2.70 39.60 0</gx:coord></gx:Track>"
+            "</gx:MultiTrack></Placemark></Document></kml>"
+        ))
+        self.assertEqual(response.status_code, 201)
+        route = NavigationRoute.objects.get(id=response.json()["id"])
+        self.assertEqual(
+            [(lat, lng, t.hour, t.second) for lat, lng, _, _, t in route.iter_track()],
+            [(39.5, 2.6, 10, 0), (39.51, 2.61, 10, 5), (39.6, 2.7, 11, 0)],
+        )
+
+    def test_malformed_coordinates_are_400_and_leave_no_route(self):
+        cases = [
+            ("bad.gpx", '<gpx><trk><trkseg><trkpt lat="abc" lon="2.6"><time>2024-06-01T10:00:00Z</time>'
+                        "</trkpt></trkseg></trk></gpx>"),
+            ("bad.kml", KML_HEADER + "<Placemark><gx:Track><when>2024-06-01T10:00:00Z</when>"
+                                     "<gx:coord>east 39.5 0</gx:coord></gx:Track></Placemark></kml>"),
+            ("nan.kml", KML_HEADER + "<Placemark><TimeSpan><begin>2024-06-01T10:00:00Z</begin>"
+                                     "<end>2024-06-01T11:00:00Z</end></TimeSpan><LineString>"
+                                     "<coordinates>2.6,39.5 nan,39.6</coordinates></LineString></Placemark></kml>"),
+        ]
+        for name, content in cases:
+            response = self.upload(name, content)
+            self.assertEqual(response.status_code, 400, name)
+            self.assertIn("Invalid", response.json()["error"])
+        self.assertFalse(NavigationRoute.all_objects.filter(boat=self.boat).exists())
+
+    def test_linestring_without_timespan_is_rejected(self):
+        response = self.upload("line.kml", KML_HEADER + (
+            "<Placemark><LineString><coordinates>2.6,39.5 2.7,39.6</coordinates></LineString></Placemark></kml>"
+        ))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("TimeSpan", response.json()["error"])
+
+    def test_nmea_skips_corrupt_sentences(self):
+        response = self.upload("log.nmea", "\n".join([
+            "$GPRMC,100000,A,3930.000,N,00236.000,E,5.0,0,010624,,",
+            "$GPRMC,100005,A,39xx.000,N,00236.000,E,5.0,0,010624,,",
+            "$GPRMC,100010,A,3931.000,N,00237.000,E,fast,0,010624,,",
+        ]))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["point_count"], 2)
+
+    def test_entities_are_rejected(self):
+        response = self.upload("lol.gpx", (
+            '<?xml version="1.0"?><!DOCTYPE gpx [<!ENTITY lol "lol"><!ENTITY lol2 "&lol;&lol;&lol;">]>'
+            '<gpx><trk><name>&lol2;</name><trkseg><trkpt lat="39.5" lon="2.6"><time>2024-06-01T10:00:00Z</time>'
+            "</trkpt></trkseg></trk></gpx>"
+        ))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid XML", response.json()["error"])
+        self.assertFalse(NavigationRoute.all_objects.filter(boat=self.boat).exists())
+
+    def test_route_is_hidden_until_import_finishes(self):
+        gpx = "<gpx><trk><trkseg>" + "".join(
+            f'<trkpt lat="39.5" lon="2.{i}"><time>2024-06-01T10:00:0{i}Z</time></trkpt>' for i in range(4)
+        ) + "</trkseg></trk></gpx>"
+        visible = []
+
+        def record(route, points):
+            visible.append(NavigationRoute.objects.filter(pk=route.pk).exists())
+            visible.append(bool(self.client.get(f"/api/boats/{self.boat.id}/bitacora/").json()["results"]))
+            return record_points(route, points)
+
+        with mock.patch("core.navigation.record_points", side_effect=record):
+            response = self.client.post(self.url, {
+                "file": SimpleUploadedFile("trip.gpx", gpx.encode()),
+            }, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(visible, [False, False])
+        self.assertTrue(NavigationRoute.objects.filter(pk=response.json()["id"]).exists())
+
+    def test_import_commits_in_chunks(self):
+        gpx = "<gpx><trk><trkseg>" + "".join(
+            f'<trkpt lat="39.5" lon="2.{i}"><time>2024-06-01T10:00:0{i}Z</time></trkpt>' for i in range(5)
+        ) + "</trkseg></trk></gpx>"
+        from core.track_import import import_track
+        with mock.patch("core.navigation.record_points", wraps=record_points) as record:
+            route = import_track(self.boat, io.BytesIO(gpx.encode()), "gpx", chunk_size=2)
+        self.assertEqual(record.call_count, 3)
+        self.assertEqual(route.point_count, 5)
+
+
+class MembershipTests(TestCase):
+    """
+    Через настоящие access-токены: запросы на чтение берут членства из claims.
+    """
+    def setUp(self):
+        self.user, self.account, self.boat = make_member("member")
+        _, self.other_account, self.other_boat = make_member("other-owner")
+        self.refresh = str(MarinexTokenObtainPairSerializer.get_token(self.user))
+        self.client = self.bearer_client()
+
+    def bearer_client(self):
+        response = APIClient().post("/api/token/refresh/", {"refresh": self.refresh}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.refresh = response.json().get("refresh", self.refresh)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        return client
+
+    def boat_ids(self):
+        response = self.client.get("/api/boats/")
+        if response.status_code == 401:
+            # Членства изменились: клиент обновляет токен, как в приложении
+            self.assertEqual(response.json()["detail"], "Account memberships changed, refresh the token")
+            self.client = self.bearer_client()
+            response = self.client.get("/api/boats/")
+        self.assertEqual(response.status_code, 200)
+        return {boat["id"] for boat in response.json()["results"]}
+
+    def test_added_membership_is_seen_after_refresh(self):
+        self.assertEqual(self.boat_ids(), {str(self.boat.id)})
+        UserAccount.objects.create(user=self.user, account=self.other_account)
+        self.assertEqual(self.boat_ids(), {str(self.boat.id), str(self.other_boat.id)})
+
+    def test_removal_by_queryset_update_is_enforced(self):
+        UserAccount.objects.create(user=self.user, account=self.other_account)
+        self.assertEqual(len(self.boat_ids()), 2)
+        client = self.client
+
+        UserAccount.objects.filter(user=self.user, account=self.other_account).update(deleted_at=timezone.now())
+        self.assertEqual(client.get(f"/api/boats/{self.other_boat.id}/documents/").status_code, 401)
+        self.assertEqual(self.boat_ids(), {str(self.boat.id)})
+        self.assertEqual(self.client.get(f"/api/boats/{self.other_boat.id}/documents/").status_code, 404)
+
+    def test_removal_by_queryset_delete_is_enforced(self):
+        UserAccount.objects.create(user=self.user, account=self.other_account)
+        self.assertEqual(len(self.boat_ids()), 2)
+        client = self.client
+
+        UserAccount.all_objects.filter(user=self.user).delete()
+        self.assertEqual(client.get("/api/boats/").status_code, 401)
+        self.assertEqual(self.boat_ids(), set())
+        self.assertEqual(self.client.get(f"/api/boats/{self.boat.id}/documents/").status_code, 404)
+
+    def test_foreign_or_malformed_boat_is_not_found(self):
+        self.assertEqual(self.client.get(f"/api/boats/{self.boat.id}/documents/").status_code, 200)
+        self.assertEqual(self.client.get(f"/api/boats/{self.other_boat.id}/documents/").status_code, 404)
+        self.assertEqual(self.client.get("/api/boats/not-a-uuid/documents/").status_code, 404)
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user, self.account, self.boat = make_member("claims")
+        self.client = api_client(self.user)
+
+    def test_profile_loads_user_for_claims_token(self):
+        response = self.client.get("/api/me/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["email"], self.user.email)
+
+    def test_claims_user_has_no_database_fallback(self):
+        token = MarinexTokenObtainPairSerializer.get_token(self.user).access_token
+        user = ClaimsJWTAuthentication().get_claims_user(token)
+        self.assertEqual(user.username, self.user.username)
+        # Полей, которых нет в токене, нет и у пользователя: никакого запроса в БД
+        with self.assertNumQueries(0):
+            self.assertIsNone(user.email)
+
+    def test_inactive_user_is_rejected_on_safe_methods(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.get("/api/boats/")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["detail"], "User is inactive")
+
+    def test_bulk_membership_removal_rejects_token(self):
+        _, other_account, other_boat = make_member("claims-removed")
+        for remove in (
+            lambda rows: rows.update(deleted_at=timezone.now()),
+            lambda rows: rows.delete(),
+        ):
+            with self.subTest(remove=remove):
+                UserAccount.all_objects.filter(user=self.user, account=other_account).delete()
+                UserAccount.objects.create(user=self.user, account=other_account)
+                self.user.refresh_from_db()
+                client = api_client(self.user)
+                self.assertEqual(client.get(f"/api/boats/{other_boat.id}/documents/").status_code, 200)
+
+                # queryset.update()/delete() обходят сигналы UserAccount
+                remove(UserAccount.objects.filter(user=self.user, account=other_account))
+                self.assertEqual(client.get("/api/boats/").status_code, 401)
+                self.assertEqual(client.get(f"/api/boats/{other_boat.id}/documents/").status_code, 401)
+
+    def test_changed_memberships_reject_token_until_refresh(self):
+        _, other_account, other_boat = make_member("claims-other")
+        refresh = str(MarinexTokenObtainPairSerializer.get_token(self.user))
+        UserAccount.objects.create(user=self.user, account=other_account)
+        self.assertEqual(self.client.get("/api/boats/").status_code, 401)
+
+        response = APIClient().post("/api/token/refresh/", {"refresh": refresh}, format="json")
+        self.assertEqual(response.status_code, 200)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        boats = {boat["id"] for boat in client.get("/api/boats/").json()["results"]}
+        self.assertEqual(boats, {str(self.boat.id), str(other_boat.id)})
+
+
+@override_settings(
+    DOCUMENT_AI_CLIENT="core.document_ai.FakeDocumentAIClient",
+    DOCUMENT_AI_MAX_CONCURRENCY=1,
+    DOCUMENT_AI_TIMEOUT_S=0.2,
+)
+class DocumentAIConcurrencyTests(TestCase):
+    def setUp(self):
+        self.user, _, self.boat = make_member("analyst")
+        self.token = str(MarinexTokenObtainPairSerializer.get_token(self.user).access_token)
+        # Свежий семафор процесса под DOCUMENT_AI_MAX_CONCURRENCY теста
+        patcher = mock.patch.object(views, "_ai_slots", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def analyze(self, content):
+        upload = SimpleUploadedFile("doc.pdf", content, content_type="application/pdf")
+        return await self.async_client.post(
+            "/api/ai/analyze-document/", {"file": upload}, headers={"authorization": f"Bearer {self.token}"}
+        )
+
+    async def wait_for_free_slot(self):
+        semaphore = views._ai_slot_semaphore()
+        for _ in range(100):
+            if semaphore.acquire(blocking=False):
+                semaphore.release()
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    async def test_analysis_uses_configured_client(self):
+        response = await self.analyze(b"%PDF plain")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["name"], "Documento")
+        self.assertTrue(await self.wait_for_free_slot())
+
+    @override_settings(DOCUMENT_AI_FAKE_DELAY_S=0.6)
+    async def test_timed_out_call_keeps_slot_until_it_finishes(self):
+        response = await self.analyze(b"%PDF slow")
+        self.assertEqual(response.status_code, 504)
+
+        # Модель ещё работает: второй запрос не получает слот
+        self.assertFalse(views._ai_slot_semaphore().acquire(blocking=False))
+        response = await self.analyze(b"%PDF next")
+        self.assertEqual(response.status_code, 503)
+
+        self.assertTrue(await self.wait_for_free_slot())
+
+
+class AIJobQueueTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, True)
+        overrides = override_settings(MEDIA_ROOT=media, DOCUMENT_AI_JOB_MAX_ATTEMPTS=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # Модель-заглушка: тесты очереди не зависят от клиента и кэша
+        patcher = mock.patch.object(document_ai, "analyze_document", return_value={"name": "Permiso"})
+        self.model = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self):
+        job = ai_jobs.submit_job(SimpleUploadedFile("permit.pdf", b"%PDF permit", content_type="application/pdf"))
+        self.assertTrue(job.file.storage.exists(job.file.name))
+        return job
+
+    def test_done_job_keeps_result_and_drops_upload(self):
+        job = self.submit()
+        name = job.file.name
+        job = ai_jobs.run_job(ai_jobs.claim_job("w1"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.locked_by), (DocumentAIJob.STATUS_DONE, {"name": "Permiso"}, ""))
+        self.assertFalse(job.file)
+        self.assertFalse(job.file.storage.exists(name))
+
+    def test_failed_attempts_are_retried_then_failed(self):
+        job = self.submit()
+        name = job.file.name
+        self.model.side_effect = document_ai.DocumentAIError("not json", raw="oops")
+
+        with self.assertLogs("core.ai_jobs", "INFO"):
+            ai_jobs.run_job(ai_jobs.claim_job("w1"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, DocumentAIJob.STATUS_PENDING)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertTrue(job.file.storage.exists(name))
+
+        DocumentAIJob.objects.filter(id=job.id).update(run_after=timezone.now())
+        with self.assertLogs("core.ai_jobs", "WARNING"):
+            ai_jobs.run_job(ai_jobs.claim_job("w1"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (DocumentAIJob.STATUS_FAILED, 2))
+        self.assertFalse(job.file.storage.exists(name))
+
+    def test_stale_job_on_last_attempt_is_failed_not_rerun(self):
+        job = self.submit()
+        name = job.file.name
+        stale = timezone.now() - timedelta(seconds=ai_jobs.DEFAULT_STALE_S + 1)
+        DocumentAIJob.objects.filter(id=job.id).update(
+            status=DocumentAIJob.STATUS_RUNNING, attempts=2, locked_by="dead", locked_at=stale
+        )
+
+        with self.assertLogs("core.ai_jobs", "WARNING"):
+            self.assertIsNone(ai_jobs.claim_job("w1"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (DocumentAIJob.STATUS_FAILED, 2, ""))
+        self.assertFalse(job.file.storage.exists(name))
+        self.model.assert_not_called()
+
+    def test_stale_job_with_attempts_left_is_reclaimed(self):
+        job = self.submit()
+        stale = timezone.now() - timedelta(seconds=ai_jobs.DEFAULT_STALE_S + 1)
+        DocumentAIJob.objects.filter(id=job.id).update(
+            status=DocumentAIJob.STATUS_RUNNING, attempts=1, locked_by="dead", locked_at=stale
+        )
+        claimed = ai_jobs.claim_job("w1")
+        self.assertEqual((claimed.id, claimed.attempts, claimed.locked_by), (job.id, 2, "w1"))
+
+    def test_outcome_of_reclaimed_attempt_is_dropped(self):
+        self.submit()
+        job = ai_jobs.claim_job("w1")
+        # Пока w1 считали умершим, задание забрал w2
+        DocumentAIJob.objects.filter(id=job.id).update(locked_by="w2", attempts=2)
+
+        with self.assertLogs("core.ai_jobs", "WARNING"):
+            ai_jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.result), (DocumentAIJob.STATUS_RUNNING, "w2", None))
+        self.assertTrue(job.file.storage.exists(job.file.name))
+
+
+@override_settings(DOCUMENT_AI_CLIENT="core.document_ai.FakeDocumentAIClient", DOCUMENT_AI_MODEL="model-a")
+class DocumentAIResultCacheTests(TestCase):
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp.write(b"%PDF cached")
+        self.path = tmp.name
+        self.addCleanup(os.remove, self.path)
+
+    def test_result_is_cached_per_client_and_model(self):
+        self.assertEqual(document_ai.analyze_document(self.path, "application/pdf")["name"], "Documento")
+        with mock.patch.object(document_ai.FakeDocumentAIClient, "analyze") as analyze:
+            self.assertEqual(document_ai.analyze_document(self.path, "application/pdf")["name"], "Documento")
+        analyze.assert_not_called()
+
+        with override_settings(DOCUMENT_AI_MODEL="model-b"):
+            self.assertIsNone(document_ai.prepare_analysis(self.path).cached)
+        with override_settings(DOCUMENT_AI_CLIENT="tests.OtherClient"):
+            self.assertIsNone(document_ai.prepare_analysis(self.path).cached)
+
+    def test_stats_separate_process_counters_from_stored_hits(self):
+        document_ai.analyze_document(self.path, "application/pdf")
+        before = ai_cache.stats()
+        document_ai.analyze_document(self.path, "application/pdf")
+        after = ai_cache.stats()
+
+        self.assertEqual(after["process"]["pid"], os.getpid())
+        self.assertEqual(after["process"]["hits"], before["process"]["hits"] + 1)
+        self.assertEqual((after["entries"], after["total_hits"]), (1, 1))
+
+
+class DocumentAICatalogTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(document_ai, "_catalog", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.category = DocumentCategory.objects.create(name="Seguros")
+
+    def names(self):
+        return json.loads(document_ai.get_catalog().text)
+
+    def test_change_by_another_worker_is_seen_after_check_interval(self):
+        self.assertEqual(self.names(), [["1", "Seguros"]])
+        # update() без сигналов — как правка из другого процесса
+        DocumentCategory.objects.filter(pk=self.category.pk).update(name="Licencias", updated_at=timezone.now())
+
+        with override_settings(DOCUMENT_AI_CATALOG_CHECK_S=3600):
+            self.assertEqual(self.names(), [["1", "Seguros"]])
+        document_ai._catalog["check_at"] = 0
+        self.assertEqual(self.names(), [["1", "Licencias"]])
+
+    @override_settings(DOCUMENT_AI_CATALOG_CHECK_S=0)
+    def test_deleted_category_is_dropped(self):
+        DocumentCategory.objects.create(name="Permisos")
+        self.assertEqual(len(self.names()), 2)
+        DocumentCategory.objects.filter(pk=self.category.pk).delete()
+        self.assertEqual(self.names(), [["1", "Permisos"]])
+
+
+@override_settings(DOCUMENT_AI_CLIENT="core.document_ai.FakeDocumentAIClient")
+class DocumentAIBatchTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, True)
+        overrides = override_settings(MEDIA_ROOT=media)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user, _, self.boat = make_member("batcher")
+        self.token = str(MarinexTokenObtainPairSerializer.get_token(self.user).access_token)
+
+    async def run_batch(self, count):
+        files = [SimpleUploadedFile(f"doc{i}.pdf", f"%PDF batch {i}".encode(), content_type="application/pdf")
+                 for i in range(count)]
+        response = await self.async_client.post(
+            "/api/ai/analyze-batch/",
+            {"files": files, "boat": str(self.boat.id)},
+            headers={"authorization": f"Bearer {self.token}"},
+        )
+        self.assertEqual(response.status_code, 200)
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        return [json.loads(line) for line in body.decode().splitlines()]
+
+    async def test_documents_are_created_for_boat(self):
+        lines = await self.run_batch(3)
+        self.assertEqual(lines[-1], {"done": True, "total": 3, "ok": 3, "failed": 0})
+        ids = {line["document_id"] for line in lines[:-1]}
+        count = await sync_to_async(Document.objects.filter(boat=self.boat, id__in=ids).count)()
+        self.assertEqual(count, 3)
+
+    async def test_failed_document_creation_is_reported_per_file(self):
+        create = views._create_analyzed_document
+
+        def flaky(boat, user, uploaded, result):
+            if uploaded.name == "doc1.pdf":
+                raise ValueError("storage is read-only")
+            return create(boat, user, uploaded, result)
+
+        with mock.patch.object(views, "_create_analyzed_document", flaky):
+            lines = await self.run_batch(3)
+        self.assertEqual(lines[-1], {"done": True, "total": 3, "ok": 2, "failed": 1})
+        failed = [line for line in lines[:-1] if line["status"] == "error"]
+        self.assertEqual([(line["filename"], line["exception"]) for line in failed], [("doc1.pdf", "storage is read-only")])
+
+    def test_batch_leaves_a_slot_for_other_requests(self):
+        for max_concurrency, batch, expected in ((4, 4, 3), (4, 2, 2), (1, 4, 1)):
+            with override_settings(DOCUMENT_AI_MAX_CONCURRENCY=max_concurrency, DOCUMENT_AI_BATCH_CONCURRENCY=batch):
+                self.assertEqual(views._batch_concurrency(), expected)
+
+
+REPLICA_ALIAS = "replica_test"
+
+
+@override_settings(
+    DATABASE_REPLICAS=[REPLICA_ALIAS],
+    DATABASE_ROUTERS=["core.db_router.ReplicaRouter"],
+    DATABASE_STICKY_PRIMARY_S=60,
+)
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Primary is the test database, the replica a second SQLite file holding a
+    snapshot of it: rows written after the snapshot are "not replicated yet".
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Алиас добавляется после проверок и создания тестовых БД раннером: реплике они не нужны.
+        # MIRROR, как у реплик в settings: очистка после теста её не трогает
+        cls.replica_dir = tempfile.mkdtemp()
+        name = os.path.join(cls.replica_dir, "replica.sqlite3")
+        connections.settings[REPLICA_ALIAS] = dict(
+            connections.settings["default"], NAME=name, TEST=dict(connections.settings["default"]["TEST"], MIRROR="default")
+        )
+        cls.databases = {"default", REPLICA_ALIAS}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[REPLICA_ALIAS].close()
+        del connections[REPLICA_ALIAS]
+        del connections.settings[REPLICA_ALIAS]
+        shutil.rmtree(cls.replica_dir, True)
+        cls.databases = {"default"}
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.account, self.boat = make_member("sticky")
+        primary, replica = connections["default"], connections[REPLICA_ALIAS]
+        primary.ensure_connection()
+        replica.ensure_connection()
+        primary.connection.backup(replica.connection)
+        self.lagging_boat = Boat.objects.create(account=self.account, name="lagging")
+        self.client = api_client(self.user)
+
+    def boat_ids(self, client):
+        response = client.get("/api/boats/")
+        self.assertEqual(response.status_code, 200)
+        return {boat["id"] for boat in response.json()["results"]}
+
+    def test_write_pins_reads_to_primary_by_signed_cookie(self):
+        self.assertEqual(self.boat_ids(self.client), {str(self.boat.id)})
+
+        self.client.post("/api/boats/", {"name": "Nueva"}, format="json")
+        self.assertIn(db_router.STICKY_COOKIE, self.client.cookies)
+        # Без общего кэша (другой воркер) достаточно cookie
+        cache.clear()
+        self.assertIn(str(self.lagging_boat.id), self.boat_ids(self.client))
+        self.assertEqual(self.boat_ids(api_client(self.user)), {str(self.boat.id)})
+
+    def test_unsigned_or_foreign_cookie_is_ignored(self):
+        self.client.cookies[db_router.STICKY_COOKIE] = str(self.user.pk)
+        self.assertEqual(self.boat_ids(self.client), {str(self.boat.id)})
+
+        other, _, _ = make_member("sticky-other")
+        other_client = api_client(other)
+        other_client.post("/api/boats/", {"name": "Ajena"}, format="json")
+        self.client.cookies[db_router.STICKY_COOKIE] = other_client.cookies[db_router.STICKY_COOKIE].value
+        cache.clear()
+        self.assertEqual(self.boat_ids(self.client), {str(self.boat.id)})
+
+    def test_process_local_cache_is_reported(self):
+        self.assertEqual([w.id for w in db_router.check_sticky_cache(None)], ["core.W001"])
+        shared = {"default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "cache"}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(db_router.check_sticky_cache(None), [])
+
+
+class NavigationPointIngestTests(TestCase):
+    def setUp(self):
+        self.user, _, self.boat = make_member("logger")
+        self.route = make_route(self.boat)
+        self.client = api_client(self.user)
+        self.outsider = api_client(make_member("outsider")[0])
+        self.start = datetime(2024, 6, 1, 12, tzinfo=dt_timezone.utc)
+
+    def point(self, i, **overrides):
+        recorded_at = (self.start + timedelta(seconds=i)).isoformat()
+        return {"lat": 39.5 + i / 1000, "lng": 2.6, "speed": 1.5, "recorded_at": recorded_at, **overrides}
+
+    def bulk(self, client, points):
+        return client.post(f"/api/navigation/route/{self.route.id}/point/bulk/", {"points": points}, format="json")
+
+    def test_single_point_on_foreign_route_is_not_found(self):
+        url = f"/api/navigation/route/{self.route.id}/point/"
+        self.assertEqual(self.outsider.post(url, self.point(0), format="json").status_code, 404)
+        self.assertEqual(self.client.post(url, self.point(0), format="json").status_code, 201)
+        self.assertEqual(NavigationPoint.objects.filter(route=self.route).count(), 1)
+
+    def test_bulk_all_valid_is_created(self):
+        response = self.bulk(self.client, [self.point(i) for i in range(3)])
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body["created"], body["failed"]), (3, 0))
+        self.assertEqual([r["status"] for r in body["results"]], ["created"] * 3)
+        self.route.refresh_from_db()
+        self.assertEqual(self.route.point_count, 3)
+
+    def test_bulk_partial_failure_is_multi_status(self):
+        response = self.bulk(self.client, [self.point(0), self.point(1, lat="north"), "junk", self.point(3)])
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual((body["created"], body["failed"]), (2, 2))
+        self.assertEqual([(r["index"], r["status"]) for r in body["results"]],
+                         [(0, "created"), (1, "error"), (2, "error"), (3, "created")])
+        self.assertIn("lat", body["results"][1]["errors"])
+
+    def test_bulk_without_valid_points_is_rejected(self):
+        self.assertEqual(self.bulk(self.client, []).status_code, 400)
+        response = self.bulk(self.client, [self.point(0, lng=None)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["created"], 0)
+        with override_settings(NAVIGATION_BULK_MAX_POINTS=2):
+            self.assertEqual(self.bulk(self.client, [self.point(i) for i in range(3)]).status_code, 400)
+        self.assertFalse(NavigationPoint.objects.filter(route=self.route).exists())
+
+    def test_bulk_on_foreign_route_is_not_found(self):
+        self.assertEqual(self.bulk(self.outsider, [self.point(0)]).status_code, 404)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry = mock.patch.object(metrics, "_registry", metrics.Registry())
+        registry.start()
+        self.addCleanup(registry.stop)
+        self.user, _, _ = make_member("metrics")
+
+    def test_middleware_records_endpoint_metrics(self):
+        self.assertEqual(api_client(self.user).get("/api/boats/").status_code, 200)
+
+        values = metrics.collect()
+        labels = (("endpoint", "boat-list.list"), ("method", "GET"))
+        self.assertEqual(values[("marinex_http_responses_total", labels + (("status", "200"),))], 1)
+        counts, _, count = values[("marinex_http_sql_queries", labels)]
+        self.assertEqual(count, 1)
+        self.assertEqual(counts[0], 0)  # корзина le="0" пуста: запросы к БД посчитаны
+        self.assertEqual(values[("marinex_http_render_duration_seconds", labels)][2], 1)
+        _, size, _ = values[("marinex_http_response_size_bytes", labels)]
+        self.assertGreater(size, 0)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        self.assertEqual(APIClient().get("/metrics").status_code, 401)
+        self.assertEqual(api_client(self.user).get("/metrics").status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save(update_fields=["is_staff"])
+        response = api_client(self.user).get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn("# TYPE marinex_http_request_duration_seconds histogram", response.content.decode())
+
+    def write_snapshot(self, directory, name, status_count):
+        labels = [["endpoint", "boat-list"], ["method", "GET"], ["status", "200"]]
+        with open(os.path.join(directory, name), "w") as f:
+            json.dump([["marinex_http_responses_total", labels, status_count]], f)
+
+    def test_multiprocess_files_are_merged_and_dead_ones_retired(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        config = override_settings(METRICS={"ENABLED": True, "MULTIPROCESS_DIR": directory, "FLUSH_INTERVAL_S": 5})
+        config.enable()
+        self.addCleanup(config.disable)
+
+        # Живой воркер держит flock на своём .lock, умерший — нет
+        self.write_snapshot(directory, "101-1.json", 2)
+        alive = open(os.path.join(directory, "101-1.lock"), "w")
+        self.addCleanup(alive.close)
+        fcntl.flock(alive, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.write_snapshot(directory, "202-1.json", 3)
+        open(os.path.join(directory, "202-1.lock"), "w").close()
+        self.write_snapshot(directory, metrics.RETIRED_FILE, 5)
+
+        key = ("marinex_http_responses_total", (("endpoint", "boat-list"), ("method", "GET"), ("status", "200")))
+        self.assertEqual(metrics.collect()[key], 10)
+        # Повторный scrape: счётчик не растёт и не убывает
+        self.assertEqual(metrics.collect()[key], 10)
+
+        files = set(os.listdir(directory))
+        self.assertNotIn("202-1.json", files)
+        self.assertNotIn("202-1.lock", files)
+        self.assertIn("101-1.json", files)
+        with open(os.path.join(directory, metrics.RETIRED_FILE)) as f:
+            self.assertEqual(json.load(f)[0][2], 8)
+
+
+class SQLiteProductionModeTests(SimpleTestCase):
+    """
+    Тестовая БД живёт в памяти (journal_mode там всегда "memory"), поэтому
+    проверяем отдельный файл с теми же настройками, что и default.
+    """
+    ALIAS = "sqlite_check"
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, "check.sqlite3")
+        # Соединение вне connections.settings: SimpleTestCase не запрещает такие
+        settings_dict = dict(connections.settings["default"], NAME=self.path)
+        connections[self.ALIAS] = load_backend(settings_dict["ENGINE"]).DatabaseWrapper(settings_dict, self.ALIAS)
+        self.addCleanup(self.drop_alias)
+
+    def drop_alias(self):
+        connections[self.ALIAS].close()
+        del connections[self.ALIAS]
+
+    def pragma(self, name):
+        with connections[self.ALIAS].cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        self.assertEqual(self.pragma("journal_mode"), "wal")
+        self.assertEqual(self.pragma("busy_timeout"), settings.SQLITE_PRAGMAS["busy_timeout"])
+        self.assertEqual(self.pragma("synchronous"), 1)  # NORMAL
+
+    def test_transactions_begin_immediate(self):
+        other = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+        self.addCleanup(other.close)
+
+        with transaction.atomic(using=self.ALIAS):
+            # Транзакция ещё ничего не читала и не писала, но блокировку на запись уже держит
+            with self.assertRaisesMessage(sqlite3.OperationalError, "database is locked"):
+                other.execute("BEGIN IMMEDIATE")
+        other.execute("BEGIN IMMEDIATE")
+        other.execute("ROLLBACK")
+
+
+class CurrentUserMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user, _, self.boat = make_member("current")
+
+    def request(self, user, factory=RequestFactory):
+        request = factory().get("/")
+        request.user = user
+        return request
+
+    def test_sync_view_sees_user_only_during_request(self):
+        seen = []
+
+        def view(request):
+            seen.append(get_current_user())
+            self.boat.soft_delete()
+            return HttpResponse()
+
+        CurrentUserMiddleware(view)(self.request(self.user))
+
+        self.assertEqual(seen, [self.user])
+        self.assertIsNone(get_current_user())
+        self.assertEqual(Boat.all_objects.get(pk=self.boat.pk).deleted_by_id, self.user.pk)
+
+    def test_async_requests_do_not_leak_users(self):
+        other, _, _ = make_member("current-other")
+        seen = {}
+
+        async def view(request):
+            before = get_current_user()
+            # Другой запрос выполняется в том же потоке, пока этот ждёт
+            await asyncio.sleep(0.01)
+            seen[request.user.username] = (before, get_current_user())
+            return HttpResponse()
+
+        middleware = CurrentUserMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))  # без адаптера sync_to_async
+
+        async def serve():
+            await asyncio.gather(
+                middleware(self.request(self.user, AsyncRequestFactory)),
+                middleware(self.request(AnonymousUser(), AsyncRequestFactory)),
+                middleware(self.request(other, AsyncRequestFactory)),
+            )
+            return get_current_user()
+
+        self.assertIsNone(asyncio.run(serve()))
+        self.assertEqual(seen, {"current": (self.user, self.user), "": (None, None), "current-other": (other, other)})
+        self.assertIsNone(get_current_user())
+
+
+class BoatListTests(TestCase):
+    def boat_list_queries(self, username, boats):
+        rng = random.Random(boats)
+        user = synthetic.make_user(username, password_hash=make_password(None))
+        synthetic.seed_account(
+            rng, synthetic.seed_catalogs(rng), f"{username} fleet", user=user, boats=boats,
+            tasks_per_boat=0, works_per_boat=0, documents_per_boat=0, attachments_per_boat=2,
+        )
+        user.refresh_from_db()
+        client = api_client(user)
+        client.get("/api/boats/")  # прогрев кэша членств
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/api/boats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), boats)
+        self.assertTrue(all(len(boat["attachments"]) == 2 for boat in response.json()["results"]))
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_boats(self):
+        self.assertEqual(self.boat_list_queries("one-boat", 1), self.boat_list_queries("fleet", 6))
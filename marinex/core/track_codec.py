@@ -0,0 +1,172 @@
+# core/track_codec.py
+"""
+Compact binary encoding of a finished navigation track.
+
+Layout (all integers are LEB128 varints, signed values are zigzag-encoded):
+
+    b"MXT" version:u8 count
+    first point:  lat_e6  lng_e6  time_us  speed_q  type_code
+    next points:  dlat_e6 dlng_e6 dtime_us speed_q  type_code
+
+* lat/lng are stored as int32 microdegrees (~0.11 m) and delta-encoded
+  against the previous point, so a typical fix costs 2-3 bytes per axis.
+* time is microseconds since the epoch, delta-encoded (points are sorted),
+  so recorded_at survives archive -> restore exactly. Version 1 blobs
+  stored milliseconds and are still decoded.
+* speed_q is round(speed * 100) + 1, with 0 reserved for "no speed".
+* type_code is the index of the point type in NavigationPoint.TYPE_CHOICES.
+
+Lossy by design: coordinates are rounded to 1e-6 degrees and speed to 0.01 m/s.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+MAGIC = b"MXT"
+VERSION = 2
+HEADER_SIZE = len(MAGIC) + 1
+
+# Единица времени по версии формата, в микросекундах
+_TIME_UNIT_US = {1: 1000, 2: 1}
+
+TYPE_CODES = ("gps", "start", "end", "stop")
+_TYPE_TO_CODE = {name: code for code, name in enumerate(TYPE_CODES)}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class TrackCodecError(ValueError):
+    pass
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        try:
+            byte = data[pos]
+        except IndexError:
+            raise TrackCodecError("Truncated track blob")
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _to_us(value):
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def encode_track(points):
+    """
+    points: iterable of (lat, lng, speed, type, recorded_at) tuples, sorted by recorded_at.
+    """
+    body = bytearray()
+    count = 0
+    prev_lat = prev_lng = prev_us = 0
+
+    for lat, lng, speed, p_type, recorded_at in points:
+        lat_e6 = int(round(lat * 1_000_000))
+        lng_e6 = int(round(lng * 1_000_000))
+        us = _to_us(recorded_at)
+        if count and us < prev_us:
+            raise TrackCodecError("Points must be sorted by recorded_at")
+
+        _write_varint(body, _zigzag(lat_e6 - prev_lat))
+        _write_varint(body, _zigzag(lng_e6 - prev_lng))
+        _write_varint(body, us - prev_us if count else us)
+        _write_varint(body, 0 if speed is None else max(int(round(speed * 100)), 0) + 1)
+        body.append(_TYPE_TO_CODE.get(p_type, 0))
+
+        prev_lat, prev_lng, prev_us = lat_e6, lng_e6, us
+        count += 1
+
+    header = bytearray(MAGIC)
+    header.append(VERSION)
+    _write_varint(header, count)
+    return bytes(header + body)
+
+
+def _read_header(data):
+    if len(data) < HEADER_SIZE:
+        raise TrackCodecError(f"Track blob too short: {len(data)} bytes")
+    if data[:3] != MAGIC:
+        raise TrackCodecError("Not a Marinex track blob")
+    if data[3] not in _TIME_UNIT_US:
+        raise TrackCodecError(f"Unsupported track blob version {data[3]}")
+    count, pos = _read_varint(data, HEADER_SIZE)
+    return data[3], count, pos
+
+
+def decode_track(data):
+    """
+    Yields (lat, lng, speed, type, recorded_at) tuples in recorded order.
+    """
+    for _, point in decode_track_positions(data):
+        yield point
+
+
+def decode_track_positions(data, position=None):
+    """
+    Like decode_track, but yields (position, point). position is the decoder
+    state after the point, (index, offset, lat_e6, lng_e6); passed back together
+    with that point's recorded_at as (index, offset, lat_e6, lng_e6, recorded_at)
+    it resumes decoding right after the point without decoding the ones before.
+    """
+    data = bytes(data)
+    version, count, pos = _read_header(data)
+    time_unit_us = _TIME_UNIT_US[version]
+    index = lat_e6 = lng_e6 = ticks = 0
+    if position is not None:
+        index, pos, lat_e6, lng_e6, recorded_at = position
+        if not (0 < index <= count and HEADER_SIZE < pos <= len(data)):
+            raise TrackCodecError("Track position out of range")
+        ticks = _to_us(recorded_at) // time_unit_us
+
+    for index in range(index + 1, count + 1):
+        value, pos = _read_varint(data, pos)
+        lat_e6 += _unzigzag(value)
+        value, pos = _read_varint(data, pos)
+        lng_e6 += _unzigzag(value)
+        value, pos = _read_varint(data, pos)
+        ticks += value
+        speed_q, pos = _read_varint(data, pos)
+        try:
+            type_code = data[pos]
+        except IndexError:
+            raise TrackCodecError("Truncated track blob")
+        pos += 1
+        try:
+            recorded_at = _EPOCH + timedelta(microseconds=ticks * time_unit_us)
+        except OverflowError:
+            raise TrackCodecError("Corrupt track blob: time out of range")
+
+        yield (index, pos, lat_e6, lng_e6), (
+            lat_e6 / 1_000_000,
+            lng_e6 / 1_000_000,
+            None if speed_q == 0 else (speed_q - 1) / 100,
+            TYPE_CODES[type_code] if type_code < len(TYPE_CODES) else "gps",
+            recorded_at,
+        )
+
+
+def track_point_count(data):
+    if not data:
+        return 0
+    _, count, _ = _read_header(bytes(data))
+    return count
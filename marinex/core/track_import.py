@@ -0,0 +1,386 @@
+# core/track_import.py
+"""
+Streaming import of recorded tracks (GPX, KML, NMEA 0183 logs) into NavigationRoute.
+
+Parsers are generators of (lat, lng, speed, type, recorded_at) tuples. XML is
+read with defusedxml's iterparse (uploads are untrusted: no entity expansion,
+no external references) and every processed element is detached from its
+parent, so memory stays bounded for very large files; points are written with
+navigation.record_points() in chunks.
+"""
+import io
+import math
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import defusedxml.ElementTree as ET
+from defusedxml import DefusedXmlException
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+IMPORT_CHUNK_SIZE = 5000
+KNOTS_TO_MS = 0.514444
+
+FORMATS = ("gpx", "kml", "nmea")
+
+
+class TrackImportError(ValueError):
+    pass
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value.strip())
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+
+def _iterparse(fileobj, on_end, detach, meta):
+    """
+    Walks the document keeping only the current branch in memory.
+    on_end(elem, meta) returns the points found in a closed element (meta["parent"]
+    is the local tag of its parent); elements with a tag in `detach` are removed
+    from their parent once processed.
+    """
+    stack = []
+    try:
+        for event, elem in ET.iterparse(fileobj, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            meta["parent"] = _local(stack[-1].tag) if stack else None
+            yield from on_end(elem, meta)
+            if stack and _local(elem.tag) in detach:
+                # Отцепляем обработанный элемент, чтобы дерево не росло
+                stack[-1].remove(elem)
+    except (ET.ParseError, DefusedXmlException) as e:
+        raise TrackImportError(f"Invalid XML: {e}")
+
+
+def _coordinate(value, limit, what):
+    """
+    float() for a latitude/longitude field; malformed or out-of-range values are a TrackImportError.
+    """
+    try:
+        coord = float(value)
+    except (TypeError, ValueError):
+        raise TrackImportError(f"Invalid {what}: {value!r}")
+    if not -limit <= coord <= limit:
+        raise TrackImportError(f"Invalid {what}: {value!r}")
+    return coord
+
+
+def _speed(value):
+    # Скорость необязательна: нечисловое значение просто отбрасываем
+    try:
+        speed = float(value)
+    except (TypeError, ValueError):
+        return None
+    return speed if math.isfinite(speed) else None
+
+
+# -------------------------
+# GPX
+# -------------------------
+def _gpx_end(elem, meta):
+    tag = _local(elem.tag)
+    if tag == "name" and "name" not in meta and elem.text:
+        meta["name"] = elem.text.strip()
+    if tag not in ("trkpt", "rtept"):
+        return ()
+
+    lat = _coordinate(elem.get("lat"), 90, "latitude")
+    lng = _coordinate(elem.get("lon"), 180, "longitude")
+
+    recorded_at = speed = None
+    for child in elem.iter():
+        child_tag = _local(child.tag)
+        if child_tag == "time":
+            recorded_at = _parse_time(child.text)
+        elif child_tag == "speed" and child.text:
+            speed = _speed(child.text)
+    elem.clear()
+
+    if recorded_at is None:
+        return ()
+    return ((lat, lng, speed, "gps", recorded_at),)
+
+
+def parse_gpx(fileobj, meta):
+    return _iterparse(fileobj, _gpx_end, ("trkpt", "rtept", "wpt", "metadata"), meta)
+
+
+# -------------------------
+# KML (gx:Track with <when>, or LineString + TimeSpan)
+# -------------------------
+def _reopen(fileobj):
+    """
+    Second independent reader of the same upload (for gx:Track, see _track_whens).
+    """
+    if hasattr(fileobj, "temporary_file_path"):
+        return open(fileobj.temporary_file_path(), "rb")
+    raw = getattr(fileobj, "file", fileobj)
+    if hasattr(raw, "getvalue"):
+        return io.BytesIO(raw.getvalue())
+    path = getattr(raw, "name", None)
+    if isinstance(path, str) and os.path.exists(path):
+        return open(path, "rb")
+    raise TrackImportError("gx:Track import needs a file that can be read twice")
+
+
+def _track_whens(fileobj):
+    """
+    Yields (track_index, recorded_at) for every <when> of a gx:Track, in document order.
+
+    gx:Track lists all <when> before all <gx:coord>, so pairing them in one pass
+    means buffering the whole track. Instead the whens are read by a second
+    parser over the same file that runs in step with the first one.
+    """
+    reader = _reopen(fileobj)
+    track = 0
+    stack = []
+    try:
+        for event, elem in ET.iterparse(reader, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            tag = _local(elem.tag)
+            if tag == "when" and stack and _local(stack[-1].tag) == "Track":
+                yield track, _parse_time(elem.text)
+            elif tag == "Track":
+                track += 1
+            elem.clear()
+            if stack and tag in ("when", "coord", "Track", "Placemark"):
+                stack[-1].remove(elem)
+    except (ET.ParseError, DefusedXmlException) as e:
+        raise TrackImportError(f"Invalid XML: {e}")
+    finally:
+        reader.close()
+
+
+def _next_when(meta):
+    """
+    The <when> paired with the next <gx:coord> of the current track (None if the track has no more).
+    """
+    whens = meta.get("whens")
+    if whens is None:
+        whens = meta["whens"] = _track_whens(meta["fileobj"])
+    while True:
+        item = meta.pop("pending_when", None) or next(whens, None)
+        if item is None:
+            return None
+        if item[0] > meta["track"]:
+            # when следующего трека: придерживаем до его координат
+            meta["pending_when"] = item
+            return None
+        if item[0] == meta["track"]:
+            return item[1]
+        # лишние when уже пройденного трека пропускаем
+
+
+def _kml_end(elem, meta):
+    tag = _local(elem.tag)
+    if tag == "name" and "name" not in meta and elem.text:
+        meta["name"] = elem.text.strip()
+        return ()
+    if tag in ("begin", "end"):
+        meta[tag] = _parse_time(elem.text)
+        return ()
+    if tag == "Track":
+        meta["track"] += 1
+        return ()
+    if tag == "coord":
+        parts = (elem.text or "").split()
+        elem.clear()
+        if len(parts) < 2:
+            raise TrackImportError(f"Invalid gx:coord: {' '.join(parts)!r}")
+        lat = _coordinate(parts[1], 90, "latitude")
+        lng = _coordinate(parts[0], 180, "longitude")
+        recorded_at = _next_when(meta)
+        if recorded_at is None:
+            return ()
+        return ((lat, lng, None, "gps", recorded_at),)
+    if tag == "coordinates":
+        text = elem.text or ""
+        elem.clear()
+        # Point (метки) и полигоны — не трек
+        if meta["parent"] != "LineString":
+            return ()
+        return _kml_linestring(text, meta)
+    return ()
+
+
+def _kml_linestring(text, meta):
+    coords = []
+    for token in text.split():
+        parts = token.split(",")
+        if len(parts) < 2:
+            raise TrackImportError(f"Invalid coordinates: {token!r}")
+        coords.append((_coordinate(parts[1], 90, "latitude"), _coordinate(parts[0], 180, "longitude")))
+    if not coords:
+        return []
+
+    # У LineString нет времени по точкам: распределяем равномерно по TimeSpan.
+    # Без TimeSpan время взять неоткуда, а выдумывать его нельзя
+    start = meta.get("begin")
+    end = meta.get("end")
+    if start is None or (len(coords) > 1 and (end is None or end <= start)):
+        raise TrackImportError("LineString without a TimeSpan (begin and end) has no timestamps")
+    step = (end - start) / (len(coords) - 1) if len(coords) > 1 else timedelta(0)
+    return [(lat, lng, None, "gps", start + step * i) for i, (lat, lng) in enumerate(coords)]
+
+
+def parse_kml(fileobj, meta):
+    meta.update(fileobj=fileobj, track=0)
+    try:
+        yield from _iterparse(fileobj, _kml_end, ("when", "coord", "coordinates", "Track", "Placemark"), meta)
+    finally:
+        whens = meta.pop("whens", None)
+        if whens is not None:
+            whens.close()
+
+
+# -------------------------
+# NMEA 0183 ($--RMC sentences)
+# -------------------------
+def _nmea_checksum_ok(sentence):
+    if "*" not in sentence:
+        return True
+    body, checksum = sentence[1:].split("*", 1)
+    value = 0
+    for char in body:
+        value ^= ord(char)
+    try:
+        return value == int(checksum[:2], 16)
+    except ValueError:
+        return False
+
+
+def _nmea_coord(value, hemisphere, degree_digits):
+    if not value:
+        return None
+    degrees = float(value[:degree_digits])
+    minutes = float(value[degree_digits:])
+    coord = degrees + minutes / 60
+    limit = 90 if degree_digits == 2 else 180
+    return _coordinate(-coord if hemisphere in ("S", "W") else coord, limit, "NMEA coordinate")
+
+
+def parse_nmea(fileobj, meta):
+    # Битые предложения в логах NMEA обычны: такая строка пропускается, а не валит импорт
+    for raw in fileobj:
+        line = (raw.decode("ascii", "ignore") if isinstance(raw, bytes) else raw).strip()
+        if not line.startswith("$") or line[3:6] != "RMC" or not _nmea_checksum_ok(line):
+            continue
+        fields = line.split("*", 1)[0].split(",")
+        if len(fields) < 10 or fields[2] != "A":
+            continue
+        try:
+            lat = _nmea_coord(fields[3], fields[4], 2)
+            lng = _nmea_coord(fields[5], fields[6], 3)
+            speed = _speed(fields[7]) if fields[7] else None
+            if speed is not None:
+                speed *= KNOTS_TO_MS
+            recorded_at = datetime.strptime(fields[9] + fields[1][:6], "%d%m%y%H%M%S").replace(tzinfo=dt_timezone.utc)
+            if "." in fields[1]:
+                recorded_at += timedelta(seconds=float("0." + fields[1].split(".", 1)[1]))
+        except (ValueError, IndexError):
+            continue
+        if lat is None or lng is None:
+            continue
+        yield lat, lng, speed, "gps", recorded_at
+
+
+PARSERS = {"gpx": parse_gpx, "kml": parse_kml, "nmea": parse_nmea}
+
+
+def detect_format(filename, head=b""):
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if ext in FORMATS:
+        return ext
+    if ext in ("nma", "log", "txt"):
+        return "nmea"
+    if b"<gpx" in head:
+        return "gpx"
+    if b"<kml" in head:
+        return "kml"
+    if head.lstrip().startswith(b"$"):
+        return "nmea"
+    raise TrackImportError("Unknown track format, expected GPX, KML or NMEA")
+
+
+def _build_points(route, chunk):
+    from .models import NavigationPoint
+    return [
+        NavigationPoint(route=route, lat=lat, lng=lng, speed=speed, type=type_, recorded_at=recorded_at)
+        for lat, lng, speed, type_, recorded_at in chunk
+    ]
+
+
+def import_track(boat, fileobj, fmt, name=None, user=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Creates a NavigationRoute for the boat from a track file and returns it.
+    First/last points are typed start/end; start/end times and stats come from the track.
+
+    Every chunk is its own record_points() transaction, so the SQLite write lock
+    is not held for the whole file. Until the last chunk is in, the route stays
+    soft-deleted (hidden from the API and the live stream); if the import fails,
+    the partial route is deleted.
+    """
+    from .models import NavigationRoute
+    from .navigation import record_points
+
+    if fmt not in PARSERS:
+        raise TrackImportError(f"Unsupported format: {fmt}")
+
+    meta = {}
+    route = NavigationRoute.objects.create(
+        account=boat.account,
+        boat=boat,
+        name=name,
+        created_by=user,
+        updated_by=user,
+        deleted_at=timezone.now(),
+    )
+
+    try:
+        chunk = []
+        previous = None
+        first_at = None
+        for point in PARSERS[fmt](fileobj, meta):
+            if previous is not None:
+                chunk.append(previous)
+                if len(chunk) >= chunk_size:
+                    record_points(route, _build_points(route, chunk))
+                    chunk = []
+            else:
+                first_at = point[4]
+                point = point[:3] + ("start",) + point[4:]
+            previous = point
+
+        if previous is None:
+            raise TrackImportError("No track points found")
+
+        if previous[4] != first_at:
+            previous = previous[:3] + ("end",) + previous[4:]
+        chunk.append(previous)
+        record_points(route, _build_points(route, chunk))
+    except Exception:
+        route.delete()
+        raise
+
+    route.name = name or meta.get("name") or f"Import {route.first_recorded_at:%Y-%m-%d}"
+    route.start_time = route.first_recorded_at
+    route.end_time = route.last_recorded_at
+    route.deleted_at = None
+    route.save(update_fields=["name", "start_time", "end_time", "deleted_at", "updated_at"])
+
+    return route
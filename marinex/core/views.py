@@ -1,6 +1,8 @@
 from django.utils import timezone
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.authentication import SessionAuthentication
 from rest_framework import viewsets, permissions, serializers, generics
 from .serializers import TaskSerializer, TaskStatusSerializer, WorkSerializer, WorkStatusSerializer, \
     WorkCategorySerializer, TaskCategorySerializer, AccountCompanySerializer, CompanyServiceSerializer
@@ -25,18 +27,42 @@ from .serializers import (
     BoatAttachmentSerializer
 )
 
+from django.core import signing
 from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib.auth import get_user_model
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
+import asyncio
+import base64
+import math
+from django.utils.text import slugify
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.utils.urls import replace_query_param
+from datetime import datetime, time, timezone as dt_timezone
+from xml.sax.saxutils import escape
 from uuid import UUID
 from rest_framework import viewsets, status
-from .models import NavigationRoute, NavigationPoint
-from .serializers import NavigationRouteSerializer, NavigationPointSerializer
-import google.generativeai as genai
+from .models import NavigationRoute, NavigationPoint, NavigationRouteCell, ROUTE_CELL_PRECISION
+from .serializers import NavigationRouteSerializer, NavigationRouteSummarySerializer, NavigationPointSerializer
+from .navigation import RouteArchived, record_points
+from .track_import import TrackImportError, detect_format, import_track
+from .track_codec import TrackCodecError, decode_track_positions
+from . import ingest_buffer
+from .geohash import cover as geohash_cover
+from .live import get_broker, latest_position, load_events
+from .memberships import get_account_ids, get_memberships
+from .authentication import ClaimsJWTAuthentication
+from . import ai_cache, ai_jobs, document_ai, metrics
+from .models import DocumentAIJob
+from .serializers import DocumentAIJobSerializer
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.conf import settings
 import tempfile
+import threading
 import os
 import json
 
@@ -55,7 +81,9 @@ class UserProfileView(APIView):
     parser_classes = [JSONParser, MultiPartParser, FormParser]
 
     def get(self, request):
-        serializer = UserProfileSerializer(request.user)
+        # Для GET request.user — ClaimsUser из токена: профилю нужны все поля
+        user = User.objects.get(pk=request.user.pk)
+        serializer = UserProfileSerializer(user, context={"request": request})
         return Response(serializer.data)
 
     def patch(self, request):
@@ -72,7 +100,8 @@ class UserProfileView(APIView):
         serializer = UserProfileSerializer(
             user,
             data=request.data,
-            partial=True
+            partial=True,
+            context={"request": request}
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
@@ -125,39 +154,55 @@ class PortViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
 
 
+class BoatNestedMixin:
+    """
+    Для ViewSet'ов под /api/boats/<boat_pk>/...: лодка вместе с аккаунтом
+    проверяется по членствам пользователя одним запросом и запоминается на запросе.
+    Чужая или несуществующая лодка -> 404. get_route() — то же для /route/<route_id>/.
+    """
+    BOAT_REQUEST_ATTR = "_marinex_boats"
+
+    def get_boat(self):
+        boat_pk = self.kwargs.get('boat_pk')  # 'boat_pk' из-за nested-routers
+        target = getattr(self.request, "_request", self.request)
+        boats = target.__dict__.setdefault(self.BOAT_REQUEST_ATTR, {})
+        if boat_pk not in boats:
+            try:
+                # boat_pk приходит из URL как есть: не-UUID — такой лодки нет, а не 500
+                boat_id = UUID(str(boat_pk))
+            except ValueError:
+                raise NotFound("Boat not found")
+            boats[boat_pk] = Boat.objects.select_related('account').filter(
+                pk=boat_id, account_id__in=get_account_ids(self.request)
+            ).first()
+        if boats[boat_pk] is None:
+            raise NotFound("Boat not found")
+        return boats[boat_pk]
+
+    def get_route(self):
+        # Маршрут по route_id из URL (экспорт): только из аккаунтов пользователя
+        route = NavigationRoute.objects.filter(
+            pk=self.kwargs.get('route_id'), account_id__in=get_account_ids(self.request)
+        ).first()
+        if route is None:
+            raise NotFound("Route not found")
+        return route
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.kwargs.get('boat_pk'):
+            context['boat'] = self.get_boat()
+        return context
+
+
 # --- Endpoint: /api/boats/<boat_pk>/attachments/ ---
-class BoatAttachmentViewSet(viewsets.ModelViewSet):
+class BoatAttachmentViewSet(BoatNestedMixin, viewsets.ModelViewSet):
     serializer_class = BoatAttachmentSerializer
     permission_classes = [IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser)  # Для файлов
 
     def get_queryset(self):
-        # Этот ViewSet вложенный, boat_id придет из URL
-        boat_id = self.kwargs.get('boat_pk')  # 'boat_pk' из-за nested-routers
-        if not boat_id:
-            return BoatAttachment.objects.none()
-
-        # Убедимся, что пользователь имеет доступ к этой лодке
-        user_accounts_ids = UserAccount.objects.filter(
-            user=self.request.user
-        ).values_list('account_id', flat=True)
-
-        try:
-            boat = Boat.objects.get(pk=boat_id, account_id__in=user_accounts_ids)
-            return boat.attachments.all()
-        except Boat.DoesNotExist:
-            return BoatAttachment.objects.none()
-
-    def get_serializer_context(self):
-        # Передаем boat и request в сериализатор
-        context = super().get_serializer_context()
-        boat_id = self.kwargs.get('boat_pk')
-        try:
-            context['boat'] = Boat.objects.get(pk=boat_id)
-        except Boat.DoesNotExist:
-            pass  # Обработка ошибки будет в get_queryset
-        context['request'] = self.request
-        return context
+        return self.get_boat().attachments.all()
 
 
 class BoatViewSet(viewsets.ModelViewSet):
@@ -167,20 +212,22 @@ class BoatViewSet(viewsets.ModelViewSet):
     # Убрали parser_classes отсюда
 
     def get_queryset(self):
-        user = self.request.user
-        user_accounts_ids = UserAccount.objects.filter(
-            user=user
-        ).values_list('account_id', flat=True)
-        return Boat.objects.filter(account_id__in=user_accounts_ids)
+        user_accounts_ids = get_account_ids(self.request)
+        # Всё, что читает BoatSerializer: без этого по 4 запроса на каждую лодку списка
+        return (
+            Boat.objects.filter(account_id__in=user_accounts_ids)
+            .select_related("model__brand", "port", "province__country")
+            .prefetch_related("attachments")
+        )
 
     def perform_create(self, serializer):
-        user_account = UserAccount.objects.filter(user=self.request.user).first()
-        if not user_account:
+        account_id = get_memberships(self.request).primary_account_id
+        if not account_id:
             raise serializers.ValidationError(
                 "У вас нет аккаунта, к которому можно добавить лодку."
             )
         # Сохраняем лодку, привязав к аккаунту
-        serializer.save(account=user_account.account)
+        serializer.save(account_id=account_id)
 
 class DocumentCategoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = DocumentCategory.objects.all().order_by('level', 'name')
@@ -189,34 +236,23 @@ class DocumentCategoryViewSet(viewsets.ReadOnlyModelViewSet):
 
 # core/views.py
 
-class DocumentViewSet(viewsets.ModelViewSet):
+class DocumentViewSet(BoatNestedMixin, viewsets.ModelViewSet):
     serializer_class = DocumentSerializer
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser) # <-- ДОБАВЬТЕ ЭТУ СТРОКУ
 
     def get_queryset(self):
-        # Получаем boat_pk из URL
-        boat_pk = self.kwargs.get('boat_pk')
-        if not boat_pk:
-            return Document.objects.none()
-
-        # TODO: Добавить проверку безопасности, что пользователь
-        # имеет доступ к лодке (boat_pk)
-
-        return Document.objects.filter(boat_id=boat_pk).order_by('category__name', 'name')
+        boat = self.get_boat()
+        return (
+            Document.objects.filter(boat=boat)
+            .select_related('category', 'status', 'periodization')
+            .order_by('category__name', 'name')
+        )
 
     def perform_create(self, serializer):
-        boat_pk = self.kwargs.get('boat_pk')
-        try:
-            boat = Boat.objects.get(pk=boat_pk)
-        except Boat.DoesNotExist:
-            raise serializers.ValidationError("Лодка не найдена.")
-
-            # TODO: Добавить проверку безопасности
-
         serializer.save(
             created_by=self.request.user,
-            boat=boat
+            boat=self.get_boat()
         )
 
 
@@ -241,23 +277,15 @@ class TaskCategoryViewSet(viewsets.ReadOnlyModelViewSet):
         return qs
 
 
-class TaskViewSet(viewsets.ModelViewSet):
+class TaskViewSet(BoatNestedMixin, viewsets.ModelViewSet):
     serializer_class = TaskSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        boat_pk = self.kwargs.get('boat_pk')
-        if not boat_pk:
-            return Task.objects.none()
-
-        try:
-            boat = Boat.objects.select_related('account').get(pk=boat_pk)
-            account_id = boat.account.id
-        except Boat.DoesNotExist:
-            return Task.objects.none()
+        boat = self.get_boat()
 
         return Task.objects.filter(
-            models.Q(boat_id=boat_pk) | models.Q(account_id=account_id, boat__isnull=True)
+            models.Q(boat_id=boat.id) | models.Q(account_id=boat.account_id, boat__isnull=True)
         ).select_related(
             'status',
             'category',
@@ -265,11 +293,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         ).order_by('due_date')
 
     def perform_create(self, serializer):
-        boat_pk = self.kwargs.get('boat_pk')
-        try:
-            boat = Boat.objects.select_related('account').get(pk=boat_pk)
-        except Boat.DoesNotExist:
-            raise serializers.ValidationError("Лодка не найдена.")
+        boat = self.get_boat()
 
         serializer.save(
             created_by=self.request.user, # Si usas AuditModel o campos manuales en Task
@@ -292,26 +316,18 @@ class WorkStatusViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
 
-class WorkViewSet(viewsets.ModelViewSet):
+class WorkViewSet(BoatNestedMixin, viewsets.ModelViewSet):
     serializer_class = WorkSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        boat_pk = self.kwargs.get("boat_pk")
-        if not boat_pk:
-            return Work.objects.none()
-
-        # Ищем лодку + аккаунт
-        try:
-            boat = Boat.objects.select_related("account").get(pk=boat_pk)
-            account_id = boat.account.id
-        except Boat.DoesNotExist:
-            return Work.objects.none()
+        # Лодка + аккаунт (с проверкой доступа)
+        boat = self.get_boat()
 
         return (
             Work.objects.filter(
-                models.Q(boat_id=boat_pk) |
-                models.Q(account_id=account_id, boat__isnull=True)
+                models.Q(boat_id=boat.id) |
+                models.Q(account_id=boat.account_id, boat__isnull=True)
             )
             .select_related(
                 "status",
@@ -323,12 +339,7 @@ class WorkViewSet(viewsets.ModelViewSet):
         )
 
     def perform_create(self, serializer):
-        boat_pk = self.kwargs.get("boat_pk")
-
-        try:
-            boat = Boat.objects.select_related("account").get(pk=boat_pk)
-        except Boat.DoesNotExist:
-            raise serializers.ValidationError("Лодка не найдена.")
+        boat = self.get_boat()
 
         serializer.save(
             boat=boat,
@@ -382,16 +393,13 @@ class AccountCompanyViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        user_accounts_ids = UserAccount.objects.filter(user=user).values_list('account_id', flat=True)
+        user_accounts_ids = get_account_ids(self.request)
 
         return AccountCompany.objects.filter(account_id__in=user_accounts_ids).select_related('company')
 
     def perform_create(self, serializer):
         account = serializer.validated_data['account']
-        user_account = UserAccount.objects.filter(user=self.request.user, account=account).exists()
-
-        if not user_account:
+        if account.id not in get_memberships(self.request):
             raise serializers.ValidationError("Вы не являетесь участником этого аккаунта.")
 
         serializer.save(created_by=self.request.user)
@@ -406,7 +414,7 @@ class AccountViewSet(viewsets.ReadOnlyModelViewSet):
 
     def get_queryset(self):
         # Пользователь видит только свои аккаунты
-        return Account.objects.filter(account_users__user=self.request.user)
+        return Account.objects.filter(id__in=get_account_ids(self.request))
 
 
 class AccountUsersViewSet(viewsets.ReadOnlyModelViewSet):
@@ -435,33 +443,218 @@ class AccountUsersViewSet(viewsets.ReadOnlyModelViewSet):
 
         # 3. Validación de UUID: Evita el Error 500 si el formato es incorrecto
         try:
-            UUID(account_pk)
+            account_id = UUID(account_pk)
         except ValueError:
             return User.objects.none()
 
-        return User.objects.filter(user_accounts__account_id=account_pk).distinct()
+        # Только участники аккаунтов самого пользователя
+        if account_id not in get_memberships(self.request):
+            return User.objects.none()
+
+        return User.objects.filter(user_accounts__account_id=account_id).distinct()
 
 
 
-class NavigationRouteViewSet(viewsets.ModelViewSet):
+def parse_aware_datetime(value):
+    """
+    ISO datetime из query-параметра; без зоны считается в TIME_ZONE проекта.
+    None для пустого значения, ValueError для нераспознанного.
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def encode_points_cursor(recorded_at, key):
+    if isinstance(key, tuple):
+        key = ".".join(map(str, key))
+    raw = f"{recorded_at.isoformat()}|{key}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_points_cursor(value):
+    """
+    -> (recorded_at, key): key — UUID точки, позиция в треке архива
+    (index, offset, lat_e6, lng_e6) или порядковый номер точки архива (старые курсоры).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        recorded_raw, key = raw.rsplit("|", 1)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(value)
+    recorded_at = parse_aware_datetime(recorded_raw)
+    if recorded_at is None:
+        raise ValueError(value)
+    if "." in key:
+        return recorded_at, tuple(int(part) for part in key.split("."))
+    return recorded_at, int(key) if key.isdigit() else UUID(key)
+
+
+class NavigationRouteViewSet(BoatNestedMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = NavigationRouteSerializer
 
+    POINTS_PAGE_SIZE = 1000
+    POINTS_MAX_PAGE_SIZE = 5000
+
+    def get_serializer_class(self):
+        if self.action == "list":
+            return NavigationRouteSummarySerializer
+        return NavigationRouteSerializer
+
+    @action(detail=True, methods=["get"], url_path="points")
+    def points(self, request, *args, **kwargs):
+        """
+        Точки маршрута страницами: ?after=<ISO>&before=<ISO>&limit=<n>.
+        В ответе next — ссылка на следующую страницу с ?cursor=: ключ (recorded_at, id)
+        последней точки, поэтому точки с одинаковым временем не теряются на границе.
+        """
+        route = self.get_object()
+        params = request.query_params
+
+        try:
+            after = parse_aware_datetime(params.get("after"))
+            before = parse_aware_datetime(params.get("before"))
+            limit = int(params.get("limit", self.POINTS_PAGE_SIZE))
+        except ValueError:
+            raise serializers.ValidationError({"detail": "after/before must be ISO datetimes, limit an integer"})
+        limit = min(max(limit, 1), self.POINTS_MAX_PAGE_SIZE)
+
+        cursor = None
+        if params.get("cursor"):
+            try:
+                cursor = decode_points_cursor(params["cursor"])
+            except ValueError:
+                raise serializers.ValidationError({"detail": "Invalid cursor"})
+
+        if route.is_archived:
+            # У точек архива нет id: ключ — позиция декодера в треке, со следующей страницы
+            # декодирование продолжается с неё, а не с начала blob'а
+            position = None
+            if cursor and isinstance(cursor[1], tuple):
+                if len(cursor[1]) != 4:
+                    raise serializers.ValidationError({"detail": "Invalid cursor"})
+                position = cursor[1] + (cursor[0],)
+            window = []
+            try:
+                for key, (lat, lng, speed, p_type, recorded_at) in decode_track_positions(
+                    route.archived_track or b"", position
+                ):
+                    # старые курсоры: порядковый номер точки с нуля
+                    if cursor and isinstance(cursor[1], int) and key[0] - 1 <= cursor[1]:
+                        continue
+                    # курсор, выданный до архивации маршрута
+                    if cursor and isinstance(cursor[1], UUID) and recorded_at <= cursor[0]:
+                        continue
+                    if after and recorded_at <= after:
+                        continue
+                    if before and recorded_at >= before:
+                        break
+                    window.append((key, NavigationPoint(
+                        id=None, route=route, lat=lat, lng=lng, speed=speed, type=p_type, recorded_at=recorded_at,
+                    )))
+                    if len(window) > limit:
+                        break
+            except TrackCodecError:
+                if position is None:
+                    raise
+                raise serializers.ValidationError({"detail": "Invalid cursor"})
+        else:
+            qs = route.points.order_by("recorded_at", "id")
+            if cursor:
+                if not isinstance(cursor[1], UUID):
+                    raise serializers.ValidationError({"detail": "Invalid cursor"})
+                qs = qs.filter(
+                    models.Q(recorded_at__gt=cursor[0]) | models.Q(recorded_at=cursor[0], id__gt=cursor[1])
+                )
+            if after:
+                qs = qs.filter(recorded_at__gt=after)
+            if before:
+                qs = qs.filter(recorded_at__lt=before)
+            window = [(point.id, point) for point in qs[:limit + 1]]
+
+        has_more = len(window) > limit
+        window = window[:limit]
+
+        next_url = None
+        if has_more:
+            key, last = window[-1]
+            next_url = replace_query_param(
+                request.build_absolute_uri(), "cursor", encode_points_cursor(last.recorded_at, key)
+            )
+
+        return Response({
+            "next": next_url,
+            "results": NavigationPointSerializer([point for _, point in window], many=True).data,
+        })
+
+    @action(detail=False, methods=["post"], url_path="import", parser_classes=[MultiPartParser, FormParser])
+    def import_file(self, request, *args, **kwargs):
+        """
+        Импорт трека из файла (multipart: file, name?, format? = gpx|kml|nmea).
+        Файл разбирается потоково, точки пишутся пачками через record_points.
+        """
+        boat = self.get_boat()
+
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"error": "file is required"}, status=400)
+
+        try:
+            fmt = request.data.get("format")
+            if not fmt:
+                head = upload.read(512)
+                upload.seek(0)
+                fmt = detect_format(upload.name, head)
+            route = import_track(boat, upload, fmt.lower(), name=request.data.get("name") or None, user=request.user)
+        except TrackImportError as e:
+            return Response({"error": str(e)}, status=400)
+
+        return Response(NavigationRouteSummarySerializer(route).data, status=201)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action != "retrieve":
+            return context
+
+        # ?tolerance=<метры> или ?zoom=<уровень карты> -> упрощённый трек для карты
+        params = self.request.query_params
+        try:
+            if params.get("tolerance"):
+                context["simplify_tolerance"] = float(params["tolerance"])
+            elif params.get("zoom"):
+                context["simplify_zoom"] = float(params["zoom"])
+        except ValueError:
+            raise serializers.ValidationError({"detail": "tolerance and zoom must be numbers"})
+        # nan/inf проходят float(), но ломают math.floor в tolerance_bucket
+        for key in ("simplify_tolerance", "simplify_zoom"):
+            if key in context and not math.isfinite(context[key]):
+                raise serializers.ValidationError({"detail": "tolerance and zoom must be finite numbers"})
+        if "simplify_zoom" in context:
+            context["simplify_zoom"] = min(max(context["simplify_zoom"], 0), 24)
+        return context
+
     def get_queryset(self):
-        boat_id = self.kwargs.get("boat_pk")
-        return NavigationRoute.objects.filter(
-            account=self.request.user.user_accounts.first().account,
-            boat_id=boat_id,
+        queryset = NavigationRoute.objects.filter(
+            boat=self.get_boat(),
             deleted_at__isnull=True
         ).order_by("-created_at")
+        if self.action == "list":
+            # Сводка берётся из колонок статистики, blob архива не нужен
+            queryset = queryset.defer("archived_track")
+        return queryset
 
     def perform_create(self, serializer):
-        boat = Boat.objects.get(id=self.kwargs["boat_pk"])
-        account = self.request.user.user_accounts.first().account
+        boat = self.get_boat()
 
         serializer.save(
             boat=boat,
-            account=account,
+            account_id=boat.account_id,
             created_by=self.request.user,
             updated_by=self.request.user,
         )
@@ -472,10 +665,13 @@ class NavigationPointCreate(APIView):
 
     def post(self, request, route_id):
         try:
-            route = NavigationRoute.objects.get(id=route_id)
+            route = NavigationRoute.objects.get(id=route_id, account_id__in=get_account_ids(request))
         except NavigationRoute.DoesNotExist:
             return Response({"error": "Route not found"}, status=404)
 
+        if route.is_archived:
+            return Response({"error": "Route is archived"}, status=409)
+
         lat = request.data.get("lat")
         lng = request.data.get("lng")
         speed = request.data.get("speed", 0)
@@ -485,162 +681,773 @@ class NavigationPointCreate(APIView):
         if lat is None or lng is None:
             return Response({"error": "Lat/Lng required"}, status=400)
 
-        point = NavigationPoint.objects.create(
-            route=route,
-            lat=lat,
-            lng=lng,
-            speed=speed,
-            type=p_type,
-            recorded_at=timestamp or timezone.now()
-        )
+        serializer = NavigationPointSerializer(data={
+            "lat": lat,
+            "lng": lng,
+            "speed": speed,
+            "type": p_type,
+            "recorded_at": timestamp or timezone.now(),
+        })
+        serializer.is_valid(raise_exception=True)
+
+        if ingest_buffer.is_enabled():
+            try:
+                point_id, = ingest_buffer.get_buffer().submit(route.id, [serializer.validated_data])
+            except ingest_buffer.BufferFull:
+                return Response({"error": "Ingest queue is full, retry later"}, status=503)
+            return Response({"id": point_id, **serializer.data}, status=202)
+
+        point = NavigationPoint(route=route, **serializer.validated_data)
+        try:
+            record_points(route, [point])
+        except RouteArchived:
+            return Response({"error": "Route is archived"}, status=409)
 
         return Response(NavigationPointSerializer(point).data, status=201)
 
-class NavigationExportGPX(APIView):
+
+class NavigationPointBulkCreate(APIView):
+    """
+    Пакетная загрузка GPS-точек: клиент буферизует 30-60 фиксов и шлёт их одним запросом.
+    Маршрут и доступ проверяются один раз, валидные точки пишутся одной транзакцией.
+    """
     permission_classes = [IsAuthenticated]
 
-    def get(self, request, route_id):
-        route = NavigationRoute.objects.get(id=route_id)
-        points = route.points.all()
+    def post(self, request, route_id):
+        try:
+            route = NavigationRoute.objects.get(id=route_id, account_id__in=get_account_ids(request))
+        except NavigationRoute.DoesNotExist:
+            return Response({"error": "Route not found"}, status=404)
 
-        gpx = """<?xml version="1.0"?>
-<gpx version="1.1" creator="Marinex">
-<trk><name>{}</name><trkseg>
-""".format(route.name or route.id)
+        if route.is_archived:
+            return Response({"error": "Route is archived"}, status=409)
+
+        items = request.data.get("points") if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({"error": "A non-empty list of points is required"}, status=400)
+
+        max_points = getattr(settings, "NAVIGATION_BULK_MAX_POINTS", 1000)
+        if len(items) > max_points:
+            return Response({"error": f"Too many points, max {max_points} per request"}, status=400)
+
+        now = timezone.now()
+        results = []
+        valid = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results.append({"index": index, "status": "error", "errors": {"non_field_errors": ["Invalid point"]}})
+                continue
+
+            data = {
+                "lat": item.get("lat"),
+                "lng": item.get("lng"),
+                "speed": item.get("speed", 0),
+                "type": item.get("type", "gps"),
+                "recorded_at": item.get("recorded_at") or now,
+            }
+            serializer = NavigationPointSerializer(data=data)
+            if not serializer.is_valid():
+                results.append({"index": index, "status": "error", "errors": serializer.errors})
+                continue
 
-        for p in points:
-            gpx += f'<trkpt lat="{p.lat}" lon="{p.lng}"><speed>{p.speed or 0}</speed></trkpt>\n'
+            valid.append((index, serializer.validated_data))
 
-        gpx += "</trkseg></trk></gpx>"
+        if valid and ingest_buffer.is_enabled():
+            # Write-behind: точки в очереди, коммит сделает фоновый flusher
+            try:
+                ids = ingest_buffer.get_buffer().submit(route.id, [data for _, data in valid])
+            except ingest_buffer.BufferFull:
+                return Response({"error": "Ingest queue is full, retry later"}, status=503)
+            item_status, ok_status = "queued", status.HTTP_202_ACCEPTED
+        else:
+            to_create = [NavigationPoint(route=route, **data) for _, data in valid]
+            try:
+                record_points(route, to_create)
+            except RouteArchived:
+                return Response({"error": "Route is archived"}, status=409)
+            ids = [str(point.id) for point in to_create]
+            item_status, ok_status = "created", status.HTTP_201_CREATED
+
+        for (index, _), point_id in zip(valid, ids):
+            results.append({"index": index, "status": item_status, "id": point_id})
+        results.sort(key=lambda r: r["index"])
+
+        created = len(valid)
+        failed = len(items) - created
+        if not created:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif failed:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = ok_status
+
+        return Response({"created": created, "failed": failed, "results": results}, status=response_status)
+
+class NavigationIngestMetrics(APIView):
+    """
+    Состояние write-behind буфера: глубина очереди, задержка до коммита и т.д.
+    """
+    permission_classes = [IsAdminUser]
 
-        return Response(gpx, content_type="application/gpx+xml")
+    def get(self, request):
+        if not ingest_buffer.is_enabled():
+            return Response({"enabled": False})
+        return Response({"enabled": True, **ingest_buffer.get_buffer().metrics()})
 
 
-class NavigationExportKML(APIView):
+class NavigationAreaSearch(APIView):
+    """
+    GET /api/navigation/search/?bbox=minLng,minLat,maxLng,maxLat[&from=&to=&boat=&mode=routes|points]
+    Маршруты (или точки) аккаунтов пользователя, проходящие через bbox за окно времени.
+    Точки ищутся по geohash-индексу, поэтому стоимость зависит от bbox, а не от размера таблицы.
+    """
+    permission_classes = [IsAuthenticated]
+
+    MAX_POINTS = 10000
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            min_lng, min_lat, max_lng, max_lat = [float(v) for v in params.get("bbox", "").split(",")]
+        except ValueError:
+            return Response({"error": "bbox=minLng,minLat,maxLng,maxLat is required"}, status=400)
+        if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= max_lng <= 180):
+            return Response({"error": "Invalid bbox"}, status=400)
+
+        try:
+            since = parse_aware_datetime(params.get("from"))
+            until = parse_aware_datetime(params.get("to"))
+        except ValueError:
+            return Response({"error": "from/to must be ISO datetimes"}, status=400)
+
+        mode = params.get("mode", "routes")
+        if mode not in ("routes", "points"):
+            return Response({"error": "mode must be 'routes' or 'points'"}, status=400)
+
+        routes = NavigationRoute.objects.filter(account_id__in=get_account_ids(request))
+        if params.get("boat"):
+            try:
+                routes = routes.filter(boat_id=UUID(params["boat"]))
+            except ValueError:
+                return Response({"error": "boat must be a UUID"}, status=400)
+
+        # Живые точки: диапазоны geohash из покрытия bbox + точная проверка координат.
+        # Ячейки архивных маршрутов короче: ячейка пересекает [start, end),
+        # если она < end и >= start, обрезанного до её длины
+        cover = models.Q()
+        cell_cover = models.Q()
+        for start, end in geohash_cover(min_lat, min_lng, max_lat, max_lng):
+            rng = models.Q(geohash__gte=start)
+            cell_rng = models.Q(geohash__gte=start[:ROUTE_CELL_PRECISION])
+            if end is not None:
+                rng &= models.Q(geohash__lt=end)
+                cell_rng &= models.Q(geohash__lt=end)
+            cover |= rng
+            cell_cover |= cell_rng
+        points = NavigationPoint.objects.filter(
+            cover,
+            lat__gte=min_lat, lat__lte=max_lat,
+            lng__gte=min_lng, lng__lte=max_lng,
+            route__in=routes.filter(archived_at__isnull=True),
+        )
+        if since:
+            points = points.filter(recorded_at__gte=since)
+        if until:
+            points = points.filter(recorded_at__lte=until)
+
+        # Архивные маршруты: отбор по bbox и ячейкам geohash маршрута,
+        # декодируется трек только оставшихся кандидатов
+        archived = routes.filter(
+            archived_at__isnull=False,
+            min_lat__lte=max_lat, max_lat__gte=min_lat,
+            min_lng__lte=max_lng, max_lng__gte=min_lng,
+            id__in=NavigationRouteCell.objects.filter(cell_cover).values("route_id"),
+        )
+        if since:
+            archived = archived.filter(last_recorded_at__gte=since)
+        if until:
+            archived = archived.filter(first_recorded_at__lte=until)
+
+        def inside(lat, lng, recorded_at):
+            return (
+                min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+                and (since is None or recorded_at >= since)
+                and (until is None or recorded_at <= until)
+            )
+
+        if mode == "routes":
+            route_ids = set(points.order_by().values_list("route_id", flat=True).distinct())
+            for route in archived:
+                if any(inside(lat, lng, t) for lat, lng, _, _, t in route.iter_track()):
+                    route_ids.add(route.id)
+            found = routes.filter(id__in=route_ids).defer("archived_track").order_by("-start_time")
+            return Response(NavigationRouteSummarySerializer(found, many=True).data)
+
+        # Без ORDER BY, чтобы планировщик шёл по geohash-индексу, а не по recorded_at
+        results = []
+        for point in points.order_by()[:self.MAX_POINTS + 1]:
+            data = NavigationPointSerializer(point).data
+            data["route"] = str(point.route_id)
+            results.append(data)
+        for route in archived:
+            if len(results) > self.MAX_POINTS:
+                break
+            for point in route.get_points():
+                if inside(point.lat, point.lng, point.recorded_at):
+                    data = NavigationPointSerializer(point).data
+                    data["route"] = str(route.id)
+                    results.append(data)
+
+        truncated = len(results) > self.MAX_POINTS
+        results = sorted(results[:self.MAX_POINTS], key=lambda p: p["recorded_at"])
+        return Response({"truncated": truncated, "results": results})
+
+
+LIVE_REPLAY_LIMIT = 5000
+
+
+LIVE_TICKET_MAX_AGE_S = 60
+LIVE_TICKET_SALT = "marinex.live-ticket"
+
+
+class NavigationLiveTicket(APIView):
+    """
+    POST /api/navigation/route/<id>/live/ticket/ -> {"ticket": ...}
+    EventSource не умеет слать заголовки, а JWT в ?token= оседает в логах доступа.
+    Поэтому поток открывается по короткоживущему подписанному билету на один маршрут.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, route_id):
+        route = NavigationRoute.objects.filter(id=route_id, account_id__in=get_account_ids(request)).first()
+        if route is None:
+            raise NotFound("Route not found")
+        ticket = signing.dumps({"user": str(request.user.pk), "route": str(route.id)}, salt=LIVE_TICKET_SALT)
+        return Response({"ticket": ticket, "expires_in": LIVE_TICKET_MAX_AGE_S})
+
+
+def _authenticate_stream_request(request, route_id):
+    """
+    JWT из заголовка Authorization или ?ticket= от NavigationLiveTicket.
+    """
+    from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+    from .authentication import ClaimsJWTAuthentication
+
+    if request.GET.get("ticket"):
+        try:
+            payload = signing.loads(request.GET["ticket"], salt=LIVE_TICKET_SALT, max_age=LIVE_TICKET_MAX_AGE_S)
+        except signing.BadSignature:
+            return None
+        if payload.get("route") != str(route_id):
+            return None
+        return get_user_model().objects.filter(pk=payload.get("user"), is_active=True).first()
+
+    auth = ClaimsJWTAuthentication()
+    try:
+        header = auth.get_header(request)
+        raw_token = auth.get_raw_token(header) if header else None
+        if raw_token is None:
+            return None
+        return auth.get_claims_user(auth.get_validated_token(raw_token))
+    except (InvalidToken, TokenError):
+        return None
+
+
+def _get_stream_route(request, user, route_id):
+    user_accounts_ids = get_memberships(request, user).account_ids
+    return NavigationRoute.objects.filter(id=route_id, account_id__in=user_accounts_ids).first()
+
+
+def _parse_stream_position(value):
+    """
+    since / Last-Event-ID: id события (курсор точки) или ISO datetime -> (recorded_at, point_id).
+    """
+    try:
+        recorded_at, key = decode_points_cursor(value)
+        return recorded_at, key if isinstance(key, UUID) else None
+    except ValueError:
+        return parse_aware_datetime(value), None
+
+
+async def navigation_live_stream(request, route_id):
+    """
+    SSE: /api/navigation/route/<id>/live/?ticket=<билет>&since=<ISO>
+    Сначала отдаёт сохранённые точки после since (или Last-Event-ID), затем новые по мере приёма.
+    Требует ASGI-сервер (marinex/asgi.py): под WSGI бесконечный ответ занял бы воркер целиком.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Live streaming requires an ASGI server"}, status=503)
+
+    user = await sync_to_async(_authenticate_stream_request)(request, route_id)
+    if user is None:
+        return JsonResponse({"error": "Authentication required"}, status=401)
+
+    route = await sync_to_async(_get_stream_route)(request, user, route_id)
+    if route is None:
+        return JsonResponse({"error": "Route not found"}, status=404)
+
+    since_raw = request.GET.get("since") or request.headers.get("Last-Event-ID")
+    try:
+        since, since_id = _parse_stream_position(since_raw) if since_raw else (None, None)
+    except ValueError:
+        return JsonResponse({"error": "since must be an ISO datetime or an event id"}, status=400)
+
+    keepalive = getattr(settings, "NAVIGATION_LIVE_KEEPALIVE_S", 15)
+
+    def format_event(recorded_at, point_id, data):
+        event_id = encode_points_cursor(recorded_at, point_id) if point_id else recorded_at.isoformat()
+        return f"id: {event_id}\nevent: point\ndata: {data}\n\n"
+
+    async def events():
+        if since is not None:
+            subscription = get_broker().subscribe(route.id, since, since_id)
+        else:
+            # С последней сохранённой точки по (время, id): точки с тем же временем, принятые позже, не теряются
+            subscription = get_broker().subscribe(route.id, *await sync_to_async(latest_position)(route))
+        try:
+            # Точки из догонки могут прийти и от брокера: пропускаем их по id, а не по времени
+            replayed = set()
+            if since is not None:
+                for recorded_at, point_id, data in await sync_to_async(load_events)(
+                    route.id, since, LIVE_REPLAY_LIMIT, since_id
+                ):
+                    replayed.add(point_id)
+                    yield format_event(recorded_at, point_id, data)
+
+            while True:
+                try:
+                    recorded_at, point_id, data = await subscription.get(keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if point_id in replayed:
+                    continue
+                yield format_event(recorded_at, point_id, data)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def _format_point_time(value):
+    return value.astimezone(dt_timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+# В GPX 1.1 у trkpt нет <speed>: скорость кладём в Garmin TrackPointExtension
+GPX_TRACKPOINT_EXTENSION_NS = "http://www.garmin.com/xmlschemas/TrackPointExtension/v2"
+
+
+def _gpx_speed_extension(speed):
+    if speed is None:
+        return ""
+    return f"<extensions><gpxtpx:TrackPointExtension><gpxtpx:speed>{speed}</gpxtpx:speed>" \
+           "</gpxtpx:TrackPointExtension></extensions>"
+
+
+def _export_filename(route, ext):
+    name = slugify(route.name or "") or str(route.id)
+    return f"{name}.{ext}"
+
+
+class NavigationExportGPX(BoatNestedMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, route_id):
-        route = NavigationRoute.objects.get(id=route_id)
-        points = route.points.all()
+        route = self.get_route()
+        response = StreamingHttpResponse(self.stream(route), content_type="application/gpx+xml")
+        response["Content-Disposition"] = f'attachment; filename="{_export_filename(route, "gpx")}"'
+        return response
+
+    def stream(self, route):
+        yield (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<gpx version="1.1" creator="Marinex" xmlns="http://www.topografix.com/GPX/1/1"'
+            f' xmlns:gpxtpx="{GPX_TRACKPOINT_EXTENSION_NS}">\n'
+            f"<trk><name>{escape(str(route.name or route.id))}</name><trkseg>\n"
+        )
 
-        kml = """<?xml version="1.0" encoding="UTF-8"?>
-<kml xmlns="http://www.opengis.net/kml/2.2"><Document>
-<Placemark><LineString><coordinates>
-"""
+        buffer = []
+        for lat, lng, speed, p_type, recorded_at in route.iter_track(chunk_size=EXPORT_CHUNK_SIZE):
+            buffer.append(
+                f'<trkpt lat="{lat}" lon="{lng}"><time>{_format_point_time(recorded_at)}</time>'
+                f"{_gpx_speed_extension(speed)}</trkpt>\n"
+            )
+            if len(buffer) >= EXPORT_CHUNK_SIZE:
+                yield "".join(buffer)
+                buffer = []
+        if buffer:
+            yield "".join(buffer)
 
-        for p in points:
-            kml += f"{p.lng},{p.lat},0\n"
+        yield "</trkseg></trk></gpx>\n"
 
-        kml += "</coordinates></LineString></Placemark></Document></kml>"
 
-        return Response(kml, content_type="application/vnd.google-earth.kml+xml")
+class NavigationExportKML(BoatNestedMixin, APIView):
+    permission_classes = [IsAuthenticated]
 
+    def get(self, request, route_id):
+        route = self.get_route()
+        response = StreamingHttpResponse(
+            self.stream(route), content_type="application/vnd.google-earth.kml+xml"
+        )
+        response["Content-Disposition"] = f'attachment; filename="{_export_filename(route, "kml")}"'
+        return response
+
+    def stream(self, route):
+        time_span = ""
+        if route.start_time or route.end_time:
+            time_span = "<TimeSpan>"
+            if route.start_time:
+                time_span += f"<begin>{_format_point_time(route.start_time)}</begin>"
+            if route.end_time:
+                time_span += f"<end>{_format_point_time(route.end_time)}</end>"
+            time_span += "</TimeSpan>"
+
+        yield (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n'
+            f"<Placemark><name>{escape(str(route.name or route.id))}</name>{time_span}"
+            "<LineString><coordinates>\n"
+        )
 
-genai.configure(api_key=settings.GEMINI_API_KEY)
+        buffer = []
+        for lat, lng, speed, p_type, recorded_at in route.iter_track(chunk_size=EXPORT_CHUNK_SIZE):
+            buffer.append(f"{lng},{lat},0\n")
+            if len(buffer) >= EXPORT_CHUNK_SIZE:
+                yield "".join(buffer)
+                buffer = []
+        if buffer:
+            yield "".join(buffer)
 
+        yield "</coordinates></LineString></Placemark></Document></kml>\n"
 
-class DocumentAIAnalyze(APIView):
+
+class DocumentAIJobCreate(APIView):
+    """
+    POST /api/ai/jobs/ (multipart: file) — ставит документ в очередь анализа и сразу
+    возвращает id задания. Обрабатывают воркеры `manage.py run_ai_worker`.
+    """
     permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
 
     def post(self, request):
         uploaded = request.FILES.get("file")
         if not uploaded:
             return Response({"error": "No file provided"}, status=400)
 
-        # Save temp file
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            for chunk in uploaded.chunks():
-                tmp.write(chunk)
-            tmp_path = tmp.name
+        job = ai_jobs.submit_job(uploaded, user=request.user)
+        return Response(DocumentAIJobSerializer(job).data, status=202)
+
+
+class DocumentAIJobDetail(APIView):
+    """
+    GET /api/ai/jobs/<id>/ — статус задания; в result тот же JSON, что у analyze-document.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = DocumentAIJob.objects.filter(id=job_id, created_by_id=request.user.pk).first()
+        if job is None:
+            return Response({"error": "Job not found"}, status=404)
+        return Response(DocumentAIJobSerializer(job).data)
 
-        try:
-            # Upload to Gemini
-            file_obj = genai.upload_file(
-                tmp_path,
-                mime_type=uploaded.content_type or "application/octet-stream"
-            )
 
-            # Load categories (convert UUID to string)
-            categories = DocumentCategory.objects.all().order_by("level", "name")
-            categories_json = [
-                {
-                    "id": str(c.id),
-                    "name": c.name,
-                    "parent": str(c.parent_id) if c.parent_id else None,
-                    "level": c.level,
-                }
-                for c in categories
-            ]
+class DocumentAICacheStats(APIView):
+    """
+    Счётчики кэша результатов AI-анализа (hits/misses только этого воркера, total_hits и записи — из БД)
+    и размер промпта с компактным каталогом категорий.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({**ai_cache.stats(), "prompt": document_ai.catalog_sizes()})
+
+
+AI_SLOT_POLL_S = 0.05
+
+_ai_slots = None
+_ai_slots_lock = threading.Lock()
+
+
+def _ai_slot_semaphore():
+    # Один семафор на процесс, а не на event loop: под ASGI у каждого запроса может быть свой loop
+    global _ai_slots
+    if _ai_slots is None:
+        with _ai_slots_lock:
+            if _ai_slots is None:
+                _ai_slots = threading.BoundedSemaphore(getattr(settings, "DOCUMENT_AI_MAX_CONCURRENCY", 4))
+    return _ai_slots
+
+
+class _AISlot:
+    """
+    One acquired slot of DOCUMENT_AI_MAX_CONCURRENCY; release() is safe to call more than once.
+    """
 
-            model = genai.GenerativeModel("gemini-2.5-pro")
+    def __init__(self, semaphore):
+        self._semaphore = semaphore
+        self._lock = threading.Lock()
+        self._held = True
 
-            system_prompt = f"""
-            Eres un asistente experto en documentación náutica.
+    def release(self):
+        with self._lock:
+            if not self._held:
+                return
+            self._held = False
+        self._semaphore.release()
 
-            Aquí tienes la lista completa de categorías:
 
-            {json.dumps(categories_json, indent=2)}
+async def _acquire_ai_slot(timeout):
+    # threading-семафор нельзя ждать в loop: опрашиваем без блокировки. None — слот не освободился за timeout
+    semaphore = _ai_slot_semaphore()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not semaphore.acquire(blocking=False):
+        if loop.time() >= deadline:
+            return None
+        await asyncio.sleep(AI_SLOT_POLL_S)
+    return _AISlot(semaphore)
 
-            Debes ANALIZAR el documento adjunto y devolver SIEMPRE un JSON válido:
 
-            {{
-              "name": "string",
-              "category_id": "uuid" o null,
-              "subcategory_id": "uuid" o null,
-              "expiration_date": "YYYY-MM-DD" o null,
-              "no_expiration": true o false,
-              "notes": "string"
-            }}
+def _start_model_call(slot, tmp_path, mime_type, prompt):
+    """
+    Calls the model in its own thread and returns an asyncio future for the raw answer.
+    The thread owns the slot and the temp file and frees them when the call really
+    ends, so a request that timed out does not let another call start meanwhile.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def deliver(raw, error):
+        # Запрос мог уже сдаться по таймауту
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(raw)
+
+    def run():
+        raw = error = None
+        try:
+            raw = document_ai.get_client().analyze(tmp_path, mime_type, prompt)
+        except Exception as e:
+            error = e
+        finally:
+            slot.release()
+            os.remove(tmp_path)
+        try:
+            loop.call_soon_threadsafe(deliver, raw, error)
+        except RuntimeError:
+            pass  # loop запроса уже закрыт
 
-            REGLAS SOBRE EL NOMBRE:
-            - El nombre debe ser corto y genérico (por ejemplo: "Seguro de Responsabilidad Civil").
-            - NO incluyas números, códigos, pólizas ni fechas en el nombre.
+    threading.Thread(target=run, name="document-ai", daemon=True).start()
+    return future
 
-            REGLAS SOBRE CATEGORÍAS:
-            - category_id = categoría con level = 0
-            - subcategory_id = categoría cuyo parent coincide con category_id
 
-            REGLAS SOBRE FECHAS (MUY IMPORTANTE):
-            - Las fechas dentro del documento están SIEMPRE en formato español: **DD/MM/YYYY**.
-            - NO interpretes nunca las fechas como formato americano **MM/DD/YYYY**.
-            - Si lees por ejemplo "15/01/2028", significa **15 de enero de 2028**, NO diciembre.
-            - Debes convertir la fecha encontrada a formato ISO: "YYYY-MM-DD".
-            - NO reordenes ni intercambies día y mes bajo ninguna circunstancia.
+def _save_upload_to_temp(uploaded):
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        for chunk in uploaded.chunks():
+            tmp.write(chunk)
+        return tmp.name
 
-            REGLAS GENERALES:
-            - NO uses ```json ni bloques de código.
-            - Devuelve SOLO un JSON limpio, sin texto adicional.
-            """
 
-            response = model.generate_content([system_prompt, file_obj])
+def _authenticate_api_request(request):
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+    from .authentication import ClaimsJWTAuthentication
 
-            raw = response.text.strip()
+    try:
+        result = ClaimsJWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+    return result[0] if result else None
 
-            # Remove ```json fences if AI returns them
-            if raw.startswith("```"):
-                raw = raw.replace("```json", "")
-                raw = raw.replace("```", "")
-                raw = raw.strip()
 
+async def _analyze_upload(uploaded, timeout, slot):
+    """
+    Cleaned analysis of one uploaded file (cache or model); always releases the slot.
+    Raises asyncio.TimeoutError or document_ai.DocumentAIError.
+    """
+    tmp_path = None
+    started = False
+    try:
+        tmp_path = await asyncio.to_thread(_save_upload_to_temp, uploaded)
+        prepared = await sync_to_async(document_ai.prepare_analysis)(tmp_path)
+        if prepared.cached is not None:
+            # Тот же файл с теми же категориями и промптом уже анализировался
+            return prepared.cached
+
+        # Поток не прервать: по таймауту ответ клиенту уходит сразу, вызов модели дорабатывает
+        # в фоне и держит слот до конца
+        future = _start_model_call(slot, tmp_path, uploaded.content_type or "application/octet-stream", prepared.prompt)
+        started = True
+        raw = await asyncio.wait_for(future, timeout)
+
+        cleaned = document_ai.clean_response(raw, prepared.catalog)
+        await sync_to_async(document_ai.store_result)(prepared, cleaned)
+        return cleaned
+    finally:
+        if not started:
+            slot.release()
+            if tmp_path is not None:
+                os.remove(tmp_path)
+
+
+@csrf_exempt
+async def document_ai_analyze(request):
+    """
+    POST /api/ai/analyze-document/ (multipart: file)
+    Асинхронная view (ASGI): вызов модели идёт в отдельном потоке, не блокируя event loop,
+    не больше DOCUMENT_AI_MAX_CONCURRENCY вызовов на процесс (слот держится, пока вызов
+    действительно не завершится) и не дольше DOCUMENT_AI_TIMEOUT_S ожидания.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    user = await sync_to_async(_authenticate_api_request)(request)
+    if user is None:
+        return JsonResponse({"error": "Authentication required"}, status=401)
+
+    uploaded = await sync_to_async(lambda: request.FILES.get("file"))()
+    if not uploaded:
+        return JsonResponse({"error": "No file provided"}, status=400)
+
+    timeout = getattr(settings, "DOCUMENT_AI_TIMEOUT_S", 90)
+    slot = await _acquire_ai_slot(timeout)
+    if slot is None:
+        return JsonResponse({"error": "AI service is busy, try again later"}, status=503)
+
+    try:
+        return JsonResponse(await _analyze_upload(uploaded, timeout, slot))
+
+    except document_ai.DocumentAIError as e:
+        return JsonResponse({
+            "error": "AI returned invalid JSON",
+            "exception": str(e),
+            "raw": e.raw
+        }, status=500)
+
+    except asyncio.TimeoutError:
+        return JsonResponse({"error": "AI analysis timed out"}, status=504)
+
+
+def _create_analyzed_document(boat, user, uploaded, result):
+    expiration_date = None
+    if result.get("expiration_date"):
+        day = parse_date(str(result["expiration_date"]))
+        if day:
+            expiration_date = timezone.make_aware(datetime.combine(day, time.min))
+
+    document = Document.objects.create(
+        boat=boat,
+        name=result.get("name") or uploaded.name,
+        category_id=result.get("subcategory_id") or result.get("category_id"),
+        expiration_date=expiration_date,
+        no_expiration=result.get("no_expiration", False),
+        notes=result.get("notes") or None,
+        file=uploaded,
+        created_by=user,
+        updated_by=user,
+    )
+    return str(document.id)
+
+
+def _batch_concurrency():
+    # Пакет не занимает все слоты процесса: одиночные анализы не ждут конца чужого пакета
+    max_concurrency = getattr(settings, "DOCUMENT_AI_MAX_CONCURRENCY", 4)
+    return max(1, min(getattr(settings, "DOCUMENT_AI_BATCH_CONCURRENCY", 4), max_concurrency - 1))
+
+
+@csrf_exempt
+async def document_ai_analyze_batch(request):
+    """
+    POST /api/ai/analyze-batch/ (multipart: files[]; boat=<id> — сразу создать Document для лодки)
+    Файлы анализируются параллельно (не больше DOCUMENT_AI_BATCH_CONCURRENCY на пакет и
+    DOCUMENT_AI_MAX_CONCURRENCY на процесс; один пакет всегда оставляет слот другим запросам);
+    результаты уходят NDJSON-строками по мере готовности:
+    {"index", "filename", "status": "ok"|"error", "result"|"error", "document_id"?}, в конце {"done": true, ...}.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    user = await sync_to_async(_authenticate_api_request)(request)
+    if user is None:
+        return JsonResponse({"error": "Authentication required"}, status=401)
+
+    files = await sync_to_async(lambda: request.FILES.getlist("files"))()
+    if not files:
+        return JsonResponse({"error": "No files provided"}, status=400)
+    max_files = getattr(settings, "DOCUMENT_AI_BATCH_MAX_FILES", 50)
+    if len(files) > max_files:
+        return JsonResponse({"error": f"Too many files, max {max_files}"}, status=400)
+
+    boat = None
+    boat_id = request.POST.get("boat")
+    if boat_id:
+        boat = await sync_to_async(
+            lambda: Boat.objects.filter(id=boat_id, account_id__in=get_memberships(request, user).account_ids).first()
+        )()
+        if boat is None:
+            return JsonResponse({"error": "Boat not found"}, status=404)
+
+    timeout = getattr(settings, "DOCUMENT_AI_TIMEOUT_S", 90)
+    batch_semaphore = asyncio.Semaphore(_batch_concurrency())
+
+    async def analyze(index, uploaded):
+        line = {"index": index, "filename": uploaded.name}
+        async with batch_semaphore:
+            slot = await _acquire_ai_slot(timeout)
+            if slot is None:
+                return {**line, "status": "error", "error": "AI service is busy, try again later"}
             try:
-                data = json.loads(raw)
+                result = await _analyze_upload(uploaded, timeout, slot)
+            except document_ai.DocumentAIError as e:
+                return {**line, "status": "error", "error": "AI returned invalid JSON", "exception": str(e)}
+            except asyncio.TimeoutError:
+                return {**line, "status": "error", "error": "AI analysis timed out"}
             except Exception as e:
-                return Response({
-                    "error": "AI returned invalid JSON",
-                    "exception": str(e),
-                    "raw": raw
-                }, status=500)
-
-            cleaned = {
-                "name": data.get("name", ""),
-                "category_id": str(data["category_id"]) if data.get("category_id") else None,
-                "subcategory_id": str(data["subcategory_id"]) if data.get("subcategory_id") else None,
-                "expiration_date": data.get("expiration_date"),
-                "no_expiration": bool(data.get("no_expiration", False)),
-                "notes": data.get("notes", "")
-            }
+                return {**line, "status": "error", "error": str(e)}
 
-            return Response(cleaned)
+        line.update(status="ok", result=result)
+        if boat is not None:
+            try:
+                line["document_id"] = await sync_to_async(_create_analyzed_document)(boat, user, uploaded, result)
+            except Exception as e:
+                # Анализ удался, документ нет: строка об ошибке, а не оборванный поток
+                return {**line, "status": "error", "error": "Document could not be created", "exception": str(e)}
+        return line
 
+    async def stream():
+        ok = 0
+        tasks = [asyncio.ensure_future(analyze(i, f)) for i, f in enumerate(files)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                line = await finished
+                ok += line["status"] == "ok"
+                yield json.dumps(line) + "\n"
         finally:
-            os.remove(tmp_path)
+            for task in tasks:
+                task.cancel()
+        yield json.dumps({"done": True, "total": len(files), "ok": ok, "failed": len(files) - ok}) + "\n"
+
+    response = StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+class MetricsView(APIView):
+    """
+    GET /metrics - метрики запросов по эндпоинтам в формате Prometheus (core/metrics.py).
+    Только staff: JWT или сессия админки.
+    """
+    authentication_classes = [ClaimsJWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -3,6 +3,10 @@ ASGI config for marinex project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Live route streaming (/api/navigation/route/<id>/live/) needs this entry point,
+and document analysis (/api/ai/analyze-document/) only stops tying up a worker
+per upload when served from it, e.g. ``gunicorn -k uvicorn.workers.UvicornWorker marinex.asgi:application``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -27,11 +27,21 @@ from core.views import (
     AccountViewSet,
     AccountUsersViewSet,
     AccountCompanyViewSet,
-    DocumentAIAnalyze,
+    document_ai_analyze,
+    document_ai_analyze_batch,
+    DocumentAIJobCreate,
+    DocumentAIJobDetail,
+    DocumentAICacheStats,
     NavigationRouteViewSet,
     NavigationPointCreate,
+    NavigationPointBulkCreate,
     NavigationExportGPX,
-    NavigationExportKML
+    NavigationExportKML,
+    navigation_live_stream,
+    NavigationLiveTicket,
+    NavigationAreaSearch,
+    NavigationIngestMetrics,
+    MetricsView,
 )
 
 router = routers.DefaultRouter()
@@ -60,6 +70,7 @@ accounts_router.register(r'users', AccountUsersViewSet, basename='account-users'
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", MetricsView.as_view(), name="metrics"),
 
     path("api/register/", AccountRegistrationView.as_view(), name="register"),
     path("api/me/", UserProfileView.as_view(), name="user-profile"),
@@ -69,9 +80,18 @@ urlpatterns = [
     path("api/", include(router.urls)),
     path("api/", include(boats_router.urls)),
     path("api/", include(accounts_router.urls)),
-    path("api/ai/analyze-document/", DocumentAIAnalyze.as_view()),
+    path("api/ai/analyze-document/", document_ai_analyze),
+    path("api/ai/analyze-batch/", document_ai_analyze_batch),
+    path("api/ai/jobs/", DocumentAIJobCreate.as_view()),
+    path("api/ai/jobs/<uuid:job_id>/", DocumentAIJobDetail.as_view()),
+    path("api/ai/cache/stats/", DocumentAICacheStats.as_view()),
 
+    path("api/navigation/search/", NavigationAreaSearch.as_view()),
+    path("api/navigation/ingest/metrics/", NavigationIngestMetrics.as_view()),
     path("api/navigation/route/<uuid:route_id>/point/", NavigationPointCreate.as_view()),
+    path("api/navigation/route/<uuid:route_id>/point/bulk/", NavigationPointBulkCreate.as_view()),
+    path("api/navigation/route/<uuid:route_id>/live/", navigation_live_stream),
+    path("api/navigation/route/<uuid:route_id>/live/ticket/", NavigationLiveTicket.as_view()),
     path("api/navigation/route/<uuid:route_id>/export/gpx/", NavigationExportGPX.as_view()),
     path("api/navigation/route/<uuid:route_id>/export/kml/", NavigationExportKML.as_view()),
 ]